@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+"""
+Retention for arp_table.
+
+Rows for devices not seen for a number of days are moved out of the live
+table, as are rows superseded by a newer row for the same MAC (left over
+from before devices were identified by MAC), so update_network_info.py only
+reconciles devices that are actually around.
+
+Rows go to the arp_archive table (ROW_FORMAT=COMPRESSED) or, with
+--archive-file, are appended to a gzip compressed JSON-lines file.  Work is
+done in small batches by primary key, each in its own short transaction,
+with a pause in between, so the live table is never locked for long and an
+interrupted run simply continues next time.
+
+Entries in the arp_changes log older than a day are deleted as well.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import sys
+import time
+
+from network_db import db, DatabaseError, change_log_sql
+
+DEFAULT_DAYS = 30
+DEFAULT_BATCH = 500
+DEFAULT_PAUSE = 0.2
+
+# arp_changes entries are only needed until followers have read them.
+CHANGE_LOG_DAYS = 1
+
+COLUMNS = ('id', 'ip_address', 'hw_address', 'created_at', 'state', 'hostname', 'ip_int', 'last_seen')
+
+def run_sql(sql_commands):
+    """
+    Run SQL against network_info
+    Returns the result rows (lists of strings), or None on error
+    """
+    try:
+        return db.run(sql_commands)
+    except DatabaseError as e:
+        print(f"Error running SQL: {e}")
+        return None
+
+def stale_ids(cutoff, batch_size):
+    """
+    Ids of up to batch_size rows not seen since cutoff ('YYYY-MM-DD HH:MM:SS')
+    """
+    rows = run_sql(
+        f"SELECT id FROM arp_table WHERE last_seen < '{cutoff}' "
+        f"OR (last_seen IS NULL AND created_at < '{cutoff}') ORDER BY id LIMIT {batch_size};"
+    )
+    return None if rows is None else [int(row[0]) for row in rows]
+
+def superseded_ids(batch_size):
+    """
+    Ids of up to batch_size rows for a MAC that also has a newer row
+    """
+    rows = run_sql(
+        "SELECT DISTINCT old.id FROM arp_table old JOIN arp_table newer "
+        "ON newer.hw_address = old.hw_address AND newer.id > old.id "
+        f"ORDER BY old.id LIMIT {batch_size};"
+    )
+    return None if rows is None else [int(row[0]) for row in rows]
+
+def archive_to_table(ids, reason):
+    id_list = ", ".join(str(entry_id) for entry_id in ids)
+    columns = ", ".join(COLUMNS)
+    return run_sql(
+        f"START TRANSACTION; "
+        f"INSERT IGNORE INTO arp_archive ({columns}, reason) "
+        f"SELECT {columns}, '{reason}' FROM arp_table WHERE id IN ({id_list}); "
+        f"{change_log_sql(f'id IN ({id_list})', removed=True)} "
+        f"DELETE FROM arp_table WHERE id IN ({id_list}); "
+        f"COMMIT;"
+    ) is not None
+
+def archive_to_file(ids, reason, path):
+    # Written and synced before the rows are deleted: a crash in between
+    # leaves a duplicate in the file, never a lost row.
+    id_list = ", ".join(str(entry_id) for entry_id in ids)
+    rows = run_sql(f"SELECT {', '.join(COLUMNS)} FROM arp_table WHERE id IN ({id_list});")
+    if rows is None:
+        return False
+
+    archived_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with gzip.open(path, 'at') as f:
+        for row in rows:
+            entry = dict(zip(COLUMNS, (None if value == 'NULL' else value for value in row)))
+            entry['archived_at'] = archived_at
+            entry['reason'] = reason
+            f.write(json.dumps(entry) + "\n")
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+    return run_sql(f"{change_log_sql(f'id IN ({id_list})', removed=True)} "
+                   f"DELETE FROM arp_table WHERE id IN ({id_list});") is not None
+
+def prune_change_log(days=CHANGE_LOG_DAYS):
+    """
+    Delete arp_changes entries older than days
+    """
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    return run_sql(f"DELETE FROM arp_changes WHERE changed_at < '{cutoff}';") is not None
+
+def archive_rows(days=DEFAULT_DAYS, batch_size=DEFAULT_BATCH, max_batches=None,
+                 archive_file=None, pause=DEFAULT_PAUSE):
+    """
+    Archive stale and superseded rows, batch_size at a time
+    Stops after max_batches batches (None for no limit)
+    Returns the number of rows archived
+    """
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    archived = 0
+    batches = 0
+
+    for reason, find in (('superseded', lambda: superseded_ids(batch_size)),
+                         ('stale', lambda: stale_ids(cutoff, batch_size))):
+        while max_batches is None or batches < max_batches:
+            ids = find()
+            if not ids:
+                break
+
+            if archive_file:
+                ok = archive_to_file(ids, reason, archive_file)
+            else:
+                ok = archive_to_table(ids, reason)
+            if not ok:
+                return archived
+
+            archived += len(ids)
+            batches += 1
+            print(f"  Archived {len(ids)} {reason} rows")
+            time.sleep(pause)
+
+    return archived
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+def main():
+    """
+    Main function with command line options
+    """
+    try:
+        db.configure_from_argv(sys.argv)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if '--help' in sys.argv:
+        print("Usage:")
+        print("  python3 arp_retention.py                     # Archive rows not seen for 30 days")
+        print("  python3 arp_retention.py --days 7            # ... for 7 days")
+        print("  python3 arp_retention.py --batch 200 --max-batches 10")
+        print("                                               # Smaller, fewer batches per run")
+        print("  python3 arp_retention.py --archive-file arp_archive.jsonl.gz")
+        print("                                               # Archive to a compressed file instead of arp_archive")
+        print("  python3 arp_retention.py --optimize          # Also rebuild arp_table afterwards")
+        print("  python3 arp_retention.py --db sqlite:///var/lib/network_info/network_info.db")
+        print("                                               # Use an embedded SQLite database instead of MySQL")
+        return
+
+    try:
+        days = float(get_option_value('--days') or DEFAULT_DAYS)
+        batch_size = int(get_option_value('--batch') or DEFAULT_BATCH)
+        max_batches = int(get_option_value('--max-batches')) if get_option_value('--max-batches') else None
+    except ValueError:
+        print("Error: --days, --batch and --max-batches take numeric values")
+        sys.exit(1)
+
+    print(f"Archiving arp_table rows not seen for {days:g} days")
+    archived = archive_rows(days, batch_size, max_batches, get_option_value('--archive-file'))
+    print(f"Archived {archived} rows")
+    prune_change_log()
+
+    if '--optimize' in sys.argv and archived:
+        print("Optimizing arp_table...")
+        run_sql("OPTIMIZE TABLE arp_table;")
+
+if __name__ == "__main__":
+    main()
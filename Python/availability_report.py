@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+"""
+Availability report from the state-transition log.
+
+Loads the state_log of a history database (see state_history.py) into
+NumPy arrays and computes, for any time window, per host and per subnet:
+
+    up / degraded / down seconds    time observed in each state
+    availability                    (up + degraded) / observed time
+    outages                         maximal runs of down time
+    MTTR                            mean length of outages that ended
+    MTBF                            available time / outages that began
+
+Each transition opens an interval that lasts until the host's next
+transition (or the end of the window); the intervals are clipped to the
+window and summed per host with bincount, and outages are found as runs of
+down intervals, all without a Python loop over rows.  A year of history
+for thousands of hosts takes well under a second.
+
+Reading rows out of SQLite costs far more than the arithmetic, so the log
+is also kept column-wise in <history db>.npz and each run only reads the
+rows appended since the last (--no-cache to read everything).  Outage
+timelines need the raw log to cover the window; it is kept for
+state_history.DEFAULT_RAW_DAYS days.
+"""
+
+import datetime
+import ipaddress
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from host_table import int_to_ip, int_to_mac
+from state_history import STATES, DAY
+
+UP = STATES.index('up')
+DOWN = STATES.index('down')
+DEGRADED = STATES.index('degraded')
+
+# Hosts without a known MAC are keyed by IP, above the 48-bit MAC range.
+_IP_KEY = 1 << 48
+
+
+def _fetch(conn, after):
+    rows = conn.execute("SELECT rowid, mac, ip, ts, new_state FROM state_log WHERE rowid > ? ORDER BY rowid;",
+                        (after,))
+    flat = np.fromiter((value for row in rows for value in row), dtype=np.int64)
+    return flat.reshape(-1, 5).T
+
+
+def load_columns(conn, cache_path=None):
+    """
+    The whole log as int64 arrays (rowid, mac, ip, ts, state)
+
+    Turning rows into Python objects is most of the cost of a report, so
+    with cache_path the arrays are kept in an .npz file and only rows added
+    since are read from the database; the log is append-only and pruning
+    never removes its newest row, so rowids only grow.
+    """
+    columns = None
+    if cache_path is not None:
+        try:
+            with np.load(cache_path) as cached:
+                columns = [cached[name] for name in ('rowid', 'mac', 'ip', 'ts', 'state')]
+        except (OSError, KeyError, ValueError):
+            columns = None
+
+    newest = conn.execute("SELECT max(rowid) FROM state_log;").fetchone()[0] or 0
+    if columns is not None and len(columns[0]) and columns[0][-1] > newest:
+        # The database was recreated.
+        columns = None
+
+    after = int(columns[0][-1]) if columns is not None and len(columns[0]) else 0
+    if columns is None or after < newest:
+        added = _fetch(conn, after)
+        columns = list(added) if columns is None else [np.concatenate(pair) for pair in zip(columns, added)]
+        if cache_path is not None:
+            try:
+                tmp_path = cache_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, **dict(zip(('rowid', 'mac', 'ip', 'ts', 'state'), columns)))
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                print(f"Warning: could not write {cache_path}: {e}", file=sys.stderr)
+    return columns
+
+
+def load_log(conn, end, cache_path=None):
+    """
+    Transitions before end as int64 arrays (key, ip, ts, state), sorted by
+    host then time
+    """
+    rowid, mac, ip, ts, state = load_columns(conn, cache_path)
+    before = ts < end
+    mac, ip, ts, state = mac[before], ip[before], ts[before], state[before]
+    key = np.where(mac != 0, mac, ip + _IP_KEY)
+    order = np.lexsort((ts, key))
+    return key[order], ip[order], ts[order], state[order]
+
+
+def host_name(key):
+    return int_to_mac(key) if key < _IP_KEY else int_to_ip(key - _IP_KEY)
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / np.maximum(denominator, 1), np.nan)
+
+
+class AvailabilityReport:
+    """
+    Availability figures for every host seen in [start, end)
+    """
+
+    def __init__(self, key, ip, ts, state, start, end, prefix=24):
+        self.start = start
+        self.end = end
+        self.prefix = prefix
+
+        # Each row's interval lasts until the next row for the same host.
+        last_of_host = np.ones(len(key), dtype=bool)
+        last_of_host[:-1] = key[1:] != key[:-1]
+        until = np.empty_like(ts)
+        until[:-1] = ts[1:]
+        until[last_of_host] = end
+
+        begin = np.clip(ts, start, end)
+        finish = np.clip(until, start, end)
+        seconds = finish - begin
+        inside = seconds > 0
+
+        key, ip, state = key[inside], ip[inside], state[inside]
+        begin, finish, seconds = begin[inside], finish[inside], seconds[inside]
+
+        self.hosts, host_index = np.unique(key, return_inverse=True)
+        count = len(self.hosts)
+
+        # Address each host was last at, for grouping by subnet.
+        last_index = np.zeros(count, dtype=np.int64)
+        np.maximum.at(last_index, host_index, np.arange(len(key)))
+        self.host_ip = ip[last_index]
+
+        def total(mask):
+            return np.bincount(host_index[mask], weights=seconds[mask], minlength=count)
+
+        self.up = total(state == UP)
+        self.degraded = total(state == DEGRADED)
+        self.down = total(state == DOWN)
+
+        # Outages are runs of consecutive down intervals of one host.
+        is_down = state == DOWN
+        previous_down = np.zeros(len(key), dtype=bool)
+        previous_down[1:] = is_down[:-1] & (host_index[1:] == host_index[:-1])
+        next_down = np.zeros(len(key), dtype=bool)
+        next_down[:-1] = is_down[1:] & (host_index[1:] == host_index[:-1])
+        run_start = np.flatnonzero(is_down & ~previous_down)
+        run_end = np.flatnonzero(is_down & ~next_down)
+
+        self.outage_host = host_index[run_start]
+        self.outage_begin = begin[run_start]
+        self.outage_end = finish[run_end]
+        self.outage_seconds = self.outage_end - self.outage_begin
+
+        began = self.outage_begin > start
+        ended = self.outage_end < end
+        self.failures = np.bincount(self.outage_host[began], minlength=count)
+        self.repairs = np.bincount(self.outage_host[ended], minlength=count)
+        self.repair_seconds = np.bincount(self.outage_host[ended], weights=self.outage_seconds[ended],
+                                          minlength=count)
+
+    def host_rows(self):
+        """
+        One dict per host, least available first
+        """
+        observed = self.up + self.degraded + self.down
+        availability = _ratio(self.up + self.degraded, observed)
+        mttr = _ratio(self.repair_seconds, self.repairs)
+        mtbf = _ratio(self.up + self.degraded, self.failures)
+        outages = np.bincount(self.outage_host, minlength=len(self.hosts))
+
+        rows = []
+        for i in np.lexsort((self.hosts, np.nan_to_num(availability, nan=2.0))):
+            rows.append({
+                'host': host_name(int(self.hosts[i])),
+                'ip': int_to_ip(int(self.host_ip[i])) if self.host_ip[i] else None,
+                'up': int(self.up[i]),
+                'degraded': int(self.degraded[i]),
+                'down': int(self.down[i]),
+                'availability': None if np.isnan(availability[i]) else float(availability[i]),
+                'outages': int(outages[i]),
+                'mttr': None if np.isnan(mttr[i]) else float(mttr[i]),
+                'mtbf': None if np.isnan(mtbf[i]) else float(mtbf[i]),
+            })
+        return rows
+
+    def subnet_rows(self):
+        """
+        One dict per subnet of the hosts' latest addresses, time-weighted
+        """
+        mask = np.int64((0xFFFFFFFF << (32 - self.prefix)) & 0xFFFFFFFF)
+        subnets, subnet_index = np.unique(self.host_ip & mask, return_inverse=True)
+        count = len(subnets)
+
+        def total(values):
+            return np.bincount(subnet_index, weights=values, minlength=count)
+
+        up, degraded, down = total(self.up), total(self.degraded), total(self.down)
+        observed = up + degraded + down
+        availability = _ratio(up + degraded, observed)
+        repairs = total(self.repairs)
+        mttr = _ratio(total(self.repair_seconds), repairs)
+        hosts = np.bincount(subnet_index, minlength=count)
+        outages = total(np.bincount(self.outage_host, minlength=len(self.hosts)))
+
+        return [{
+            'subnet': f"{int_to_ip(int(subnets[i]))}/{self.prefix}",
+            'hosts': int(hosts[i]),
+            'up': int(up[i]),
+            'degraded': int(degraded[i]),
+            'down': int(down[i]),
+            'availability': None if np.isnan(availability[i]) else float(availability[i]),
+            'outages': int(outages[i]),
+            'mttr': None if np.isnan(mttr[i]) else float(mttr[i]),
+        } for i in range(count)]
+
+    def outages(self, host=None):
+        """
+        Outage timeline, oldest first, optionally for one host name
+        """
+        order = np.argsort(self.outage_begin, kind='stable')
+        rows = []
+        for i in order:
+            name = host_name(int(self.hosts[self.outage_host[i]]))
+            if host is not None and name != host and \
+                    int_to_ip(int(self.host_ip[self.outage_host[i]])) != host:
+                continue
+            rows.append({
+                'host': name,
+                'start': int(self.outage_begin[i]),
+                'end': int(self.outage_end[i]),
+                'seconds': int(self.outage_seconds[i]),
+                'ongoing': bool(self.outage_end[i] >= self.end),
+            })
+        return rows
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    if seconds < DAY:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / DAY:.1f}d"
+
+
+def format_time(ts):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(ts))
+
+
+def parse_date(text):
+    return int(datetime.datetime.fromisoformat(text).timestamp())
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def main():
+    """
+    Print or dump as JSON the availability report for a history database
+    """
+    if len(sys.argv) < 2 or '--help' in sys.argv:
+        print("Usage:")
+        print("  python3 availability_report.py <history db>                  # Last 30 days, per host")
+        print("  python3 availability_report.py <history db> --days 365       # Last year")
+        print("  python3 availability_report.py <history db> --since 2026-01-01 --until 2026-04-01")
+        print("  python3 availability_report.py <history db> --subnets        # Per /24 (--prefix N for others)")
+        print("  python3 availability_report.py <history db> --outages [--host 192.168.0.18]")
+        print("                                                               # Outage timeline")
+        print("  python3 availability_report.py <history db> --json           # Everything, as JSON")
+        print("  python3 availability_report.py <history db> --no-cache       # Don't use <history db>.npz")
+        return
+
+    if not os.path.exists(sys.argv[1]):
+        print(f"Error: no history database {sys.argv[1]}")
+        sys.exit(1)
+
+    try:
+        end = parse_date(get_option_value('--until')) if get_option_value('--until') else int(time.time())
+        if get_option_value('--since'):
+            start = parse_date(get_option_value('--since'))
+        else:
+            start = end - int(float(get_option_value('--days') or 30) * DAY)
+        prefix = int(get_option_value('--prefix') or 24)
+        ipaddress.IPv4Network(f"0.0.0.0/{prefix}")
+    except ValueError:
+        print("Error: --since/--until take ISO dates, --days and --prefix numbers")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(f"file:{sys.argv[1]}?mode=ro", uri=True)
+    try:
+        cache_path = None if '--no-cache' in sys.argv else sys.argv[1] + '.npz'
+        report = AvailabilityReport(*load_log(conn, end, cache_path), start, end, prefix)
+    except sqlite3.Error as e:
+        print(f"Error reading history database: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+
+    host = get_option_value('--host')
+
+    if '--json' in sys.argv:
+        json.dump({
+            'start': start,
+            'end': end,
+            'hosts': report.host_rows(),
+            'subnets': report.subnet_rows(),
+            'outages': report.outages(host),
+        }, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"Availability {format_time(start)} - {format_time(end)} "
+          f"({len(report.hosts)} hosts, computed in {elapsed * 1000:.0f} ms)")
+    print()
+
+    if '--outages' in sys.argv:
+        print(f"{'Host':<20} {'Start':<17} {'End':<17} {'Length':>8}")
+        print("-" * 65)
+        for outage in report.outages(host):
+            end_text = 'ongoing' if outage['ongoing'] else format_time(outage['end'])
+            print(f"{outage['host']:<20} {format_time(outage['start']):<17} {end_text:<17} "
+                  f"{format_duration(outage['seconds']):>8}")
+        return
+
+    if '--subnets' in sys.argv:
+        print(f"{'Subnet':<20} {'Hosts':>6} {'Avail':>8} {'Down':>8} {'Outages':>8} {'MTTR':>8}")
+        print("-" * 62)
+        for row in report.subnet_rows():
+            availability = '-' if row['availability'] is None else f"{row['availability']:.2%}"
+            print(f"{row['subnet']:<20} {row['hosts']:>6} {availability:>8} {format_duration(row['down']):>8} "
+                  f"{row['outages']:>8} {format_duration(row['mttr']):>8}")
+        return
+
+    print(f"{'Host':<20} {'IP Address':<16} {'Avail':>8} {'Down':>8} {'Outages':>8} {'MTTR':>8} {'MTBF':>8}")
+    print("-" * 82)
+    for row in report.host_rows():
+        availability = '-' if row['availability'] is None else f"{row['availability']:.2%}"
+        print(f"{row['host']:<20} {row['ip'] or '-':<16} {availability:>8} {format_duration(row['down']):>8} "
+              f"{row['outages']:>8} {format_duration(row['mttr']):>8} {format_duration(row['mtbf']):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+"""
+Synthetic-scale benchmark for the network_info update and display paths.
+
+For each size (1k, 10k and 100k hosts by default) a SQLite network_info
+database and an "arp -a" listing are generated: the listing holds the
+database's hosts with a configurable churn, split evenly between devices
+that left, devices that moved to a new address and devices never seen
+before.  Each flow then runs in a fresh interpreter against a fresh copy
+of the database, with a stand-in arp command printing the listing:
+
+    update     update_network_info.py --no-ping, the whole update
+    list       set_hostname.py --list
+    show       display_arp_entries.py
+    summary    display_arp_entries.py --summary
+    hostname   set_hostname.py <ip> <name> for HOSTNAME_UPDATES hosts
+
+and its wall time (median of --repeat runs), peak resident memory and
+database round trips and statements are reported.  --save writes them to a
+JSON baseline; --compare checks a run against one and exits with status 1
+when a flow got slower or bigger than the tolerance allows, or issues more
+queries.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SIZES = (1000, 10000, 100000)
+FLOWS = ('update', 'list', 'show', 'summary', 'hostname')
+
+DEFAULT_CHURN = 0.05
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+
+HOSTNAME_UPDATES = 100
+
+# Timing differences below this many seconds are noise, whatever the ratio.
+MIN_WALL_DIFFERENCE = 0.005
+
+# Synthetic hosts live at BASE_ADDRESS + n; movers and newcomers get
+# addresses from their own blocks so they never collide with a known host.
+BASE_ADDRESS = 0x0a000001       # 10.0.0.1
+MOVED_ADDRESS = 0x0a800001      # 10.128.0.1
+NEW_ADDRESS = 0x0ac00001        # 10.192.0.1
+BASE_MAC = 0x020000000000
+NEW_MAC = 0x02ff00000000
+
+
+def _ip(value):
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def _mac(value):
+    digits = '%012x' % value
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def generate(workdir, size, churn, seed=1):
+    """
+    Write base.db (size known hosts), arp.txt (the current ARP table) and
+    bin/arp into workdir
+    """
+    from sqlite_backend import SqliteBackend
+
+    rng = random.Random(seed * 1000003 + size)
+    backend = SqliteBackend(os.path.join(workdir, 'base.db'))
+    hosts = [(_ip(BASE_ADDRESS + n), BASE_ADDRESS + n, _mac(BASE_MAC + n),
+              'UP' if rng.random() < 0.8 else 'DOWN') for n in range(size)]
+    with backend.conn:
+        backend.conn.executemany("INSERT INTO arp_table (ip_address, ip_int, hw_address, state) VALUES (?, ?, ?, ?)",
+                                 hosts)
+        backend.conn.executemany("INSERT INTO address_history (ip_address, ip_int, hw_address) VALUES (?, ?, ?)",
+                                 [host[:3] for host in hosts])
+    backend.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    backend.close()
+
+    changed = int(size * churn) // 3
+    picked = rng.sample(range(size), 2 * changed)
+    gone = set(picked[:changed])
+    moved = {n: MOVED_ADDRESS + i for i, n in enumerate(picked[changed:])}
+
+    lines = []
+    for n in range(size):
+        if n not in gone:
+            lines.append(f"? ({_ip(moved.get(n, BASE_ADDRESS + n))}) at {_mac(BASE_MAC + n)} [ether] on eth0")
+    for i in range(changed):
+        lines.append(f"? ({_ip(NEW_ADDRESS + i)}) at {_mac(NEW_MAC + i)} [ether] on eth0")
+    rng.shuffle(lines)
+    with open(os.path.join(workdir, 'arp.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    os.makedirs(os.path.join(workdir, 'bin'), exist_ok=True)
+    arp = os.path.join(workdir, 'bin', 'arp')
+    with open(arp, 'w') as f:
+        f.write(f"#!/bin/sh\nexec cat '{os.path.join(workdir, 'arp.txt')}'\n")
+    os.chmod(arp, 0o755)
+
+
+class CountingBackend:
+    """
+    Wraps a backend, counting round trips and statements
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.queries = 0
+        self.statements = 0
+
+    def run(self, sql):
+        from sqlite_backend import SqliteBackend
+
+        self.queries += 1
+        self.statements += sum(1 for _ in SqliteBackend.statements(sql))
+        return self.backend.run(sql)
+
+    def close(self):
+        self.backend.close()
+
+
+def run_flow(flow, workdir):
+    """
+    Child side: run one flow against a copy of base.db and return its figures
+    """
+    from network_db import db
+
+    database = os.path.join(workdir, 'run.db')
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(database + suffix)
+    shutil.copyfile(os.path.join(workdir, 'base.db'), database)
+    history_db = os.path.join(workdir, 'history.db')
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(history_db)
+    os.environ['PATH'] = os.path.join(workdir, 'bin') + os.pathsep + os.environ.get('PATH', '')
+
+    import display_arp_entries
+    import set_hostname
+    import update_network_info
+
+    db.configure('sqlite://' + database)
+    counter = CountingBackend(db.open())
+    db.backend = counter
+
+    if flow == 'hostname':
+        rows = db.run(f'SELECT ip_address FROM arp_table ORDER BY id LIMIT {HOSTNAME_UPDATES};')
+        counter.queries = counter.statements = 0
+        targets = [columns[0] for columns in rows]
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if flow == 'update':
+            update_network_info.update_network_database(check_connectivity=False, verbose=False,
+                                                        rtt_file=None, history_db=history_db)
+        elif flow == 'list':
+            set_hostname.list_devices()
+        elif flow == 'show':
+            display_arp_entries.display_arp_entries()
+        elif flow == 'summary':
+            display_arp_entries.show_summary()
+        elif flow == 'hostname':
+            for n, ip_address in enumerate(targets):
+                set_hostname.set_hostname_direct(ip_address, f'bench-{n}')
+    wall = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        'wall': wall,
+        'peak_mb': peak / 1024,
+        'flow_mb': max(0, peak - before) / 1024,
+        'queries': counter.queries,
+        'statements': counter.statements,
+    }
+
+
+def measure(flow, workdir, repeat):
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', flow, workdir],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+        runs.append(json.loads(result.stdout))
+    return {
+        'wall': statistics.median(run['wall'] for run in runs),
+        'peak_mb': max(run['peak_mb'] for run in runs),
+        'flow_mb': max(run['flow_mb'] for run in runs),
+        'queries': runs[-1]['queries'],
+        'statements': runs[-1]['statements'],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of results against a baseline's results, as text lines
+    """
+    problems = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['wall'] - base['wall'] > max(base['wall'] * tolerance, MIN_WALL_DIFFERENCE):
+            problems.append(f"{key}: {result['wall'] * 1000:.1f} ms, was {base['wall'] * 1000:.1f} ms")
+        if result['flow_mb'] - base['flow_mb'] > max(base['flow_mb'] * tolerance, 1.0):
+            problems.append(f"{key}: uses {result['flow_mb']:.1f} MB, was {base['flow_mb']:.1f} MB")
+        for counter in ('queries', 'statements'):
+            if result[counter] > base[counter]:
+                problems.append(f"{key}: {result[counter]} {counter}, was {base[counter]}")
+    return problems
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def main():
+    if '--child' in sys.argv:
+        flow, workdir = sys.argv[sys.argv.index('--child') + 1:][:2]
+        print(json.dumps(run_flow(flow, workdir)))
+        return 0
+    if '--generate' in sys.argv:
+        size, churn, workdir = sys.argv[sys.argv.index('--generate') + 1:][:3]
+        generate(workdir, int(size), float(churn))
+        return 0
+
+    if '--help' in sys.argv:
+        print("Usage:")
+        print("  python3 bench_network_info.py                          # 1k, 10k and 100k hosts, every flow")
+        print("  python3 bench_network_info.py --sizes 1000,10000       # Only these sizes")
+        print("  python3 bench_network_info.py --flows update,list      # Only these flows")
+        print("  python3 bench_network_info.py --churn 0.2              # Fraction of hosts gone/moved/new (default 0.05)")
+        print("  python3 bench_network_info.py --repeat 5               # Runs per measurement (default 3)")
+        print("  python3 bench_network_info.py --save baseline.json     # Record the results as a baseline")
+        print("  python3 bench_network_info.py --compare baseline.json  # Fail on regressions against a baseline")
+        print("  python3 bench_network_info.py --tolerance 0.5          # Allowed slowdown/growth (default 0.25)")
+        return 0
+
+    try:
+        sizes = [int(size) for size in (get_option_value('--sizes') or ','.join(map(str, SIZES))).split(',')]
+        churn = float(get_option_value('--churn') or DEFAULT_CHURN)
+        repeat = int(get_option_value('--repeat') or DEFAULT_REPEAT)
+        tolerance = float(get_option_value('--tolerance') or DEFAULT_TOLERANCE)
+    except ValueError:
+        print("Error: --sizes, --churn, --repeat and --tolerance take numeric values")
+        return 2
+    flows = (get_option_value('--flows') or ','.join(FLOWS)).split(',')
+    unknown = [flow for flow in flows if flow not in FLOWS]
+    if unknown:
+        print(f"Error: unknown flow {', '.join(unknown)} (choose from {', '.join(FLOWS)})")
+        return 2
+
+    baseline = None
+    compare_path = get_option_value('--compare')
+    if compare_path:
+        try:
+            with open(compare_path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading baseline {compare_path}: {e}")
+            return 2
+        if baseline.get('churn') != churn:
+            print(f"Warning: baseline was recorded with churn {baseline.get('churn')}, this run uses {churn}")
+
+    print(f"Churn {churn:.0%}, median of {repeat} runs")
+    print()
+    print(f"{'Hosts':>7} {'Flow':<9} {'Wall':>10} {'Peak':>9} {'Flow mem':>9} {'Queries':>8} {'Stmts':>8}")
+    print("-" * 66)
+
+    results = {}
+    failed = False
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix='bench_network_info.') as workdir:
+            # Generated in another process so that this one stays small: a
+            # child's peak memory figure starts from its parent's.
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--generate', str(size), str(churn), workdir],
+                           check=True)
+            for flow in flows:
+                key = f"{size}/{flow}"
+                try:
+                    result = results[key] = measure(flow, workdir, repeat)
+                except RuntimeError as e:
+                    print(f"{size:>7} {flow:<9} failed: {e}")
+                    failed = True
+                    continue
+                print(f"{size:>7} {flow:<9} {result['wall'] * 1000:>8.1f}ms {result['peak_mb']:>7.1f}MB "
+                      f"{result['flow_mb']:>7.1f}MB {result['queries']:>8} {result['statements']:>8}")
+
+    save_path = get_option_value('--save')
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump({'recorded': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                       'churn': churn, 'results': results}, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {save_path}")
+
+    if baseline is not None:
+        problems = compare(results, baseline.get('results', {}), tolerance)
+        print()
+        if problems:
+            print(f"Regressions against {compare_path}:")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = True
+        else:
+            print(f"No regressions against {compare_path}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+Startup-time benchmark for netmgmt.py.
+
+For each subcommand, starts a fresh interpreter that loads netmgmt and the
+subcommand's module, as "netmgmt.py <subcommand>" does before doing any
+work, and reports the median wall time over a number of runs next to a bare
+interpreter.  Fails (exit status 1) when a subcommand's import overhead is
+over its budget or it loads a heavy module it should not need, so it can
+run in CI or before a release to catch eager imports creeping back.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_RUNS = 10
+
+# Milliseconds over a bare interpreter each subcommand may take to load.
+BUDGETS = {
+    'help': 10,
+    'list': 40,
+    'show': 40,
+    'summary': 40,
+    'set-hostname': 40,
+    'setup': 40,
+    'update': 80,
+    'monitor': 150,
+    'retention': 40,
+    'discover': 80,
+    'history': 40,
+    'availability': 200,
+    'sweep': 100,
+    'serve': 80,
+}
+
+# For a subcommand added to netmgmt without a budget here.
+DEFAULT_BUDGET = 40
+
+# Modules a subcommand must not load before it runs.
+HEAVY = {'paho', 'ping3', 'numpy', 'sqlite3', 'requests', 'bs4', 'asyncio'}
+ALLOWED = {
+    'update': {'sqlite3'},
+    'monitor': {'ping3', 'sqlite3'},
+    'discover': {'sqlite3'},
+    'history': {'sqlite3'},
+    'availability': {'numpy', 'sqlite3'},
+    'sweep': {'asyncio'},
+}
+
+_LOADER = """
+import sys
+sys.path.insert(0, {root!r})
+sys.argv = ['netmgmt.py']
+import netmgmt
+name = {name!r}
+if name in netmgmt.SUBCOMMANDS:
+    __import__(netmgmt.SUBCOMMANDS[name][0])
+print(' '.join(sorted({{module.split('.')[0] for module in sys.modules}})))
+"""
+
+
+def subcommands():
+    """
+    'help' and every netmgmt subcommand, with its budget in milliseconds
+    """
+    sys.path.insert(0, ROOT)
+    from netmgmt import SUBCOMMANDS
+
+    return [(name, BUDGETS.get(name, DEFAULT_BUDGET)) for name in ['help'] + list(SUBCOMMANDS)]
+
+
+def time_run(code):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    return elapsed, set(result.stdout.split())
+
+
+def median_time(code, runs):
+    times = []
+    modules = set()
+    for _ in range(runs):
+        elapsed, modules = time_run(code)
+        times.append(elapsed)
+    return statistics.median(times), modules
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def main():
+    if '--help' in sys.argv:
+        print("Usage:")
+        print("  python3 bench_startup.py              # Check every subcommand against its budget")
+        print("  python3 bench_startup.py --runs 20    # More runs per measurement (default 10)")
+        print("  python3 bench_startup.py --scale 2    # Double every budget (slow machines)")
+        return 0
+
+    try:
+        runs = int(get_option_value('--runs') or DEFAULT_RUNS)
+        scale = float(get_option_value('--scale') or 1)
+    except ValueError:
+        print("Error: --runs and --scale take numeric values")
+        return 2
+
+    bare, _ = median_time('pass', runs)
+    print(f"Bare interpreter: {bare * 1000:.1f} ms (median of {runs})")
+    print()
+    print(f"{'Subcommand':<14} {'Total':>8} {'Overhead':>9} {'Budget':>7}  Result")
+    print("-" * 60)
+
+    failed = False
+    for name, budget in subcommands():
+        try:
+            elapsed, modules = median_time(_LOADER.format(root=ROOT, name=name), runs)
+        except RuntimeError as e:
+            print(f"{name:<14} import failed: {e}")
+            failed = True
+            continue
+
+        overhead = (elapsed - bare) * 1000
+        heavy = sorted((modules & HEAVY) - ALLOWED.get(name, set()))
+        problems = []
+        if overhead > budget * scale:
+            problems.append("over budget")
+        if heavy:
+            problems.append("loads " + ", ".join(heavy))
+        failed = failed or bool(problems)
+
+        print(f"{name:<14} {elapsed * 1000:>6.1f}ms {overhead:>7.1f}ms {budget * scale:>5.0f}ms  "
+              f"{'; '.join(problems) or 'ok'}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
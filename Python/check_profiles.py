@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+Per-node service check profiles for monitor.py.
+
+A profile is the set of rows in the node_check table for one IP address.
+Each row is one check:
+
+    kind    'tcp'    connect to port
+            'http'   GET path on port, expect status (default 200)
+            'https'  as http, over TLS (certificates are not verified)
+            'banner' connect to port, read the greeting, expect regex to match
+
+All checks of a profile run concurrently, each with its own timeout, so a
+node with five checks takes as long as its slowest check.  The results are
+aggregated into a node health state:
+
+    up        every check passed
+    degraded  some checks passed
+    down      no check passed
+"""
+
+import concurrent.futures
+import http.client
+import re
+import socket
+import ssl
+
+from host_table import ip_to_int
+from probe_limiter import limiter
+
+STATE_UP = 'up'
+STATE_DEGRADED = 'degraded'
+STATE_DOWN = 'down'
+
+DEFAULT_TIMEOUT = 2.0
+
+CHECK_KINDS = ('tcp', 'http', 'https', 'banner')
+
+_executor = None
+
+
+class CheckSpec:
+    """
+    One check from a node's profile
+    """
+    __slots__ = ('kind', 'port', 'path', 'expect', 'pattern', 'timeout')
+
+    def __init__(self, kind, port, path=None, expect=None, timeout=DEFAULT_TIMEOUT):
+        if kind not in CHECK_KINDS:
+            raise ValueError(f"unknown check kind '{kind}'")
+        self.kind = kind
+        self.port = port
+        self.path = path or '/'
+        self.expect = expect
+        self.pattern = None
+        if expect and kind == 'banner':
+            try:
+                self.pattern = re.compile(expect)
+            except re.error as e:
+                raise ValueError(f"invalid banner pattern '{expect}': {e}")
+        self.timeout = timeout or DEFAULT_TIMEOUT
+
+    def __repr__(self):
+        return f"CheckSpec({self.kind}, {self.port})"
+
+
+def load_profiles(cursor):
+    """
+    Read every node_check row
+    Returns a dict of integer IP -> [CheckSpec, ...]
+    """
+    profiles = {}
+    for ip_address, kind, port, path, expect, timeout in cursor.execute(
+            'select ip_address, kind, port, path, expect, timeout from node_check;'):
+        try:
+            spec = CheckSpec(kind, port, path, expect, timeout)
+        except ValueError as e:
+            print(f"Ignoring check for {ip_address}: {e}")
+            continue
+        profiles.setdefault(ip_to_int(ip_address), []).append(spec)
+    return profiles
+
+
+def check_tcp(ip_address, spec):
+    with socket.create_connection((ip_address, spec.port), timeout=spec.timeout):
+        return True
+
+
+def check_http(ip_address, spec):
+    if spec.kind == 'https':
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        conn = http.client.HTTPSConnection(ip_address, spec.port, timeout=spec.timeout, context=context)
+    else:
+        conn = http.client.HTTPConnection(ip_address, spec.port, timeout=spec.timeout)
+    try:
+        conn.request('GET', spec.path)
+        status = conn.getresponse().status
+    finally:
+        conn.close()
+    expected = int(spec.expect) if spec.expect else 200
+    return status == expected
+
+
+def check_banner(ip_address, spec):
+    with socket.create_connection((ip_address, spec.port), timeout=spec.timeout) as s:
+        banner = s.recv(1024).decode('utf-8', 'replace')
+    if spec.pattern is None:
+        return bool(banner)
+    return spec.pattern.search(banner) is not None
+
+
+_CHECKS = {
+    'tcp': check_tcp,
+    'http': check_http,
+    'https': check_http,
+    'banner': check_banner,
+}
+
+
+def run_check(ip_address, spec):
+    """
+    Run a single check, returning True if it passed
+    """
+    try:
+        with limiter.probe(ip_address):
+            return _CHECKS[spec.kind](ip_address, spec)
+    except (OSError, http.client.HTTPException, ValueError, re.error):
+        return False
+
+
+def run_profile(ip_address, specs):
+    """
+    Run all checks of a profile concurrently
+    Returns (state, [(spec, passed), ...])
+    """
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix='check')
+
+    futures = [_executor.submit(run_check, ip_address, spec) for spec in specs]
+    results = [(spec, future.result()) for spec, future in zip(specs, futures)]
+
+    passed = sum(1 for _, ok in results if ok)
+    if passed == len(results):
+        state = STATE_UP
+    elif passed:
+        state = STATE_DEGRADED
+    else:
+        state = STATE_DOWN
+    return state, results
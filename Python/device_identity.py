@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+MAC-anchored device identity.
+
+A device is identified by its MAC address; its IP address is an attribute
+that DHCP may change.  resolve() matches a sighting of (ip, mac) against a
+DeviceTable and classifies it:
+
+    KNOWN     the device is where it was
+    NEW       a MAC never seen before
+    MOVED     a known MAC at a new address
+    CONFLICT  a second MAC answering on an address whose holder was seen
+              within the conflict window, i.e. both are live at once
+
+If a NEW or MOVED device takes an address whose holder has not been seen
+for longer than the window, the lease was reassigned: the holder is left
+without an address (ip 0) and returned as displaced, rather than having
+its row overwritten by the newcomer.
+
+The tables that persist this (node/arp_table plus address_history) therefore
+hold one row per device and one per address each device has used, not one
+per lease ever issued.
+"""
+
+KNOWN = 'KNOWN'
+NEW = 'NEW'
+MOVED = 'MOVED'
+CONFLICT = 'CONFLICT'
+
+DEFAULT_CONFLICT_WINDOW = 300
+
+
+class Resolution:
+    """
+    Outcome of resolving one sighting
+
+    record      the device (None for NEW, which the caller adds)
+    old_ip      previous address of a MOVED device
+    displaced   device that lost the address to this one, if any
+    holder      live device at the address, for CONFLICT
+    repeat      True if this CONFLICT was already reported within the window
+    learned     True if a KNOWN device's MAC was only now learned
+    """
+    __slots__ = ('outcome', 'record', 'old_ip', 'displaced', 'holder', 'repeat', 'learned')
+
+    def __init__(self, outcome, record=None, old_ip=0, displaced=None, holder=None, repeat=False,
+                 learned=False):
+        self.outcome = outcome
+        self.record = record
+        self.old_ip = old_ip
+        self.displaced = displaced
+        self.holder = holder
+        self.repeat = repeat
+        self.learned = learned
+
+    def __repr__(self):
+        return 'Resolution(%s, %r)' % (self.outcome, self.record)
+
+
+class IdentityResolver:
+    """
+    Resolves sightings against, and keeps up to date, a DeviceTable
+    """
+
+    def __init__(self, devices, conflict_window=DEFAULT_CONFLICT_WINDOW):
+        self.devices = devices
+        self.conflict_window = conflict_window
+        self.reported = {}
+
+    def resolve(self, ip, mac, timestamp):
+        devices = self.devices
+        holder = devices.at(ip)
+
+        if not mac:
+            if holder is None:
+                return Resolution(NEW)
+            return Resolution(KNOWN, holder)
+
+        device = devices.get(ip, mac)
+        if device is not None and device.ip == ip:
+            return Resolution(KNOWN, device)
+
+        displaced = None
+        if holder is not None:
+            if not holder.mac and device is None:
+                devices.learn_mac(holder, mac)
+                return Resolution(KNOWN, holder, learned=True)
+
+            if holder.mac and timestamp - holder.last_seen < self.conflict_window:
+                previous = self.reported.get((ip, mac))
+                repeat = previous is not None and timestamp - previous < self.conflict_window
+                if not repeat:
+                    self.reported[(ip, mac)] = timestamp
+                return Resolution(CONFLICT, device, holder=holder, repeat=repeat)
+
+            displaced = holder
+            if holder.mac:
+                devices.move(holder, 0)
+            else:
+                devices.remove(ip)
+
+        self.reported.pop((ip, mac), None)
+        if device is None:
+            return Resolution(NEW, displaced=displaced)
+
+        old_ip = device.ip
+        devices.move(device, ip)
+        return Resolution(MOVED, device, old_ip=old_ip, displaced=displaced)
+
+
+def find_conflicts(records):
+    """
+    Addresses claimed by more than one MAC in one set of sightings (for
+    example a single ARP table dump)
+    Returns a dict of integer IP -> [record, ...]
+    """
+    claims = {}
+    for record in records:
+        if record.ip and record.mac:
+            claims.setdefault(record.ip, []).append(record)
+    return {ip: found for ip, found in claims.items()
+            if len({record.mac for record in found}) > 1}
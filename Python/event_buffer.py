@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Non-blocking, per-host coalescing buffer between ingest and dispatch.
+
+put() never blocks the producer.  Pending events are keyed by host: a new
+event for a host that already has one pending replaces it in place (the
+consumer only ever needs the latest state), and when the buffer is full the
+oldest pending host is dropped.  Both cases are counted so a lagging
+consumer shows up in the statistics instead of as a stalled scanner.
+"""
+
+import collections
+import threading
+
+
+class CoalescingBuffer:
+    """
+    Bounded, keyed FIFO with replace-on-duplicate semantics
+
+    merge(old, new), if given, builds the value kept when an event for a key
+    that is already pending arrives; by default the new event wins.
+    """
+
+    def __init__(self, capacity=10000, merge=None):
+        self.capacity = capacity
+        self.merge = merge
+        self.pending = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.added = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.taken = 0
+
+    def put(self, key, item):
+        """
+        Queue item for key; never blocks
+        """
+        with self.lock:
+            self.added += 1
+            old = self.pending.get(key)
+            if old is not None:
+                self.pending[key] = self.merge(old, item) if self.merge else item
+                self.coalesced += 1
+            else:
+                if len(self.pending) >= self.capacity:
+                    self.pending.popitem(last=False)
+                    self.dropped += 1
+                self.pending[key] = item
+            self.not_empty.notify()
+
+    def take(self, max_items=100, timeout=None):
+        """
+        Remove and return up to max_items pending items, oldest first
+        Waits up to timeout seconds if nothing is pending
+        """
+        with self.lock:
+            if not self.pending and timeout:
+                self.not_empty.wait(timeout)
+            items = []
+            while self.pending and len(items) < max_items:
+                items.append(self.pending.popitem(last=False)[1])
+            self.taken += len(items)
+            return items
+
+    def __len__(self):
+        return len(self.pending)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'added': self.added,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'taken': self.taken,
+            }
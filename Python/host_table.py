@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""
+Compact in-memory host records shared by monitor.py and the network_info tools.
+
+IPv4 addresses are held as 32-bit integers and MAC addresses as 48-bit
+integers, so a record costs a handful of machine words instead of several
+Python strings.  Conversions to and from the dotted/colon text forms happen
+only at the edges (parsing command output, building SQL, printing).
+"""
+
+import socket
+import struct
+import time
+
+CAUSE_NEW = 'NEW'
+CAUSE_STATE = 'STATE'
+CAUSE_MOVED = 'MOVED'
+CAUSE_CONFLICT = 'CONFLICT'
+
+_IP_STRUCT = struct.Struct('!I')
+
+
+def ip_to_int(ip_address):
+    """
+    Convert a dotted quad string to a 32-bit integer
+    """
+    return _IP_STRUCT.unpack(socket.inet_aton(ip_address))[0]
+
+
+def int_to_ip(value):
+    """
+    Convert a 32-bit integer to a dotted quad string
+    """
+    return socket.inet_ntoa(_IP_STRUCT.pack(value))
+
+
+def mac_to_int(hw_address):
+    """
+    Convert a MAC address string (any case, ':' or '-' separated) to a 48-bit integer
+    Returns 0 for an empty or unparseable address
+    """
+    if not hw_address:
+        return 0
+    digits = hw_address.replace(':', '').replace('-', '')
+    if len(digits) != 12:
+        # fing and arp sometimes drop leading zeros, e.g. 0:1b:2c:...
+        parts = hw_address.replace('-', ':').split(':')
+        if len(parts) != 6:
+            return 0
+        digits = ''.join(part.zfill(2) for part in parts)
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return 0
+
+
+def int_to_mac(value):
+    """
+    Convert a 48-bit integer to a lowercase colon separated MAC address string
+    """
+    digits = '%012x' % value
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def cidr_range(cidr):
+    """
+    Return the inclusive (first, last) integer addresses of a CIDR block
+    Raises ValueError for a malformed block
+    """
+    import ipaddress
+
+    network = ipaddress.IPv4Network(cidr, strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+
+class HostRecord:
+    """
+    A single tracked host
+
+    ip and mac are integers; state is the state string used by the owning tool
+    ('up'/'down' for monitor.py, 'UP'/'DOWN'/'UNKNOWN' for arp_table).
+    """
+    __slots__ = ('ip', 'mac', 'state', 'name', 'maker', 'notify', 'check_port',
+                 'row_id', 'last_seen', 'event_time')
+
+    def __init__(self, ip, mac=0, state=None, name='', maker='', notify=True,
+                 check_port=0, row_id=None, last_seen=0, event_time=0):
+        self.ip = ip
+        self.mac = mac
+        self.state = state
+        self.name = name
+        self.maker = maker
+        self.notify = notify
+        self.check_port = check_port
+        self.row_id = row_id
+        self.last_seen = last_seen
+        self.event_time = event_time
+
+    @property
+    def ip_address(self):
+        return int_to_ip(self.ip)
+
+    @property
+    def hw_address(self):
+        return int_to_mac(self.mac)
+
+    def __repr__(self):
+        return 'HostRecord(%s, %s, %r)' % (self.ip_address, self.hw_address, self.state)
+
+
+class HostTable:
+    """
+    Integer keyed collection of HostRecord objects, keyed by IP
+
+    Subclasses choose another key by overriding key().
+    """
+    __slots__ = ('_records',)
+
+    def __init__(self):
+        self._records = {}
+
+    def key(self, ip, mac=0):
+        return ip
+
+    def add(self, record):
+        self._records[self.key(record.ip, record.mac)] = record
+        return record
+
+    def get(self, ip, mac=0):
+        return self._records.get(self.key(ip, mac))
+
+    def remove(self, ip, mac=0):
+        return self._records.pop(self.key(ip, mac), None)
+
+    def keys(self):
+        return self._records.keys()
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __len__(self):
+        return len(self._records)
+
+    def new_records(self, other):
+        """
+        Records in this table whose key is not present in other
+        """
+        theirs = other._records
+        return [record for key, record in self._records.items() if key not in theirs]
+
+
+_NO_MAC = 1 << 48
+
+
+class DeviceTable(HostTable):
+    """
+    HostRecords keyed by MAC address, with the IP address a mutable attribute
+
+    One record per device however often its address changes.  at(ip) finds
+    the device currently holding an address; a device with no current
+    address has ip 0.  Devices whose MAC is unknown are keyed by IP.
+    """
+    __slots__ = ('_by_ip',)
+
+    def __init__(self, records=()):
+        HostTable.__init__(self)
+        self._by_ip = {}
+        for record in records:
+            self.add(record)
+
+    def key(self, ip, mac=0):
+        return mac if mac else _NO_MAC | ip
+
+    def add(self, record):
+        self._records[self.key(record.ip, record.mac)] = record
+        if record.ip:
+            self._by_ip[record.ip] = record
+        return record
+
+    def get(self, ip, mac=0):
+        """
+        The device with this MAC, or without one the device at ip
+        """
+        if mac:
+            return self._records.get(mac)
+        return self._by_ip.get(ip)
+
+    def at(self, ip):
+        return self._by_ip.get(ip)
+
+    def remove(self, ip, mac=0):
+        record = self.get(ip, mac)
+        if record is not None:
+            del self._records[self.key(record.ip, record.mac)]
+            if self._by_ip.get(record.ip) is record:
+                del self._by_ip[record.ip]
+        return record
+
+    def move(self, record, ip):
+        """
+        Give record a new address (0 for none)
+        """
+        key = self.key(record.ip, record.mac)
+        if self._by_ip.get(record.ip) is record:
+            del self._by_ip[record.ip]
+        if not record.mac:
+            del self._records[key]
+        record.ip = ip
+        if not record.mac:
+            self._records[self.key(ip, 0)] = record
+        if ip:
+            self._by_ip[ip] = record
+
+    def learn_mac(self, record, mac):
+        """
+        Record the MAC of a device so far known only by its address
+        """
+        del self._records[self.key(record.ip, 0)]
+        record.mac = mac
+        self._records[mac] = record
+
+
+class HostEvent:
+    """
+    Typed notification event passed from the ingest path to the notifier
+
+    Replaces the colon-joined "CAUSE:ip:name:state" strings.
+    """
+    __slots__ = ('cause', 'ip', 'name', 'state', 'timestamp')
+
+    def __init__(self, cause, ip, name, state, timestamp=None):
+        self.cause = cause
+        self.ip = ip
+        self.name = name
+        self.state = state
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @property
+    def ip_address(self):
+        return int_to_ip(self.ip)
+
+    def topic_name(self):
+        """
+        Short name used in MQTT topics: the first label of the hostname,
+        falling back to the IP address when the name is unknown
+        """
+        if self.name == '':
+            return self.ip_address
+        return self.name.split('.')[0]
+
+    def __repr__(self):
+        return 'HostEvent(%s, %s, %r, %r)' % (self.cause, self.ip_address, self.name, self.state)
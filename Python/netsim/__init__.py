@@ -0,0 +1,13 @@
+"""
+Simulated network for load testing the monitor and the network_info tools
+without a network.
+
+    scenario.py   virtual hosts with scripted up/down/flap/latency behaviour
+    commands.py   fing, arp and ping stand-ins answering from a scenario
+    services.py   per-host TCP listeners and Monit status pages
+    broker.py     an in-process MQTT broker
+
+Run "python3 Python/netsim --help" for the command line.
+"""
+
+from netsim.scenario import Scenario, VirtualHost
@@ -0,0 +1,123 @@
+"""
+Command line for the network simulator.
+
+    python3 Python/netsim serve <scenario> [--mqtt-port 1883] [--no-mqtt] [--stats 10]
+    python3 Python/netsim fing <scenario> --silent <block> -o log,csv
+    python3 Python/netsim arp <scenario> -a
+    python3 Python/netsim ping <scenario> -c 1 -W 2 <address>
+    python3 Python/netsim hosts <scenario> [<block>]
+    python3 Python/netsim example > sim.txt
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from netsim import commands
+from netsim.scenario import EXAMPLE, Scenario
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def usage():
+    print("Usage:")
+    print("  python3 Python/netsim serve <scenario>             # TCP listeners, Monit pages and an MQTT broker")
+    print("        --mqtt-port 1883  --no-mqtt  --stats 10       # broker port, no broker, seconds between stats")
+    print("  python3 Python/netsim fing <scenario> ...          # fing stand-in (monitor.py -F)")
+    print("  python3 Python/netsim arp <scenario> ...           # arp -a stand-in (update_network_info.py --arp-command)")
+    print("  python3 Python/netsim ping <scenario> ...          # ping stand-in (monitor.py -P, --ping-command)")
+    print("  python3 Python/netsim hosts <scenario> [<block>]   # Virtual hosts and their states now")
+    print("  python3 Python/netsim example                      # Print an example scenario")
+
+
+def serve(scenario, interval, mqtt_port):
+    import asyncio
+    import resource
+
+    from netsim.broker import MqttBroker
+    from netsim.services import SimServices
+
+    # A listener per port per host: allow as many descriptors as we may.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    async def run():
+        stop = asyncio.Event()
+        services = SimServices(scenario)
+        broker = None
+        if mqtt_port:
+            broker = MqttBroker(port=mqtt_port)
+            await broker.start()
+            print(f"MQTT broker on 127.0.0.1:{mqtt_port}")
+        task = asyncio.ensure_future(services.run(stop))
+        print(f"Serving {len(scenario)} virtual hosts")
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                up = len(scenario.up_hosts(time.time()))
+                line = f"{up}/{len(scenario)} up " + " ".join(f"{k}={v}" for k, v in services.stats().items())
+                if broker is not None:
+                    line += " mqtt " + " ".join(f"{k}={v}" for k, v in broker.stats().items())
+                print(line, flush=True)
+        finally:
+            stop.set()
+            await task
+            if broker is not None:
+                broker.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help', 'help'):
+        usage()
+        return 0 if len(sys.argv) >= 2 else 2
+
+    command = sys.argv[1]
+    if command == 'example':
+        sys.stdout.write(EXAMPLE)
+        return 0
+    if command not in ('serve', 'fing', 'arp', 'ping', 'hosts'):
+        print(f"Unknown command '{command}'")
+        usage()
+        return 2
+    if len(sys.argv) < 3:
+        print(f"Error: {command} needs a scenario file")
+        return 2
+
+    try:
+        scenario = Scenario.load(sys.argv[2])
+    except (OSError, ValueError) as e:
+        print(f"Error loading scenario {sys.argv[2]}: {e}", file=sys.stderr)
+        return 2
+
+    argv = sys.argv[3:]
+    if command == 'serve':
+        try:
+            interval = float(get_option_value('--stats') or 10)
+            mqtt_port = 0 if '--no-mqtt' in argv else int(get_option_value('--mqtt-port') or 1883)
+        except ValueError:
+            print("Error: --stats and --mqtt-port take numeric values")
+            return 2
+        return serve(scenario, interval, mqtt_port)
+    return getattr(commands, command)(scenario, argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
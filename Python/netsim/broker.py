@@ -0,0 +1,212 @@
+"""
+A small in-process MQTT 3.1.1 broker for load tests.
+
+Enough of the protocol for paho-mqtt clients such as monitor.py's sinks,
+agents and aggregator: CONNECT, PUBLISH at QoS 0 and 1 (QoS 2 is
+acknowledged but delivered as QoS 1), SUBSCRIBE/UNSUBSCRIBE with + and #
+wildcards, retained messages, PINGREQ and DISCONNECT.  Nothing is
+persisted, there is no authentication and delivery to a subscriber is not
+retried; it exists to count what the tools publish and pass it on.
+"""
+
+import asyncio
+import struct
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+DEFAULT_PORT = 1883
+
+_U16 = struct.Struct('!H')
+
+
+def topic_matches(pattern, topic):
+    """
+    Whether a subscription filter (with + and # wildcards) matches a topic
+    """
+    filter_levels = pattern.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _packet(kind, flags, body=b''):
+    length = len(body)
+    header = bytearray([kind << 4 | flags])
+    while True:
+        byte = length & 0x7f
+        length >>= 7
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            break
+    return bytes(header) + body
+
+
+def _string(data, offset):
+    length = _U16.unpack_from(data, offset)[0]
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = ''
+        self.subscriptions = {}
+        self.next_id = 0
+
+    def packet_id(self):
+        self.next_id = self.next_id % 0xffff + 1
+        return self.next_id
+
+
+class MqttBroker:
+    """
+    Accepts MQTT clients on host:port and routes their messages
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.clients = set()
+        self.retained = {}
+        self.connects = 0
+        self.received = 0
+        self.delivered = 0
+        self.topics = {}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port, reuse_address=True)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for client in list(self.clients):
+            client.writer.close()
+
+    async def _read_packet(self, reader):
+        first = await reader.readexactly(1)
+        length = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+            if shift > 21:
+                raise ValueError("malformed remaining length")
+        return first[0] >> 4, first[0] & 0x0f, await reader.readexactly(length)
+
+    async def _serve(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                kind, flags, body = await self._read_packet(reader)
+                if kind == CONNECT:
+                    self.connects += 1
+                    _, offset = _string(body, 0)
+                    # protocol level, connect flags, keep alive
+                    client_id, _ = _string(body, offset + 4)
+                    client.client_id = client_id.decode('utf-8', 'replace')
+                    writer.write(_packet(CONNACK, 0, b'\x00\x00'))
+                elif kind == PUBLISH:
+                    self._publish(client, flags, body)
+                elif kind == PUBREL:
+                    writer.write(_packet(PUBCOMP, 0, body[:2]))
+                elif kind == SUBSCRIBE:
+                    self._subscribe(client, body)
+                elif kind == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        pattern, offset = _string(body, offset)
+                        client.subscriptions.pop(pattern.decode('utf-8', 'replace'), None)
+                    writer.write(_packet(UNSUBACK, 0, body[:2]))
+                elif kind == PINGREQ:
+                    writer.write(_packet(PINGRESP, 0))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    def _publish(self, client, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic, offset = _string(body, 0)
+        topic = topic.decode('utf-8', 'replace')
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            client.writer.write(_packet(PUBACK if qos == 1 else PUBREC, 0, packet_id))
+        payload = body[offset:]
+
+        self.received += 1
+        self.topics[topic] = self.topics.get(topic, 0) + 1
+        if flags & 0x01:
+            if payload:
+                self.retained[topic] = (payload, min(qos, 1))
+            else:
+                self.retained.pop(topic, None)
+        for subscriber in list(self.clients):
+            granted = max((q for pattern, q in subscriber.subscriptions.items() if topic_matches(pattern, topic)),
+                          default=None)
+            if granted is not None:
+                self._deliver(subscriber, topic, payload, min(qos, granted))
+
+    def _deliver(self, subscriber, topic, payload, qos, retain=False):
+        name = topic.encode('utf-8')
+        body = _U16.pack(len(name)) + name
+        if qos:
+            body += _U16.pack(subscriber.packet_id())
+        subscriber.writer.write(_packet(PUBLISH, (qos << 1) | int(retain), body + payload))
+        self.delivered += 1
+
+    def _subscribe(self, client, body):
+        packet_id = body[:2]
+        offset = 2
+        granted = []
+        new = []
+        while offset < len(body):
+            pattern, offset = _string(body, offset)
+            qos = min(body[offset] & 0x03, 1)
+            offset += 1
+            pattern = pattern.decode('utf-8', 'replace')
+            client.subscriptions[pattern] = qos
+            granted.append(qos)
+            new.append((pattern, qos))
+        client.writer.write(_packet(SUBACK, 0, packet_id + bytes(granted)))
+        for topic, (payload, qos) in self.retained.items():
+            matched = [q for pattern, q in new if topic_matches(pattern, topic)]
+            if matched:
+                self._deliver(client, topic, payload, min(qos, max(matched)), retain=True)
+
+    def stats(self):
+        return {
+            'clients': len(self.clients),
+            'connects': self.connects,
+            'received': self.received,
+            'delivered': self.delivered,
+            'topics': len(self.topics),
+        }
@@ -0,0 +1,143 @@
+"""
+Stand-ins for the fing, arp and ping commands, answering from a scenario.
+
+Each takes the scenario file first and then the arguments the real
+command gets from the tools, so it can be put in their place:
+
+    monitor.py -F "python3 Python/netsim fing sim.txt" -P "python3 Python/netsim ping sim.txt" ...
+    update_network_info.py --arp-command "python3 Python/netsim arp sim.txt" \\
+                           --ping-command "python3 Python/netsim ping sim.txt"
+
+and prints what the real command would for the virtual hosts.
+"""
+
+import random
+import sys
+import time
+
+from host_table import int_to_mac, ip_to_int
+
+FING_TIME_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+
+def fing_line(host, state, now):
+    return ';'.join((time.strftime(FING_TIME_FORMAT, time.localtime(now)), state, host.ip_address, '',
+                     host.name, int_to_mac(host.mac), host.maker))
+
+
+def fing(scenario, argv, tick=1.0, until=None):
+    """
+    fing --silent <block> -o log,csv: the hosts up now, then every change
+    as it happens, until interrupted (or until the time until)
+    """
+    blocks = [arg for arg in argv if not arg.startswith('-') and '.' in arg]
+    if not blocks:
+        print("netsim fing: no network to scan", file=sys.stderr)
+        return 2
+    block = blocks[0] if '/' in blocks[0] else blocks[0] + '/24'
+    hosts = scenario.in_block(block)
+
+    now = time.time()
+    states = {}
+    for host in hosts:
+        states[host.ip] = host.is_up(now)
+        if states[host.ip]:
+            print(fing_line(host, 'up', now))
+    sys.stdout.flush()
+
+    try:
+        while until is None or now < until:
+            time.sleep(tick)
+            now = time.time()
+            for host in hosts:
+                up = host.is_up(now)
+                if up != states[host.ip]:
+                    states[host.ip] = up
+                    print(fing_line(host, 'up' if up else 'down', now))
+            sys.stdout.flush()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    return 0
+
+
+def arp(scenario, argv):
+    """
+    arp -a: an entry for each host up now, <incomplete> for the rest, as
+    the kernel shows hosts that stopped answering
+    """
+    now = time.time()
+    lines = []
+    for host in scenario:
+        if host.is_up(now):
+            lines.append(f"{host.name} ({host.ip_address}) at {int_to_mac(host.mac)} [ether] on sim0")
+        else:
+            lines.append(f"? ({host.ip_address}) at <incomplete> on sim0")
+    sys.stdout.write('\n'.join(lines) + '\n')
+    return 0
+
+
+def ping(scenario, argv):
+    """
+    ping -c <count> -W <timeout> <address>: takes as long as the real
+    thing and exits 0 if any reply came back
+    """
+    count = 1
+    timeout = 10.0
+    address = None
+    args = iter(argv)
+    for arg in args:
+        if arg == '-c':
+            count = int(next(args, '1'))
+        elif arg == '-W':
+            timeout = float(next(args, '10'))
+        elif not arg.startswith('-'):
+            address = arg
+    if address is None:
+        print("ping: usage error: Destination address required", file=sys.stderr)
+        return 2
+
+    try:
+        host = scenario.get(ip_to_int(address))
+    except OSError:
+        print(f"ping: {address}: Name or service not known", file=sys.stderr)
+        return 2
+
+    print(f"PING {address} ({address}) 56(84) bytes of data.")
+    received = []
+    rng = random.Random()
+    for seq in range(1, count + 1):
+        rtt = host.rtt(time.time(), rng) if host is not None else None
+        if rtt is None or rtt > timeout:
+            time.sleep(timeout)
+            continue
+        time.sleep(rtt)
+        received.append(rtt * 1000)
+        print(f"64 bytes from {address}: icmp_seq={seq} ttl=64 time={rtt * 1000:.3g} ms")
+
+    print()
+    print(f"--- {address} ping statistics ---")
+    loss = 100 * (count - len(received)) // count
+    print(f"{count} packets transmitted, {len(received)} received, {loss}% packet loss")
+    if received:
+        print(f"rtt min/avg/max/mdev = {min(received):.3f}/{sum(received) / len(received):.3f}/"
+              f"{max(received):.3f}/0.000 ms")
+    return 0 if received else 1
+
+
+def hosts(scenario, argv):
+    """
+    Every virtual host and its state now
+    """
+    block = next((arg for arg in argv if '/' in arg), None)
+    now = time.time()
+    selected = scenario.in_block(block) if block else sorted(scenario, key=lambda host: host.ip)
+    up = 0
+    for host in selected:
+        state = 'up' if host.is_up(now) else 'down'
+        up += state == 'up'
+        change = host.next_change(now)
+        until = f" until {time.strftime('%H:%M:%S', time.localtime(change))}" if change else ''
+        ports = ','.join(map(str, host.ports))
+        print(f"{host.ip_address:<15} {host.name:<24} {host.behaviour:<12} {state:<4}{until:<15} {ports}")
+    print(f"{len(selected)} hosts, {up} up")
+    return 0
@@ -0,0 +1,254 @@
+"""
+Virtual hosts and the scenario files that describe them.
+
+A scenario file has one line per group of hosts: a behaviour, the address
+block the hosts are taken from, and options.
+
+    # behaviour    block             options
+    seed 7
+    up             127.20.0.0/20     count=3000 latency=2 jitter=1 ports=22,80
+    flap           127.20.16.0/24    count=200 period=120 duty=0.5 monit
+    intermittent   127.20.17.0/24    count=50 period=60 p=0.7 loss=0.1
+    degrade        127.20.18.0/24    count=20 period=300 duty=0.2 latency=5 spike=400
+    down           127.20.19.0/24    count=10
+
+    up            always up
+    down          never answers
+    flap          up for duty of every period seconds, down for the rest
+    intermittent  each period seconds, up with probability p
+    degrade       always up, but answering in spike ms for duty of every period
+
+    count=N       hosts in the group (default: the whole block)
+    latency=MS    round-trip time, jitter=MS random spread around it
+    loss=F        fraction of probes lost while up
+    ports=P,...   TCP ports listening while up (netsim serve)
+    monit         a Monit status page on 2812 while up (netsim serve)
+    name=TEXT     host name, {a}.{b}.{c}.{d} are replaced by the address
+                  octets (default h{a}-{b}-{c}-{d}.sim)
+    maker=TEXT    vendor reported by fing (default Netsim)
+
+Hosts are taken from the start of each block, skipping the network address
+and addresses an earlier line already used.  Every host's state at any
+moment is a function of the wall clock, the seed and its address only, so
+separate processes (the fing, arp and ping stand-ins and netsim serve)
+agree on it without talking to each other.  The block 127.0.0.0/8 is all
+loopback on Linux, which lets netsim serve listen on each host's own
+address.
+"""
+
+import random
+
+from host_table import cidr_range, int_to_ip
+
+BEHAVIOURS = ('up', 'down', 'flap', 'intermittent', 'degrade')
+
+DEFAULT_PERIOD = 60.0
+DEFAULT_DUTY = 0.5
+DEFAULT_P = 0.5
+DEFAULT_LATENCY = 1.0
+DEFAULT_NAME = 'h{a}-{b}-{c}-{d}.sim'
+DEFAULT_MAKER = 'Netsim'
+
+MONIT_PORT = 2812
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix(value):
+    """
+    splitmix64: a well spread 64-bit hash of an integer
+    """
+    value = (value + 0x9e3779b97f4a7c15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return value ^ (value >> 31)
+
+
+class VirtualHost:
+    """
+    One simulated device and its scripted behaviour
+    """
+    __slots__ = ('ip', 'mac', 'name', 'maker', 'behaviour', 'period', 'duty', 'p',
+                 'latency', 'jitter', 'loss', 'spike', 'ports', 'phase', 'seed')
+
+    def __init__(self, ip, behaviour='up', seed=0, period=DEFAULT_PERIOD, duty=DEFAULT_DUTY, p=DEFAULT_P,
+                 latency=DEFAULT_LATENCY, jitter=0.0, loss=0.0, spike=None, ports=(),
+                 name=DEFAULT_NAME, maker=DEFAULT_MAKER):
+        if behaviour not in BEHAVIOURS:
+            raise ValueError(f"unknown behaviour '{behaviour}'")
+        if period <= 0:
+            raise ValueError("period must be positive")
+        self.ip = ip
+        # Locally administered, derived from the address so it is stable.
+        self.mac = 0x020000000000 | ip
+        octets = dict(zip('abcd', int_to_ip(ip).split('.')))
+        self.name = name.format(**octets)
+        self.maker = maker
+        self.behaviour = behaviour
+        self.period = float(period)
+        self.duty = float(duty)
+        self.p = float(p)
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.loss = float(loss)
+        self.spike = self.latency * 10 if spike is None else float(spike)
+        self.ports = tuple(ports)
+        self.seed = seed
+        self.phase = _mix(seed << 32 | ip) % int(self.period * 1000) / 1000.0
+
+    @property
+    def ip_address(self):
+        return int_to_ip(self.ip)
+
+    def _in_duty(self, now):
+        return (now + self.phase) % self.period < self.duty * self.period
+
+    def is_up(self, now):
+        if self.behaviour == 'down':
+            return False
+        if self.behaviour == 'flap':
+            return self._in_duty(now)
+        if self.behaviour == 'intermittent':
+            slot = int((now + self.phase) // self.period)
+            return _mix((self.seed << 48) ^ (slot << 32) ^ self.ip) / _MASK64 < self.p
+        return True
+
+    def rtt(self, now, rng=random):
+        """
+        Round-trip time in seconds of one probe at now, None when it gets no answer
+        """
+        if not self.is_up(now) or (self.loss and rng.random() < self.loss):
+            return None
+        latency = self.latency
+        if self.behaviour == 'degrade' and self._in_duty(now):
+            latency = self.spike
+        if self.jitter:
+            latency = max(0.01, rng.gauss(latency, self.jitter))
+        return latency / 1000.0
+
+    def next_change(self, now):
+        """
+        Time of the next scripted state change after now (None if never)
+        """
+        if self.behaviour in ('up', 'down', 'degrade'):
+            return None
+        if self.behaviour == 'intermittent':
+            return now + self.period - (now + self.phase) % self.period
+        offset = (now + self.phase) % self.period
+        edge = self.duty * self.period
+        return now + (edge - offset if offset < edge else self.period - offset)
+
+    def __repr__(self):
+        return f"VirtualHost({self.ip_address}, {self.behaviour})"
+
+
+class Scenario:
+    """
+    A set of virtual hosts, keyed by integer IP
+    """
+
+    def __init__(self, hosts=(), seed=0):
+        self.seed = seed
+        self.hosts = {}
+        for host in hosts:
+            self.add(host)
+
+    def add(self, host):
+        self.hosts[host.ip] = host
+        return host
+
+    def get(self, ip):
+        return self.hosts.get(ip)
+
+    def in_block(self, cidr):
+        """
+        Hosts inside a CIDR block, in address order
+        """
+        first, last = cidr_range(cidr)
+        return [self.hosts[ip] for ip in sorted(self.hosts) if first <= ip <= last]
+
+    def up_hosts(self, now):
+        return [host for host in self.hosts.values() if host.is_up(now)]
+
+    def __iter__(self):
+        return iter(self.hosts.values())
+
+    def __len__(self):
+        return len(self.hosts)
+
+    @classmethod
+    def parse(cls, lines):
+        """
+        Build a scenario from the lines of a scenario file
+        Raises ValueError naming the offending line
+        """
+        scenario = cls()
+        for number, text in enumerate(lines, 1):
+            text = text.split('#', 1)[0].strip()
+            if not text:
+                continue
+            try:
+                scenario._parse_line(text)
+            except ValueError as e:
+                raise ValueError(f"line {number}: {e}")
+        return scenario
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.parse(f)
+
+    def _parse_line(self, text):
+        words = text.split()
+        if words[0] == 'seed':
+            if len(words) != 2:
+                raise ValueError("seed takes one number")
+            self.seed = int(words[1])
+            return
+        if len(words) < 2:
+            raise ValueError("expected <behaviour> <block> [options]")
+
+        behaviour, block = words[0], words[1]
+        options = {}
+        for word in words[2:]:
+            key, sep, value = word.partition('=')
+            options[key] = value if sep else True
+
+        first, last = cidr_range(block)
+        if last - first >= 2:
+            first += 1
+        count = int(options.pop('count', last - first + 1))
+
+        settings = {}
+        for key in ('period', 'duty', 'p', 'latency', 'jitter', 'loss', 'spike'):
+            if key in options:
+                settings[key] = float(options.pop(key))
+        ports = [int(port) for port in str(options.pop('ports', '')).split(',') if port]
+        if options.pop('monit', False):
+            ports.append(MONIT_PORT)
+        for key in ('name', 'maker'):
+            if key in options:
+                settings[key] = options.pop(key)
+        if options:
+            raise ValueError(f"unknown option {', '.join(sorted(options))}")
+
+        added = 0
+        ip = first
+        while added < count and ip <= last:
+            if ip not in self.hosts:
+                self.add(VirtualHost(ip, behaviour, self.seed, ports=ports, **settings))
+                added += 1
+            ip += 1
+        if added < count:
+            raise ValueError(f"{block} has room for only {added} more hosts")
+
+
+EXAMPLE = """\
+# netsim scenario: <behaviour> <block> [options]; see Python/netsim/scenario.py
+seed 1
+up             127.20.0.0/20    count=2500 latency=2 jitter=1 ports=22,80
+flap           127.20.16.0/24   count=200 period=120 duty=0.5 ports=80
+intermittent   127.20.17.0/24   count=100 period=60 p=0.8 loss=0.05
+degrade        127.20.18.0/24   count=50 period=300 duty=0.2 latency=5 spike=400 monit
+down           127.20.19.0/24   count=50
+"""
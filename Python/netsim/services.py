@@ -0,0 +1,152 @@
+"""
+TCP listeners and Monit status pages for the virtual hosts.
+
+Every host with ports gets a listener on its own address for each port
+while it is up; when the scenario takes it down the listeners close, so
+connections are refused as they would be by a host that is down.  What a
+connection gets depends on the port:
+
+    2812    Monit's HTTP interface: /_status?format=xml behind basic auth
+            (admin/monit), as getFromMonit.sh and tst.py read it
+    80, 8080, 443 and other HTTP ports
+            a minimal HTTP/1.0 200 response
+    any other
+            an SSH style banner line, then the connection is closed
+
+Responses are delayed by the host's current round-trip time.
+"""
+
+import asyncio
+import base64
+import random
+import time
+
+from netsim.scenario import MONIT_PORT
+
+HTTP_PORTS = (80, 443, 8000, 8080, 8443)
+MONIT_USER = 'admin'
+MONIT_PASSWORD = 'monit'
+
+_MONIT_XML = """<?xml version="1.0" encoding="ISO-8859-1"?>\
+<monit><server><id>{id:032x}</id><incarnation>{started}</incarnation><version>5.26.0</version>\
+<uptime>{uptime}</uptime><poll>30</poll><startdelay>0</startdelay><localhostname>{name}</localhostname>\
+<controlfile>/etc/monit/monitrc</controlfile><httpd><address>{ip}</address><port>{port}</port><ssl>0</ssl></httpd>\
+</server><platform><name>Linux</name><release>6.1.0</release><version>#1 SMP</version><machine>aarch64</machine>\
+<cpu>4</cpu><memory>3884224</memory><swap>102396</swap></platform>\
+<service type="5"><name>{name}</name><collected_sec>{now}</collected_sec><collected_usec>0</collected_usec>\
+<status>0</status><status_hint>0</status_hint><monitor>1</monitor><monitormode>0</monitormode>\
+<onreboot>0</onreboot><pendingaction>0</pendingaction><system><load><avg01>{load:.2f}</avg01>\
+<avg05>{load:.2f}</avg05><avg15>{load:.2f}</avg15></load><cpu><user>{cpu:.1f}</user><system>1.2</system>\
+<wait>0.0</wait></cpu><memory><percent>{memory:.1f}</percent><kilobyte>{kilobytes}</kilobyte></memory>\
+<swap><percent>0.0</percent><kilobyte>0</kilobyte></swap></system></service></monit>"""
+
+
+class SimServices:
+    """
+    Opens and closes each host's listeners as its state changes
+    """
+
+    def __init__(self, scenario, tick=1.0):
+        self.scenario = scenario
+        self.tick = tick
+        self.started = int(time.time())
+        self.listeners = {}
+        self.connections = 0
+        self.monit_requests = 0
+        self.refused_auth = 0
+        self.bind_errors = 0
+        self.rng = random.Random()
+
+    async def reconcile(self):
+        now = time.time()
+        for host in self.scenario:
+            if not host.ports:
+                continue
+            up = host.is_up(now)
+            for port in host.ports:
+                key = (host.ip, port)
+                server = self.listeners.get(key)
+                if up and server is None:
+                    try:
+                        self.listeners[key] = await asyncio.start_server(
+                            lambda reader, writer, host=host, port=port: self.handle(reader, writer, host, port),
+                            host.ip_address, port, reuse_address=True, backlog=64)
+                    except OSError:
+                        self.bind_errors += 1
+                elif not up and server is not None:
+                    server.close()
+                    del self.listeners[key]
+
+    async def run(self, stop):
+        """
+        Keep the listeners in step with the scenario until the asyncio.Event stop is set
+        """
+        try:
+            while not stop.is_set():
+                await self.reconcile()
+                try:
+                    await asyncio.wait_for(stop.wait(), self.tick)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for server in self.listeners.values():
+                server.close()
+            self.listeners.clear()
+
+    async def handle(self, reader, writer, host, port):
+        self.connections += 1
+        try:
+            rtt = host.rtt(time.time(), self.rng)
+            if rtt is None:
+                # Lost: leave the client waiting for its own timeout.
+                await asyncio.sleep(30)
+                return
+            await asyncio.sleep(rtt)
+            if port == MONIT_PORT:
+                await self.monit(reader, writer, host, port)
+            elif port in HTTP_PORTS:
+                await reader.readuntil(b'\r\n\r\n')
+                body = f"<html><body>{host.name}</body></html>\n".encode()
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/html\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            else:
+                writer.write(b"SSH-2.0-OpenSSH_9.2p1 netsim\r\n")
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def monit(self, reader, writer, host, port):
+        request = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+        path = request.split(' ', 2)[1] if request.count(' ') >= 2 else '/'
+        expected = 'Basic ' + base64.b64encode(f"{MONIT_USER}:{MONIT_PASSWORD}".encode()).decode()
+        authorized = any(line.lower().startswith('authorization:') and line.split(':', 1)[1].strip() == expected
+                         for line in request.split('\r\n'))
+        if not authorized:
+            self.refused_auth += 1
+            writer.write(b'HTTP/1.0 401 Unauthorized\r\nWWW-Authenticate: Basic realm="monit"\r\n'
+                         b'Content-Length: 0\r\n\r\n')
+            return
+        if not path.startswith('/_status'):
+            writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            return
+
+        self.monit_requests += 1
+        now = int(time.time())
+        body = _MONIT_XML.format(id=host.mac, started=self.started, uptime=now - self.started + 86400,
+                                 name=host.name, ip=host.ip_address, port=port, now=now,
+                                 load=self.rng.uniform(0, 2), cpu=self.rng.uniform(0, 40),
+                                 memory=self.rng.uniform(10, 80), kilobytes=self.rng.randrange(100000, 3000000))
+        data = body.encode('latin-1')
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/xml\r\nContent-Length: %d\r\n\r\n%s"
+                     % (len(data), data))
+
+    def stats(self):
+        return {
+            'listeners': len(self.listeners),
+            'connections': self.connections,
+            'monit_requests': self.monit_requests,
+            'refused_auth': self.refused_auth,
+            'bind_errors': self.bind_errors,
+        }
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+Notify/check policy for newly discovered nodes.
+
+Instead of fixing notify and checkport after the fact with fixData.sql, a
+rules file is matched against every node monitor.py inserts.  One rule per
+line: one or more conditions, all of which must match, followed by the
+settings to apply.
+
+    # conditions                       settings
+    name:Galaxy*.lan                   notify=NO
+    name:re:^(punch|labpi|rpi3)\.lan$  checkport=2812
+    mac:b8:27:eb                       checkport=2812
+    vendor:*Raspberry*                 checkport=2812
+    cidr:192.168.10.200/29             notify=NO
+
+    name, vendor  shell style glob, or re:<regex>; case insensitive, like LIKE
+    mac           MAC address prefix, one to six octets
+    cidr          address block
+
+A '#' at the start of a line or after whitespace begins a comment; inside
+a pattern (e.g. name:re:^lab#[0-9]+$) it is part of the pattern.
+
+Rules are applied in file order, so a later rule overrides an earlier one,
+as later statements in fixData.sql did.  Settings a node matches no rule for
+keep the node table defaults.
+
+The file is compiled once and recompiled only when its modification time
+changes, so it can be edited while the daemon runs.
+"""
+
+import fnmatch
+import os
+import re
+import sys
+import time
+
+from host_table import cidr_range, ip_to_int, mac_to_int
+
+SETTINGS = ('notify', 'checkport')
+
+# Comments start at a '#' that begins a token.
+_COMMENT = re.compile(r'(?:^|\s)#')
+
+
+class PolicyRule:
+    """
+    One compiled line of a rules file
+    """
+    __slots__ = ('line', 'name', 'vendor', 'mac_prefix', 'mac_mask', 'first', 'last', 'settings')
+
+    def __init__(self, line):
+        self.line = line
+        self.name = None
+        self.vendor = None
+        self.mac_prefix = None
+        self.mac_mask = 0
+        self.first = None
+        self.last = None
+        self.settings = {}
+
+    def matches(self, ip, mac, name, vendor):
+        if self.first is not None and not self.first <= ip <= self.last:
+            return False
+        if self.mac_prefix is not None and mac & self.mac_mask != self.mac_prefix:
+            return False
+        if self.name is not None and not self.name.match(name or ''):
+            return False
+        if self.vendor is not None and not self.vendor.match(vendor or ''):
+            return False
+        return True
+
+
+def _compile_pattern(pattern):
+    if pattern.startswith('re:'):
+        return re.compile(pattern[3:], re.IGNORECASE)
+    return re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+
+
+def _parse_setting(key, value):
+    if key == 'notify':
+        value = value.upper()
+        if value not in ('YES', 'NO'):
+            raise ValueError(f"notify must be YES or NO, not '{value}'")
+        return value
+    if key == 'checkport':
+        port = int(value)
+        if not 0 <= port <= 65535:
+            raise ValueError(f"checkport {port} out of range")
+        return port
+    raise ValueError(f"unknown setting '{key}'")
+
+
+def compile_rules(lines):
+    """
+    Compile rules file lines into a list of PolicyRule
+    Raises ValueError naming the offending line
+    """
+    rules = []
+    for number, text in enumerate(lines, 1):
+        text = _COMMENT.split(text, 1)[0].strip()
+        if not text:
+            continue
+
+        rule = PolicyRule(number)
+        try:
+            for token in text.split():
+                field, sep, pattern = token.partition(':')
+                if sep and field in ('name', 'vendor', 'mac', 'cidr'):
+                    if field == 'name':
+                        rule.name = _compile_pattern(pattern)
+                    elif field == 'vendor':
+                        rule.vendor = _compile_pattern(pattern)
+                    elif field == 'mac':
+                        octets = [int(octet, 16) for octet in pattern.replace('-', ':').rstrip(':*').split(':')]
+                        if not 1 <= len(octets) <= 6 or max(octets) > 255:
+                            raise ValueError(f"bad MAC prefix '{pattern}'")
+                        shift = 8 * (6 - len(octets))
+                        rule.mac_prefix = int.from_bytes(bytes(octets), 'big') << shift
+                        rule.mac_mask = ((1 << 48) - 1) ^ ((1 << shift) - 1)
+                    else:
+                        rule.first, rule.last = cidr_range(pattern)
+                    continue
+
+                key, sep, value = token.partition('=')
+                if not sep:
+                    raise ValueError(f"expected condition or setting, not '{token}'")
+                rule.settings[key.lower()] = _parse_setting(key.lower(), value)
+        except (re.error, ValueError) as e:
+            raise ValueError(f"line {number}: {e}")
+
+        if not rule.settings:
+            raise ValueError(f"line {number}: rule has no settings")
+        rules.append(rule)
+    return rules
+
+
+def apply_rules(rules, ip, mac, name, vendor):
+    """
+    Settings for a node: {'notify': 'YES'|'NO', 'checkport': int}, only the
+    keys some rule set
+    """
+    settings = {}
+    for rule in rules:
+        if rule.matches(ip, mac, name, vendor):
+            settings.update(rule.settings)
+    return settings
+
+
+class PolicyFile:
+    """
+    A rules file, recompiled when it changes on disk
+
+    A missing file means no rules.  If an edited file does not compile, the
+    previous rules stay in force and the error is printed.
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.rules = []
+        self.mtime = None
+        self.next_check = 0
+        self.reload()
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self.mtime is not None:
+                print(f"Policy file {self.path} removed, no rules")
+            self.rules = []
+            self.mtime = None
+            return
+
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path) as f:
+                rules = compile_rules(f)
+        except (OSError, ValueError) as e:
+            print(f"Policy file {self.path} not loaded: {e}")
+        else:
+            self.rules = rules
+            print(f"Loaded {len(rules)} policy rules from {self.path}")
+        self.mtime = mtime
+
+    def match(self, ip, mac, name, vendor):
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.check_interval
+            self.reload()
+        return apply_rules(self.rules, ip, mac, name, vendor)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: node_policy.py <rules file> <ip address> [<name> [<mac address> [<vendor>]]]")
+        sys.exit(2)
+
+    args = sys.argv[2:] + [''] * 3
+    with open(sys.argv[1]) as f:
+        rules = compile_rules(f)
+    print(apply_rules(rules, ip_to_int(args[0]), mac_to_int(args[2]), args[1], args[3]))
+
+
+if __name__ == "__main__":
+    main()
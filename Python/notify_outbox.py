@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""
+Durable on-disk outbox for notifications.
+
+The ingest path appends events to segment files and returns immediately; it
+never waits for the broker.  A dispatcher thread reads batches from the
+delivered-up-to cursor, hands them to a deliver() callable and advances the
+cursor only when delivery succeeded, so every event is delivered at least
+once, including events left over from before a crash.
+
+An outbox can have several readers, each with a cursor of its own (one per
+notification sink), so each advances as fast as its own deliveries succeed.
+
+Directory layout:
+
+    00000001.seg ...   segments, each a sequence of records
+                       (length u32, crc32 u32, payload)
+    cursor             delivered position of the default reader:
+                       segment number u32, offset u32
+    cursor-<reader>    the same for a named reader
+
+Segments wholly before every reader's cursor are deleted (compaction).  A
+named reader without a cursor file yet starts where the default cursor is,
+so adding readers to an existing outbox neither loses nor repeats events.
+Total disk use is bounded by max_bytes; beyond that the oldest undelivered
+segments are dropped and counted.  A torn record at the end of the newest
+segment (crash mid-write) is truncated on open.
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+
+from host_table import HostEvent
+
+DEFAULT_SEGMENT_BYTES = 1024 * 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_RECORD_HEADER = struct.Struct('!II')
+_CURSOR = struct.Struct('!II')
+_EVENT = struct.Struct('!Id')
+
+
+def pack_event(event):
+    """
+    Serialise a HostEvent for the outbox
+    """
+    parts = [_EVENT.pack(event.ip, event.timestamp)]
+    for text in (event.cause, event.name, event.state):
+        data = (text or '').encode('utf-8')[:255]
+        parts.append(bytes((len(data),)) + data)
+    return b''.join(parts)
+
+
+def unpack_event(data):
+    """
+    Inverse of pack_event()
+    """
+    ip, timestamp = _EVENT.unpack_from(data, 0)
+    offset = _EVENT.size
+    texts = []
+    for _ in range(3):
+        length = data[offset]
+        offset += 1
+        texts.append(data[offset:offset + length].decode('utf-8', 'replace'))
+        offset += length
+    cause, name, state = texts
+    return HostEvent(cause, ip, name, state, timestamp)
+
+
+class Outbox:
+    """
+    Append-only segmented log with a delivery cursor
+    """
+
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES, max_bytes=DEFAULT_MAX_BYTES, readers=('',)):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.appended = threading.Condition(self.lock)
+        self.dropped_segments = 0
+        self.appended_records = 0
+        self.delivered_records = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory)
+                               if name.endswith('.seg') and name[:-4].isdigit())
+        default = self._read_cursor('')
+        self.cursors = {}
+        for reader in readers:
+            cursor = self._read_cursor(reader) if reader else default
+            self.cursors[reader] = cursor if cursor is not None else default
+
+        if not self.segments:
+            self.segments.append(max(1, min(cursor[0] for cursor in self.cursors.values())))
+        for reader, cursor in self.cursors.items():
+            if cursor[0] < self.segments[0] or cursor[0] > self.segments[-1]:
+                self.cursors[reader] = (self.segments[0], 0)
+
+        self._recover_tail()
+        self.active = open(self._path(self.segments[-1]), 'ab')
+
+    def _path(self, segment):
+        return os.path.join(self.directory, '%08d.seg' % segment)
+
+    def _cursor_path(self, reader):
+        return os.path.join(self.directory, 'cursor-' + reader if reader else 'cursor')
+
+    def _read_cursor(self, reader):
+        # (0, 0) for a missing default cursor, None for a missing named one.
+        try:
+            with open(self._cursor_path(reader), 'rb') as f:
+                return _CURSOR.unpack(f.read(_CURSOR.size))
+        except (OSError, struct.error):
+            return None if reader else (0, 0)
+
+    def _write_cursor(self, reader):
+        path = self._cursor_path(reader)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_CURSOR.pack(*self.cursors[reader]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _recover_tail(self):
+        # Truncate a partially written record left by a crash.
+        path = self._path(self.segments[-1])
+        if not os.path.exists(path):
+            return
+        with open(path, 'r+b') as f:
+            data = f.read()
+            offset = 0
+            while offset + _RECORD_HEADER.size <= len(data):
+                length, crc = _RECORD_HEADER.unpack_from(data, offset)
+                end = offset + _RECORD_HEADER.size + length
+                if end > len(data) or zlib.crc32(data[offset + _RECORD_HEADER.size:end]) != crc:
+                    break
+                offset = end
+            if offset != len(data):
+                f.truncate(offset)
+
+    def disk_bytes(self):
+        total = 0
+        for segment in self.segments:
+            try:
+                total += os.path.getsize(self._path(segment))
+            except OSError:
+                pass
+        return total
+
+    def append(self, payload):
+        """
+        Append one record; never blocks on delivery
+        """
+        record = _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.active.tell() + len(record) > self.segment_bytes and self.active.tell() > 0:
+                self._roll()
+            self.active.write(record)
+            self.active.flush()
+            self.appended_records += 1
+            self.appended.notify_all()
+
+    def _roll(self):
+        self.active.flush()
+        os.fsync(self.active.fileno())
+        self.active.close()
+        self.segments.append(self.segments[-1] + 1)
+        self.active = open(self._path(self.segments[-1]), 'ab')
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        # Drop the oldest segments, delivered or not, to stay within max_bytes.
+        while len(self.segments) > 1 and self.disk_bytes() > self.max_bytes:
+            oldest = self.segments.pop(0)
+            os.remove(self._path(oldest))
+            self.dropped_segments += 1
+            for reader, cursor in self.cursors.items():
+                if cursor[0] <= oldest:
+                    self.cursors[reader] = (self.segments[0], 0)
+                    self._write_cursor(reader)
+
+    def sync(self):
+        with self.lock:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+
+    def read_batch(self, max_records=100, timeout=None, reader=''):
+        """
+        Read up to max_records payloads the reader has not yet delivered
+        Waits up to timeout seconds for something to arrive when empty
+        Returns (payloads, position) where position is passed to commit()
+        """
+        with self.lock:
+            payloads, position = self._read(max_records, reader)
+            if not payloads and timeout:
+                self.appended.wait(timeout)
+                payloads, position = self._read(max_records, reader)
+        return payloads, position
+
+    def _read(self, max_records, reader):
+        self.active.flush()
+        segment, offset = self.cursors[reader]
+        payloads = []
+        while len(payloads) < max_records:
+            try:
+                with open(self._path(segment), 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            pos = 0
+            while len(payloads) < max_records and pos + _RECORD_HEADER.size <= len(data):
+                length, crc = _RECORD_HEADER.unpack_from(data, pos)
+                end = pos + _RECORD_HEADER.size + length
+                if end > len(data):
+                    break
+                payloads.append(data[pos + _RECORD_HEADER.size:end])
+                pos = end
+            offset += pos
+            if len(payloads) >= max_records or segment >= self.segments[-1]:
+                break
+            segment += 1
+            offset = 0
+        return payloads, (segment, offset)
+
+    def commit(self, position, reader=''):
+        """
+        Mark everything before position delivered by the reader and delete
+        the segments every reader has finished with
+        """
+        with self.lock:
+            if position < self.cursors[reader]:
+                # Segments were dropped underneath this batch.
+                return
+            self.cursors[reader] = position
+            self._write_cursor(reader)
+            done = min(cursor[0] for cursor in self.cursors.values())
+            while self.segments[0] < done:
+                os.remove(self._path(self.segments.pop(0)))
+
+    def close(self):
+        with self.lock:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            self.active.close()
+
+
+class OutboxDispatcher(threading.Thread):
+    """
+    Drains an Outbox, through one reader's cursor, to deliver(list of
+    payloads) -> bool in batches
+
+    A failed delivery is retried with exponential backoff (up to max_backoff
+    seconds); the batch stays in the outbox until deliver() returns True.
+    """
+
+    def __init__(self, outbox, deliver, batch_size=100, max_backoff=30.0, sync_interval=1.0, reader=''):
+        threading.Thread.__init__(self, name="outbox-dispatcher" + ('-' + reader if reader else ''), daemon=True)
+        self.outbox = outbox
+        self.deliver = deliver
+        self.reader = reader
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.sync_interval = sync_interval
+        self.stopped = threading.Event()
+        self.failures = 0
+
+    def run(self):
+        backoff = 0.5
+        last_sync = time.monotonic()
+        while not self.stopped.is_set():
+            if time.monotonic() - last_sync >= self.sync_interval:
+                self.outbox.sync()
+                last_sync = time.monotonic()
+
+            payloads, position = self.outbox.read_batch(self.batch_size, timeout=1.0, reader=self.reader)
+            if not payloads:
+                continue
+
+            try:
+                delivered = self.deliver(payloads)
+            except Exception as e:
+                print(f"Outbox delivery error: {e}")
+                delivered = False
+
+            if delivered:
+                self.outbox.commit(position, self.reader)
+                self.outbox.delivered_records += len(payloads)
+                backoff = 0.5
+            else:
+                self.failures += 1
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+"""
+Pluggable notification sinks with parallel fan-out.
+
+Each sink reads the notification outbox through a cursor of its own, with
+its own dispatcher thread, so a slow webhook never delays MQTT.  A sink that
+fails keeps retrying its current batch with backoff while new events wait in
+the outbox; an event leaves the outbox only once every sink has delivered it.
+
+Sinks are configured by URL:
+
+    mqtt://host[:port][/topic/prefix]   one topic per field, as monitor.py always did
+    http://... or https://...            POST a JSON list of events
+    syslog://host[:port] or syslog:///dev/log
+    file:///path/events.jsonl            append one JSON object per line
+"""
+
+import datetime
+import json
+import logging
+import logging.handlers
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+
+from notify_outbox import OutboxDispatcher, unpack_event
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_MQTT_PREFIX = "/test/monitor/"
+
+
+def event_to_dict(event):
+    return {
+        'cause': event.cause,
+        'ip_address': event.ip_address,
+        'name': event.name,
+        'state': event.state,
+        'event_time': '{0:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.fromtimestamp(event.timestamp)),
+    }
+
+
+class NotificationSink:
+    """
+    Base class: send(events) delivers a batch or raises
+    """
+    name = 'sink'
+    url = ''
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+
+    @property
+    def reader(self):
+        # Outbox cursor name: stable across restarts for the same URL.
+        return '%s-%08x' % (self.name, zlib.crc32(self.url.encode('utf-8')))
+
+    def send(self, events):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MqttSink(NotificationSink):
+    """
+    Publishes <prefix><short name>/event_time, /cause and /state at qos 1
+    """
+    name = 'mqtt'
+
+    def __init__(self, host, port=1883, prefix=DEFAULT_MQTT_PREFIX, timeout=DEFAULT_TIMEOUT):
+        NotificationSink.__init__(self, timeout)
+        import paho.mqtt.client as mqtt
+
+        self.prefix = prefix
+        self.connected = threading.Event()
+        self.client = mqtt.Client()
+        self.client.on_connect = lambda client, userdata, flags, rc: self.connected.set()
+        self.client.on_disconnect = lambda client, userdata, rc: self.connected.clear()
+        self.client.reconnect_delay_set(1, 30)
+        self.client.connect_async(host, port, 60)
+        self.client.loop_start()
+
+    def send(self, events):
+        if not self.connected.wait(self.timeout):
+            raise ConnectionError("not connected to broker")
+
+        infos = []
+        for event in events:
+            topic = self.prefix + event.topic_name() + "/"
+            fields = event_to_dict(event)
+            infos.append(self.client.publish(topic + 'event_time', payload=fields['event_time'], qos=1))
+            infos.append(self.client.publish(topic + 'cause', payload=event.cause, qos=1))
+            infos.append(self.client.publish(topic + 'state', payload=event.state, qos=1))
+
+        deadline = time.monotonic() + self.timeout
+        for info in infos:
+            while not info.is_published():
+                if not self.connected.is_set() or time.monotonic() > deadline:
+                    raise TimeoutError("broker did not acknowledge")
+                time.sleep(0.01)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class WebhookSink(NotificationSink):
+    """
+    POSTs the batch as a JSON list
+    """
+    name = 'webhook'
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        NotificationSink.__init__(self, timeout)
+        self.url = url
+
+    def send(self, events):
+        body = json.dumps([event_to_dict(event) for event in events]).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class _RaisingSysLogHandler(logging.handlers.SysLogHandler):
+    # SysLogHandler reports a failed emit() to stderr and carries on; the
+    # sink needs the exception to retry and count it.
+    def handleError(self, record):
+        raise
+
+
+class SyslogSink(NotificationSink):
+    """
+    One syslog message per event
+    """
+    name = 'syslog'
+
+    def __init__(self, address=('localhost', 514), timeout=DEFAULT_TIMEOUT):
+        NotificationSink.__init__(self, timeout)
+        self.handler = _RaisingSysLogHandler(address=address)
+        self.handler.ident = 'netmgmt: '
+
+    def send(self, events):
+        for event in events:
+            message = f"{event.cause} {event.ip_address} {event.name or '-'} {event.state}"
+            self.handler.emit(logging.makeLogRecord({'msg': message, 'levelno': logging.INFO,
+                                                     'levelname': 'INFO'}))
+
+    def close(self):
+        self.handler.close()
+
+
+class JsonLinesSink(NotificationSink):
+    """
+    Appends one JSON object per event to a local file
+    """
+    name = 'file'
+
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        NotificationSink.__init__(self, timeout)
+        self.path = path
+
+    def send(self, events):
+        with open(self.path, 'a') as f:
+            for event in events:
+                f.write(json.dumps(event_to_dict(event)) + "\n")
+
+
+def sink_from_url(url, timeout=DEFAULT_TIMEOUT):
+    """
+    Build a sink from a configuration URL (see module docstring)
+    Raises ValueError for an unsupported URL
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'mqtt':
+        prefix = parts.path if parts.path not in ('', '/') else DEFAULT_MQTT_PREFIX
+        if not prefix.endswith('/'):
+            prefix += '/'
+        sink = MqttSink(parts.hostname, parts.port or 1883, prefix, timeout)
+    elif parts.scheme in ('http', 'https'):
+        sink = WebhookSink(url, timeout)
+    elif parts.scheme == 'syslog':
+        if parts.hostname:
+            sink = SyslogSink((parts.hostname, parts.port or 514), timeout)
+        else:
+            sink = SyslogSink(parts.path or '/dev/log', timeout)
+    elif parts.scheme == 'file':
+        sink = JsonLinesSink(parts.path, timeout)
+    else:
+        raise ValueError(f"unsupported notification sink '{url}'")
+    sink.url = url
+    return sink
+
+
+class SinkDelivery:
+    """
+    deliver(payloads) -> bool for one sink's outbox dispatcher, with
+    delivery counters
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_error = None
+
+    def __call__(self, payloads):
+        events = [unpack_event(payload) for payload in payloads]
+        started = time.monotonic()
+        try:
+            self.sink.send(events)
+        except Exception as e:
+            self.failed += 1
+            self.last_error = str(e)
+            return False
+
+        elapsed = time.monotonic() - started
+        self.batches += 1
+        self.sent += len(events)
+        self.latency_total += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+        return True
+
+    def stats(self):
+        return {
+            'sink': self.sink.name,
+            'sent': self.sent,
+            'failed': self.failed,
+            'latency_avg': self.latency_total / self.batches if self.batches else 0.0,
+            'latency_max': self.latency_max,
+            'last_error': self.last_error,
+        }
+
+
+class NotificationFanOut:
+    """
+    Delivers an outbox to every sink, each through its own cursor and
+    dispatcher thread; never waits on a sink
+
+    The outbox must be opened with readers=fan_out.readers.
+    """
+
+    def __init__(self, sinks):
+        self.deliveries = [SinkDelivery(sink) for sink in sinks]
+        self.readers = [sink.reader for sink in sinks]
+        self.dispatchers = []
+
+    def start(self, outbox, batch_size=100, max_backoff=30.0):
+        for delivery in self.deliveries:
+            dispatcher = OutboxDispatcher(outbox, delivery, batch_size, max_backoff, reader=delivery.sink.reader)
+            dispatcher.start()
+            self.dispatchers.append(dispatcher)
+
+    def stop(self, timeout=None):
+        """
+        Stop delivering; whatever a sink has not delivered stays in the
+        outbox for the next start
+        """
+        for dispatcher in self.dispatchers:
+            dispatcher.stop()
+        for dispatcher in self.dispatchers:
+            dispatcher.join(timeout)
+        for delivery in self.deliveries:
+            delivery.sink.close()
+
+    def stats(self):
+        return [delivery.stats() for delivery in self.deliveries]
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""
+Observation batches exchanged between remote probe agents and the aggregator.
+
+An agent (monitor.py -a) runs the scanner/probe pipeline on its own subnet and
+publishes compact binary batches over MQTT.  The aggregator (monitor.py -A)
+subscribes, merges observations with last-writer-wins timestamps and owns the
+node database and notifications.
+
+Batch layout (network byte order):
+
+    header   magic 'NMOB', version u8, count u16, sent time f64, agent id (u8 len + utf-8)
+    record   ip u32, mac 6 bytes, state u8, flags u8, time f64,
+             name, maker, info (each u8 len + utf-8)
+"""
+
+import struct
+import threading
+import time
+
+from host_table import int_to_ip
+
+OBSERVATION_TOPIC = "/netmgmt/observations/"
+
+BATCH_MAGIC = b'NMOB'
+BATCH_VERSION = 1
+
+STATES = ('unknown', 'down', 'up', 'degraded')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+FLAG_VERIFIED = 0x01
+
+_HEADER = struct.Struct('!4sBHd')
+_RECORD = struct.Struct('!I6sBBd')
+
+
+class Observation:
+    """
+    One sighting of a host by a scanner
+
+    verified is set when the agent has already confirmed a state change with
+    its own probe, so the aggregator (which may not be able to reach the host)
+    must not re-check it.  time_stamp is the scanner's own text timestamp when
+    one is available; it is not carried in batches.
+    """
+    __slots__ = ('ip', 'mac', 'state', 'timestamp', 'name', 'maker', 'info',
+                 'verified', 'time_stamp')
+
+    def __init__(self, ip, mac, state, timestamp=None, name='', maker='', info='',
+                 verified=False, time_stamp=None):
+        self.ip = ip
+        self.mac = mac
+        self.state = state
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.name = name
+        self.maker = maker
+        self.info = info
+        self.verified = verified
+        self.time_stamp = time_stamp
+
+    @property
+    def ip_address(self):
+        return int_to_ip(self.ip)
+
+    def text_time_stamp(self):
+        """
+        Timestamp text as stored in node.time_stamp
+        """
+        if self.time_stamp:
+            return self.time_stamp
+        return time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(self.timestamp))
+
+    def __repr__(self):
+        return 'Observation(%s, %r, %.3f)' % (self.ip_address, self.state, self.timestamp)
+
+
+def _pack_text(text):
+    data = text.encode('utf-8')[:255]
+    return bytes((len(data),)) + data
+
+
+def _unpack_text(buf, offset):
+    length = buf[offset]
+    offset += 1
+    return bytes(buf[offset:offset + length]).decode('utf-8', 'replace'), offset + length
+
+
+def encode_batch(agent_id, observations, sent=None):
+    """
+    Encode a list of Observation objects into a batch payload
+    """
+    if sent is None:
+        sent = time.time()
+    parts = [_HEADER.pack(BATCH_MAGIC, BATCH_VERSION, len(observations), sent),
+             _pack_text(agent_id)]
+    for obs in observations:
+        flags = FLAG_VERIFIED if obs.verified else 0
+        parts.append(_RECORD.pack(obs.ip, obs.mac.to_bytes(6, 'big'),
+                                  STATE_CODES.get(obs.state, 0), flags, obs.timestamp))
+        parts.append(_pack_text(obs.name))
+        parts.append(_pack_text(obs.maker))
+        parts.append(_pack_text(obs.info))
+    return b''.join(parts)
+
+
+def decode_batch(payload):
+    """
+    Decode a batch payload
+    Returns (agent_id, sent_time, [Observation, ...])
+    Raises ValueError for a payload that is not a supported batch
+    """
+    buf = memoryview(payload)
+    if len(buf) < _HEADER.size:
+        raise ValueError("short observation batch")
+    magic, version, count, sent = _HEADER.unpack_from(buf, 0)
+    if magic != BATCH_MAGIC or version != BATCH_VERSION:
+        raise ValueError("not an observation batch (magic %r, version %d)" % (magic, version))
+
+    try:
+        agent_id, offset = _unpack_text(buf, _HEADER.size)
+        observations = []
+        for _ in range(count):
+            ip, mac, state, flags, stamp = _RECORD.unpack_from(buf, offset)
+            offset += _RECORD.size
+            name, offset = _unpack_text(buf, offset)
+            maker, offset = _unpack_text(buf, offset)
+            info, offset = _unpack_text(buf, offset)
+            if state >= len(STATES):
+                state = 0
+            observations.append(Observation(ip, int.from_bytes(mac, 'big'), STATES[state], stamp,
+                                            name, maker, info, bool(flags & FLAG_VERIFIED)))
+    except (struct.error, IndexError):
+        raise ValueError("truncated observation batch")
+
+    return agent_id, sent, observations
+
+
+class ObservationBatcher:
+    """
+    Agent side: collects observations and hands encoded batches to publish()
+
+    A batch is flushed when it reaches max_batch observations or when the
+    oldest pending observation is max_delay seconds old.
+    """
+
+    def __init__(self, agent_id, publish, max_batch=200, max_delay=2.0):
+        self.agent_id = agent_id
+        self.publish = publish
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = []
+        self.oldest = 0
+        self.sent_batches = 0
+        self.sent_observations = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add(self, observation):
+        with self.lock:
+            if not self.pending:
+                self.oldest = time.time()
+            self.pending.append(observation)
+            full = len(self.pending) >= self.max_batch
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch = self.pending
+            self.pending = []
+        if batch:
+            self.publish(encode_batch(self.agent_id, batch))
+            self.sent_batches += 1
+            self.sent_observations += len(batch)
+
+    def _run(self):
+        while not self.stopped.wait(self.max_delay / 4):
+            with self.lock:
+                due = self.pending and time.time() - self.oldest >= self.max_delay
+            if due:
+                self.flush()
+        self.flush()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="observation-batcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class ObservationMerger:
+    """
+    Aggregator side: last-writer-wins filter over observations from many agents
+
+    An observation is accepted only if it is not older than the newest one
+    already accepted for the same IP or for the same MAC, so a late batch from
+    a slow agent cannot roll a host back to an earlier state or address.
+    """
+
+    def __init__(self):
+        self.by_ip = {}
+        self.by_mac = {}
+        self.accepted = 0
+        self.stale = 0
+
+    def accept(self, observation):
+        stamp = observation.timestamp
+        if stamp < self.by_ip.get(observation.ip, 0):
+            self.stale += 1
+            return False
+        if observation.mac and stamp < self.by_mac.get(observation.mac, 0):
+            self.stale += 1
+            return False
+        self.by_ip[observation.ip] = stamp
+        if observation.mac:
+            self.by_mac[observation.mac] = stamp
+        self.accepted += 1
+        return True
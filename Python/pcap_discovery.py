@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+"""
+Passive device discovery from packet captures.
+
+Reads pcap or pcapng files (or, on Linux, a live AF_PACKET socket) and
+extracts IP/MAC/hostname sightings from:
+
+    ARP     sender hardware and protocol address
+    DHCP    client MAC, the address it requests or is acknowledged, and
+            its host name option
+    mDNS    A records a host announces for its own address
+
+Capture files are memory-mapped and parsed in place through memoryview
+slices; nothing but the sightings themselves is copied, so the file can be
+far larger than memory.  New hosts are inserted, and moved hosts followed,
+through the same path update_network_info.py uses.  A capture only proves a host was
+present at some point, so hosts missing from it are left alone.
+"""
+
+import mmap
+import re
+import socket
+import struct
+import sys
+import time
+
+from host_table import DeviceTable, HostRecord
+from network_db import db
+from update_network_info import apply_address_changes, get_existing_entries, insert_new_entries, mark_seen
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+ETH_P_VLAN = (0x8100, 0x88a8)
+
+DHCP_COOKIE = 0x63825363
+DHCP_REQUEST = 3
+DHCP_ACK = 5
+DHCP_INFORM = 8
+
+MDNS_PORT = 5353
+
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+_ARP = struct.Struct('!HHBBH6sI6sI')
+_UDP = struct.Struct('!HHH')
+_DNS = struct.Struct('!HHHHHH')
+_RR = struct.Struct('!HHIH')
+
+_BAD_NAME = re.compile(r'[^A-Za-z0-9._-]')
+
+
+def clean_name(raw):
+    """
+    Host name from packet bytes, restricted to characters safe to store
+    """
+    return _BAD_NAME.sub('', bytes(raw).decode('ascii', 'replace'))[:32]
+
+
+# Capture file readers.  Each yields (linktype, timestamp, frame) with frame
+# a memoryview into the mapped file.
+
+def _pcap_packets(buf, size):
+    magic = buf[0:4].tobytes()
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+        endian = '<'
+    else:
+        endian = '>'
+    scale = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e-6
+
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0xffff
+    record = struct.Struct(endian + 'IIII')
+    offset = 24
+    while offset + 16 <= size:
+        seconds, fraction, caplen, _ = record.unpack_from(buf, offset)
+        offset += 16
+        if offset + caplen > size:
+            break
+        yield linktype, seconds + fraction * scale, buf[offset:offset + caplen]
+        offset += caplen
+
+
+def _pcapng_resolution(buf, offset, end, endian):
+    # if_tsresol (option 9) of an interface description block
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buf, offset)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = buf[offset + 4]
+            return 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _pcapng_packets(buf, size):
+    endian = '<'
+    interfaces = []
+    offset = 0
+    while offset + 12 <= size:
+        block_type = struct.unpack_from(endian + 'I', buf, offset)[0]
+        if block_type == 0x0a0d0d0a:
+            endian = '<' if buf[offset + 8:offset + 12].tobytes() == b'\x4d\x3c\x2b\x1a' else '>'
+            interfaces = []
+        length = struct.unpack_from(endian + 'I', buf, offset + 4)[0]
+        if length < 12 or offset + length > size:
+            break
+        body = offset + 8
+        end = offset + length - 4
+
+        if block_type == 1:
+            linktype, _, snaplen = struct.unpack_from(endian + 'HHI', buf, body)
+            interfaces.append((linktype, snaplen, _pcapng_resolution(buf, body + 8, end, endian)))
+        elif block_type == 6:
+            interface, high, low, caplen, _ = struct.unpack_from(endian + 'IIIII', buf, body)
+            if interface < len(interfaces):
+                linktype, _, resolution = interfaces[interface]
+                start = body + 20
+                yield linktype, ((high << 32) | low) * resolution, buf[start:start + caplen]
+        elif block_type == 3 and interfaces:
+            linktype, snaplen, _ = interfaces[0]
+            origlen = struct.unpack_from(endian + 'I', buf, body)[0]
+            caplen = min(origlen, end - body - 4, snaplen or origlen)
+            yield linktype, 0.0, buf[body + 4:body + 4 + caplen]
+
+        offset += length
+
+
+def read_capture(path):
+    """
+    Stream the packets of a pcap or pcapng file
+    Raises ValueError if the file is neither
+    """
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+        if size < 24:
+            raise ValueError(f"{path}: too short for a capture file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            buf = memoryview(mapped)
+            try:
+                magic = buf[0:4].tobytes()
+                if magic in (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4', b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d'):
+                    packets = _pcap_packets(buf, size)
+                elif magic == b'\x0a\x0d\x0d\x0a':
+                    packets = _pcapng_packets(buf, size)
+                else:
+                    raise ValueError(f"{path}: not a pcap or pcapng file")
+                for linktype, timestamp, frame in packets:
+                    try:
+                        yield linktype, timestamp, frame
+                    finally:
+                        frame.release()
+            finally:
+                buf.release()
+
+
+def live_capture(interface, duration=None):
+    """
+    Packets from a live AF_PACKET socket (Linux, needs CAP_NET_RAW)
+    Each frame is only valid until the next one is read
+    """
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(0x0003))
+    s.bind((interface, 0))
+    s.settimeout(1)
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+    deadline = None if duration is None else time.time() + duration
+    with s:
+        while deadline is None or time.time() < deadline:
+            try:
+                length = s.recv_into(buffer)
+            except socket.timeout:
+                continue
+            yield LINKTYPE_ETHERNET, time.time(), view[:length]
+
+
+# Frame parsing.  Each returns a list of (source, ip, mac, name) with ip and
+# mac as integers.
+
+def parse_frame(linktype, frame):
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return ()
+        mac = int.from_bytes(frame[6:12], 'big')
+        offset = 12
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16 or _U16.unpack_from(frame, 4)[0] != 6:
+            return ()
+        mac = int.from_bytes(frame[6:12], 'big')
+        offset = 14
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(frame) < 20 or frame[11] != 6:
+            return ()
+        mac = int.from_bytes(frame[12:18], 'big')
+        ethertype = _U16.unpack_from(frame, 0)[0]
+        return _parse_payload(ethertype, frame, 20, mac)
+    else:
+        return ()
+
+    ethertype = _U16.unpack_from(frame, offset)[0]
+    offset += 2
+    while ethertype in ETH_P_VLAN and offset + 4 <= len(frame):
+        ethertype = _U16.unpack_from(frame, offset + 2)[0]
+        offset += 4
+    return _parse_payload(ethertype, frame, offset, mac)
+
+
+def _parse_payload(ethertype, frame, offset, mac):
+    try:
+        if ethertype == ETH_P_ARP:
+            return _parse_arp(frame, offset)
+        if ethertype == ETH_P_IP:
+            return _parse_ipv4(frame, offset, mac)
+    except (struct.error, IndexError, ValueError):
+        pass
+    return ()
+
+
+def _parse_arp(frame, offset):
+    htype, ptype, hlen, plen, _, sha, spa, _, _ = _ARP.unpack_from(frame, offset)
+    if htype != 1 or ptype != ETH_P_IP or hlen != 6 or plen != 4 or spa == 0:
+        return ()
+    return [('arp', spa, int.from_bytes(sha, 'big'), '')]
+
+
+def _parse_ipv4(frame, offset, mac):
+    if frame[offset + 9] != 17:
+        return ()
+    if _U16.unpack_from(frame, offset + 6)[0] & 0x1fff:
+        return ()
+    src = _U32.unpack_from(frame, offset + 12)[0]
+    udp = offset + (frame[offset] & 0x0f) * 4
+    sport, dport, length = _UDP.unpack_from(frame, udp)
+    payload = udp + 8
+    end = min(len(frame), udp + length)
+
+    if (sport, dport) in ((68, 67), (67, 68)):
+        return _parse_dhcp(frame, payload, end)
+    if dport == MDNS_PORT or sport == MDNS_PORT:
+        return _parse_mdns(frame, payload, end, src, mac)
+    return ()
+
+
+def _parse_dhcp(frame, offset, end):
+    if frame[offset + 1] != 1 or frame[offset + 2] != 6:
+        return ()
+    ciaddr, yiaddr = struct.unpack_from('!II', frame, offset + 12)
+    client = int.from_bytes(frame[offset + 28:offset + 34], 'big')
+    if _U32.unpack_from(frame, offset + 236)[0] != DHCP_COOKIE:
+        return ()
+
+    message = requested = 0
+    name = ''
+    option = offset + 240
+    while option < end:
+        code = frame[option]
+        if code == 255:
+            break
+        if code == 0:
+            option += 1
+            continue
+        length = frame[option + 1]
+        data = option + 2
+        if code == 53:
+            message = frame[data]
+        elif code == 50 and length == 4:
+            requested = _U32.unpack_from(frame, data)[0]
+        elif code == 12:
+            name = clean_name(frame[data:data + length])
+        option = data + length
+
+    if message == DHCP_ACK:
+        ip = yiaddr or ciaddr
+    elif message == DHCP_REQUEST:
+        ip = requested or ciaddr
+    elif message == DHCP_INFORM:
+        ip = ciaddr
+    else:
+        ip = 0
+    if not ip and not name:
+        return ()
+    return [('dhcp', ip, client, name)]
+
+
+def _dns_name(frame, offset, start, end):
+    # Decode a possibly compressed DNS name; returns (name, offset after it).
+    labels = []
+    after = None
+    for _ in range(64):
+        length = frame[offset]
+        if length == 0:
+            offset += 1
+            break
+        if length & 0xc0 == 0xc0:
+            if after is None:
+                after = offset + 2
+            offset = start + (_U16.unpack_from(frame, offset)[0] & 0x3fff)
+            continue
+        labels.append(frame[offset + 1:offset + 1 + length])
+        offset += 1 + length
+        if offset >= end:
+            raise ValueError("name runs past end of packet")
+    else:
+        raise ValueError("name too long")
+    return labels, (after if after is not None else offset)
+
+
+def _parse_mdns(frame, offset, end, src, mac):
+    _, flags, qdcount, ancount, nscount, arcount = _DNS.unpack_from(frame, offset)
+    if not flags & 0x8000:
+        return ()
+    pos = offset + 12
+    for _ in range(qdcount):
+        _, pos = _dns_name(frame, pos, offset, end)
+        pos += 4
+
+    sightings = []
+    for _ in range(ancount + nscount + arcount):
+        labels, pos = _dns_name(frame, pos, offset, end)
+        rtype, rclass, _, rdlength = _RR.unpack_from(frame, pos)
+        pos += 10
+        if rtype == 1 and rclass & 0x7fff == 1 and rdlength == 4 and labels:
+            ip = _U32.unpack_from(frame, pos)[0]
+            if ip == src:
+                sightings.append(('mdns', ip, mac, clean_name(labels[0])))
+        pos += rdlength
+    return sightings
+
+
+class DiscoveryCollector:
+    """
+    Accumulates sightings into a DeviceTable, one record per MAC at the
+    last address it was seen with
+
+    A DHCP client often names itself in a message that carries no address,
+    so names are also remembered per MAC for its later sightings.
+    """
+
+    def __init__(self):
+        self.hosts = DeviceTable()
+        self.names = {}
+        self.packets = 0
+        self.bytes = 0
+        self.sightings = {'arp': 0, 'dhcp': 0, 'mdns': 0}
+
+    def add_packets(self, packets):
+        for linktype, timestamp, frame in packets:
+            self.packets += 1
+            self.bytes += len(frame)
+            for source, ip, mac, name in parse_frame(linktype, frame):
+                self.sightings[source] += 1
+                self.add(ip, mac, name, timestamp)
+
+    def add(self, ip, mac, name, timestamp):
+        if not mac:
+            return
+        if name:
+            self.names[mac] = name
+        record = self.hosts.get(ip, mac)
+        if record is None:
+            if not ip:
+                return
+            record = self.hosts.add(HostRecord(ip, mac, name=self.names.get(mac, '')))
+        elif ip and record.ip != ip and timestamp >= record.last_seen:
+            self.hosts.move(record, ip)
+        if name:
+            record.name = name
+        record.last_seen = max(record.last_seen, int(timestamp))
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+def main():
+    try:
+        db.configure_from_argv(sys.argv)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    args = sys.argv[1:]
+    if not args or '--help' in args:
+        print("Usage:")
+        print("  python3 pcap_discovery.py capture.pcap [capture2.pcapng ...]")
+        print("  python3 pcap_discovery.py --interface eth0 [--seconds 60]")
+        print("      --ping       ping new hosts to set their state (default UNKNOWN)")
+        print("      --dry-run    list what was found, do not touch the database")
+        print("      --db URL     sqlite:///path/to/network_info.db for an embedded database")
+        sys.exit(0 if args else 2)
+
+    check_connectivity = '--ping' in args
+    dry_run = '--dry-run' in args
+    collector = DiscoveryCollector()
+    started = time.time()
+
+    if '--interface' in args:
+        interface = get_option_value('--interface')
+        if not interface or interface.startswith('--'):
+            print("Error: --interface needs an interface name")
+            sys.exit(2)
+        try:
+            seconds = float(get_option_value('--seconds')) if '--seconds' in args else None
+        except (TypeError, ValueError):
+            print("Error: --seconds takes a numeric value")
+            sys.exit(2)
+        try:
+            collector.add_packets(live_capture(interface, seconds))
+        except OSError as e:
+            print(f"Error capturing on {interface}: {e}")
+            sys.exit(1)
+    else:
+        for path in [a for a in args if not a.startswith('--')]:
+            try:
+                collector.add_packets(read_capture(path))
+            except (OSError, ValueError) as e:
+                print(f"Error reading {path}: {e}")
+
+    elapsed = max(time.time() - started, 1e-6)
+    print(f"{collector.packets} packets, {collector.bytes / elapsed / 1e6:.1f} MB/s, "
+          f"sightings {collector.sightings}, {len(collector.hosts)} hosts")
+
+    for record in collector.hosts:
+        print(f"  {record.ip_address} -> {record.hw_address} {record.name}")
+
+    if dry_run or not collector.hosts:
+        return
+
+    existing_entries = get_existing_entries()
+    apply_address_changes(existing_entries, collector.hosts)
+    # Known devices seen only on the wire are still around: keep retention
+    # from archiving them.
+    mark_seen(existing_entries, collector.hosts)
+    insert_new_entries(collector.hosts.new_records(existing_entries), check_connectivity)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Shared rate limiting for every prober (ping, TCP connect, service checks).
+
+Probes pass through three gates:
+
+    - a cap on probes in flight at once
+    - a global token bucket (probes per second across all targets)
+    - a per-subnet token bucket, so one small switch or IoT segment is not
+      flooded while the global budget is spent elsewhere
+
+Usage:
+
+    with probe_limiter.limiter.probe(ip_address):
+        ... send the probe ...
+"""
+
+import threading
+import time
+
+from host_table import ip_to_int
+
+DEFAULT_RATE = 100.0
+DEFAULT_SUBNET_RATE = 20.0
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_SUBNET_PREFIX = 24
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at rate tokens per second up to burst
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1.0))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1.0):
+        """
+        Take tokens now, possibly going into debt
+        Returns the number of seconds the caller must wait before proceeding
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens=1.0):
+        """
+        Block until tokens are available
+        Returns the time spent waiting
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class ProbeLimiter:
+    """
+    In-flight cap plus global and per-subnet token buckets
+    A rate of 0 disables that bucket
+    Raises ValueError for a negative rate or an in-flight cap below 1
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, subnet_rate=DEFAULT_SUBNET_RATE,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, subnet_prefix=DEFAULT_SUBNET_PREFIX):
+        self.configure(rate, subnet_rate, max_in_flight, subnet_prefix)
+        self.probes = 0
+        self.waited = 0.0
+
+    def configure(self, rate=DEFAULT_RATE, subnet_rate=DEFAULT_SUBNET_RATE,
+                  max_in_flight=DEFAULT_MAX_IN_FLIGHT, subnet_prefix=DEFAULT_SUBNET_PREFIX):
+        if rate < 0 or subnet_rate < 0:
+            raise ValueError("probe rates cannot be negative")
+        if max_in_flight < 1:
+            raise ValueError("at least one probe must be allowed in flight")
+        self.rate = rate
+        self.subnet_rate = subnet_rate
+        self.max_in_flight = max_in_flight
+        self.subnet_mask = (0xffffffff << (32 - subnet_prefix)) & 0xffffffff
+        self.global_bucket = TokenBucket(rate) if rate else None
+        self.subnet_buckets = {}
+        self.subnet_lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def subnet_bucket(self, ip_address):
+        if not self.subnet_rate:
+            return None
+        subnet = ip_to_int(ip_address) & self.subnet_mask
+        with self.subnet_lock:
+            bucket = self.subnet_buckets.get(subnet)
+            if bucket is None:
+                bucket = self.subnet_buckets[subnet] = TokenBucket(self.subnet_rate)
+        return bucket
+
+    def reserve(self, ip_address):
+        """
+        Take tokens for one probe to ip_address without blocking
+        Returns the seconds to wait before sending (for event loop callers,
+        which manage their own in-flight cap)
+        """
+        wait = 0.0
+        if self.global_bucket is not None:
+            wait = self.global_bucket.reserve()
+        bucket = self.subnet_bucket(ip_address)
+        if bucket is not None:
+            wait = max(wait, bucket.reserve())
+        self.probes += 1
+        self.waited += wait
+        return wait
+
+    def probe(self, ip_address):
+        return _Probe(self, ip_address)
+
+
+class _Probe:
+    """
+    Context manager holding one in-flight slot for the duration of a probe
+    """
+
+    def __init__(self, limiter, ip_address):
+        self.limiter = limiter
+        self.ip_address = ip_address
+
+    def __enter__(self):
+        self.semaphore = self.limiter.in_flight
+        self.semaphore.acquire()
+        wait = self.limiter.reserve(self.ip_address)
+        if wait > 0:
+            time.sleep(wait)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+        return False
+
+
+# Shared by every prober in the process.
+limiter = ProbeLimiter()
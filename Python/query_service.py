@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+
+"""
+Read-only HTTP/JSON queries over the live device state.
+
+Answers from a StateCache (state_cache.py), never from the databases, so a
+dashboard polling every few seconds costs a dictionary walk instead of a
+mysql process and a table scan:
+
+    GET /devices                  every device
+    GET /devices?cidr=10.20.0.0/22&state=up&source=update
+                                  devices in a block, in a state, from one tool
+    GET /devices?since=<version>  only what changed after version
+    GET /devices/<ip or mac>      one device, as each tool sees it
+    GET /summary[?cidr=...]       device counts by tool and state
+    GET /events[?since=<seq>&types=state,hostname&cidr=...&source=...]
+                                  the change feed, as Server-Sent Events
+
+Every response carries the cache "version" and an ETag.  A client that
+sends the ETag back in If-None-Match gets 304 Not Modified while nothing
+it asked for has changed; one that passes the version back as since= gets
+the devices changed after it, plus the "removed" devices (gone, or no
+longer matching the filter).  "full": true means since= was older than
+the cache remembers and the response lists every device instead.
+Responses are kept per query until the cache version moves on, so
+identical polls from many clients are answered without re-encoding.
+
+/events pushes every change as it happens instead: each SSE event is
+named by its type (insert, address, state, hostname, update, remove; see
+state_cache.py), has the sequence number as its id and a JSON object as
+its data.  Sequence numbers and versions are the same numbers.  A client
+that reconnects (EventSource does this by itself, sending Last-Event-ID)
+or passes since= is replayed what it missed from a buffer of the last
+10000 events; if it missed more than that, or the service restarted, it is
+sent a "reset" event carrying the current version, and should fetch
+/devices again and carry on from the events after it.  Without since= the
+feed starts from now.  A comment line every 15 seconds keeps
+proxies from closing an idle stream.
+
+monitor.py -H serves its own node table this way as it changes.  Run on
+its own, this module keeps a cache current from the databases instead,
+every --refresh seconds:
+
+    python3 query_service.py [--db URL] [--node-db <path to node.db>]
+                             [--listen 127.0.0.1:8088] [--refresh 5]
+
+arp_table (written by update_network_info.py and set_hostname.py) appears
+as source "update" and is followed through its arp_changes log, one indexed
+query per refresh (none for SQLite while the file is unchanged); every
+change the tools make is applied and streamed in order.  last_seen is as
+of a device's latest change.  monitor.py's node table appears as source
+"monitor" and is re-read whenever node.db changes.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from host_table import DeviceTable, HostRecord, ip_to_int, mac_to_int
+from state_cache import EVENT_TYPES, DeviceFilter, StateCache, device_key
+
+DEFAULT_LISTEN = '127.0.0.1:8088'
+DEFAULT_REFRESH = 5.0
+
+# Encoded responses kept for repeat queries; the lot is dropped when full.
+MAX_CACHED_RESPONSES = 1024
+
+ARP_TABLE_SOURCE = 'update'
+NODE_SOURCE = 'monitor'
+
+# Seconds between keep-alive comments on an idle event stream.
+KEEPALIVE = 15
+
+# arp_changes entries read per query when following arp_table.
+CHANGE_BATCH = 1000
+
+
+def parse_listen(text):
+    """
+    (address, port) from "port" or "address:port"
+    Raises ValueError
+    """
+    address, _, port = text.rpartition(':')
+    return address or '127.0.0.1', int(port)
+
+
+def _encode(body):
+    return json.dumps(body, separators=(',', ':')).encode('utf-8')
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server_version = 'netmgmt-query/1'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_body(self, status, body, etag=None):
+        if etag is not None and status == 200 and etag in self.headers.get('If-None-Match', ''):
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_body(status, _encode({'error': message}))
+
+    def stream_events(self, query):
+        """
+        Send the change feed until the client goes away or the service stops
+        """
+        cache = self.server.cache
+        wanted = DeviceFilter(query.get('cidr'), None, query.get('source'))
+        types = set(query['types'].split(',')) if query.get('types') else set(EVENT_TYPES)
+        unknown = types - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"unknown event types {', '.join(sorted(unknown))}")
+        since = query.get('since', self.headers.get('Last-Event-ID'))
+        try:
+            seq = int(since) if since else cache.version
+        except ValueError:
+            raise ValueError(f"since must be a sequence number, not '{since}'")
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        self.server.streams += 1
+        try:
+            self.wfile.write(b'retry: 3000\n\n')
+            self.wfile.flush()
+            while not self.server.stopping:
+                found = cache.events_after(seq, KEEPALIVE)
+                if found is None:
+                    # Missed events that are no longer buffered: start again.
+                    seq = cache.version
+                    self.wfile.write(b'id: %d\nevent: reset\ndata: {"version":%d}\n\n' % (seq, seq))
+                    self.server.resets += 1
+                else:
+                    version, events = found
+                    chunks = []
+                    for seq, kind, source, ip, old_ip, payload in events:
+                        if kind in types and (wanted.source is None or source == wanted.source) and \
+                                (wanted.first <= ip <= wanted.last or wanted.first <= old_ip <= wanted.last):
+                            chunks.append(f"id: {seq}\nevent: {kind}\ndata: {payload}\n\n")
+                    if chunks:
+                        self.wfile.write(''.join(chunks).encode('utf-8'))
+                        self.server.events_sent += len(chunks)
+                    elif not events:
+                        self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.streams -= 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/') or '/'
+        self.server.requests += 1
+        try:
+            if path == '/events':
+                self.stream_events(query)
+                return
+            if path == '/devices':
+                status, etag, body = self.server.respond(('devices', None), query)
+            elif path.startswith('/devices/'):
+                status, etag, body = self.server.respond(('device', unquote(path[len('/devices/'):])), query)
+            elif path == '/summary':
+                status, etag, body = self.server.respond(('summary', None), query)
+            elif path == '/':
+                status, etag, body = 200, None, _encode({'endpoints': ['/devices', '/devices/<ip or mac>',
+                                                                      '/summary', '/events'],
+                                                        'version': self.server.cache.version})
+            else:
+                status, etag, body = 404, None, _encode({'error': f"no such resource {path}"})
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+        self.send_body(status, body, etag)
+
+
+class QueryService(ThreadingHTTPServer):
+    """
+    Serves a StateCache over HTTP from a thread of its own
+    """
+    daemon_threads = True
+
+    def __init__(self, cache, listen=DEFAULT_LISTEN, verbose=False):
+        ThreadingHTTPServer.__init__(self, parse_listen(listen), QueryHandler)
+        self.cache = cache
+        self.verbose = verbose
+        self.responses = {}
+        self.responses_lock = threading.Lock()
+        self.thread = None
+        self.requests = 0
+        self.not_modified = 0
+        self.encoded = 0
+        self.stopping = False
+        self.streams = 0
+        self.events_sent = 0
+        self.resets = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='query-service', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping = True
+        self.cache.wake()
+        self.shutdown()
+        self.server_close()
+
+    def respond(self, resource, query):
+        """
+        (status, etag, body) for a query, re-encoded only if the cache has
+        changed since it was last asked
+        Raises ValueError for a malformed query
+        """
+        key = (resource, tuple(sorted(query.items())))
+        version = self.cache.version
+        with self.responses_lock:
+            cached = self.responses.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1:]
+
+        kind, argument = resource
+        wanted = DeviceFilter(query.get('cidr'), query.get('state'), query.get('source'))
+        if kind == 'devices':
+            response = self.devices(wanted, query.get('since'))
+        elif kind == 'device':
+            response = self.device(argument)
+        else:
+            response = self.summary(wanted)
+        self.encoded += 1
+
+        with self.responses_lock:
+            if len(self.responses) >= MAX_CACHED_RESPONSES:
+                self.responses.clear()
+            self.responses[key] = (version,) + response
+        return response
+
+    def devices(self, wanted, since):
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                raise ValueError(f"since must be a version number, not '{since}'")
+            delta = self.cache.changed(since, wanted)
+            if delta is not None:
+                version, devices, removed = delta
+                return 200, '"%d-%d"' % (version, since), _encode({
+                    'version': version, 'full': False, 'since': since, 'count': len(devices),
+                    'devices': [device.to_dict() for device in devices],
+                    'removed': [{'source': source, 'id': id} for source, id in removed]})
+        version, devices, fingerprint = self.cache.select(wanted)
+        return 200, '"%s"' % fingerprint, _encode({
+            'version': version, 'full': True, 'count': len(devices),
+            'devices': [device.to_dict() for device in devices]})
+
+    def device(self, address):
+        devices = self.cache.find(address)
+        version = self.cache.version
+        if not devices:
+            return 404, None, _encode({'error': f"no device {address}", 'version': version})
+        fingerprint = '%d-%d' % (max(device.version for device in devices), len(devices))
+        return 200, '"%s"' % fingerprint, _encode({
+            'version': version, 'devices': [device.to_dict() for device in devices]})
+
+    def summary(self, wanted):
+        version, counts = self.cache.summary(wanted)
+        states = {}
+        for source_states in counts.values():
+            for state, count in source_states.items():
+                states[state] = states.get(state, 0) + count
+        return 200, '"%d"' % version, _encode({
+            'version': version, 'total': sum(states.values()), 'states': states,
+            'sources': {source: {'total': sum(source_states.values()), 'states': source_states}
+                        for source, source_states in counts.items()}})
+
+    def stats(self):
+        return {'requests': self.requests, 'not_modified': self.not_modified, 'encoded': self.encoded,
+                'streams': self.streams, 'events_sent': self.events_sent, 'resets': self.resets,
+                'devices': len(self.cache), 'version': self.cache.version}
+
+
+def _file_signature(path):
+    """
+    What changes when SQLite writes to path: the file's and its WAL's
+    modification times and sizes
+    """
+    signature = []
+    for name in (path, path + '-wal'):
+        try:
+            info = os.stat(name)
+            signature.append((info.st_mtime_ns, info.st_size))
+        except OSError:
+            signature.append(None)
+    return signature
+
+
+def _parse_timestamp(text):
+    try:
+        return int(time.mktime(time.strptime(text.strip(), '%Y-%m-%d %H:%M:%S')))
+    except ValueError:
+        return 0
+
+
+class ArpTableSource:
+    """
+    arp_table through network_db, the way the tools read it
+
+    Read in full once, then followed through the arp_changes log that
+    update_network_info.py, set_hostname.py and arp_retention.py append to,
+    so every change is applied (and streamed) in order and nothing is
+    re-read.  If the log has been pruned past the last change applied, or
+    the database predates it, the table is read in full again.
+    """
+    name = ARP_TABLE_SOURCE
+
+    def __init__(self, database):
+        self.database = database
+        self.path = None
+        self.signature = None
+        # Last arp_changes entry applied; None until a full read.
+        self.last_seq = None
+        # Device key -> id of the arp_table row it is read from.
+        self.rows = {}
+        url = urlparse(database.url or os.environ.get('NETWORK_INFO_DB') or '')
+        if url.scheme == 'sqlite':
+            self.path = os.path.expanduser(unquote(url.path))
+
+    def changed(self):
+        # A MySQL server gives no cheap sign of change: ask every time.
+        if self.path is None:
+            return True
+        signature = _file_signature(self.path)
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+    def reset(self):
+        self.signature = None
+        self.last_seq = None
+
+    def read(self):
+        # Older databases may hold several rows for one MAC; the newest wins.
+        devices = DeviceTable()
+        for columns in self.database.run('SELECT id, ip_address, hw_address, state, hostname, last_seen '
+                                         'FROM arp_table ORDER BY id;'):
+            if len(columns) >= 6:
+                name = columns[4].strip()
+                devices.add(HostRecord(ip_to_int(columns[1].strip()), mac_to_int(columns[2].strip()),
+                                       columns[3].strip(), name='' if name in ('NULL', 'unknown') else name,
+                                       row_id=int(columns[0]), last_seen=_parse_timestamp(columns[5])))
+        self.rows = {device_key(record.ip, record.mac): record.row_id for record in devices}
+        return devices
+
+    def update(self, cache):
+        """
+        Bring cache up to date with arp_table
+        Returns (added or changed, removed) counts
+        """
+        if not self.changed():
+            return 0, 0
+        if self.last_seq is not None:
+            counts = self._follow(cache)
+            if counts is not None:
+                return counts
+        return self._reload(cache)
+
+    def _reload(self, cache):
+        from network_db import DatabaseError
+
+        try:
+            rows = self.database.run('SELECT MAX(seq) FROM arp_changes;')
+            self.last_seq = int(rows[0][0]) if rows and rows[0][0] != 'NULL' else 0
+        except DatabaseError:
+            # No change log (set up by an older setup_database.py): read
+            # the whole table whenever it may have changed.
+            self.last_seq = None
+        return cache.replace(self.name, self.read())
+
+    def _follow(self, cache):
+        # None when the log no longer holds the last entry applied.
+        changed = removed = 0
+        while True:
+            rows = self.database.run('SELECT seq, row_id, ip_address, hw_address, state, hostname, removed, '
+                                     f'changed_at FROM arp_changes WHERE seq >= {self.last_seq} '
+                                     f'ORDER BY seq LIMIT {CHANGE_BATCH};')
+            fetched = len(rows)
+            if self.last_seq:
+                if not rows or int(rows[0][0]) != self.last_seq:
+                    return None
+                rows = rows[1:]
+            for seq, row_id, ip_address, hw_address, state, hostname, gone, changed_at in rows:
+                ip, mac, row_id = ip_to_int(ip_address.strip()), mac_to_int(hw_address.strip()), int(row_id)
+                key = device_key(ip, mac)
+                # Changes to a row superseded by a newer one for the same MAC
+                # are not the device's.
+                if gone.strip() == '1':
+                    if self.rows.get(key) == row_id:
+                        del self.rows[key]
+                        removed += cache.remove(self.name, ip, mac)
+                elif row_id >= self.rows.get(key, 0):
+                    self.rows[key] = row_id
+                    hostname = hostname.strip()
+                    changed += cache.put(self.name, ip, mac, state.strip(),
+                                         '' if hostname in ('NULL', 'unknown') else hostname,
+                                         last_seen=_parse_timestamp(changed_at))
+                self.last_seq = int(seq)
+            if fetched < CHANGE_BATCH:
+                return changed, removed
+
+
+class NodeDbSource:
+    """
+    monitor.py's node table, read directly from node.db
+    """
+    name = NODE_SOURCE
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+
+    def reset(self):
+        self.signature = None
+
+    def update(self, cache):
+        """
+        Bring cache up to date with the node table, re-read whenever the file changed
+        Returns (added or changed, removed) counts
+        """
+        if not self.changed():
+            return 0, 0
+        return cache.replace(self.name, self.read())
+
+    def changed(self):
+        signature = _file_signature(self.path)
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+    def read(self):
+        import sqlite3
+
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        try:
+            rows = conn.execute('select ip_address, mac_address, state, name, maker, event_time from node;')
+            return [HostRecord(ip_to_int(ip_address) if ip_address else 0, mac_to_int(mac_address), state,
+                               name=name or '', maker=maker or '', event_time=event_time or 0)
+                    for ip_address, mac_address, state, name, maker, event_time in rows]
+        finally:
+            conn.close()
+
+
+class Follower(threading.Thread):
+    """
+    Keeps a StateCache in step with the sources' tables
+    """
+
+    def __init__(self, cache, sources, interval=DEFAULT_REFRESH, verbose=True):
+        threading.Thread.__init__(self, name='state-follower', daemon=True)
+        self.cache = cache
+        self.sources = sources
+        self.interval = interval
+        self.verbose = verbose
+        self.stopping = threading.Event()
+
+    def refresh(self):
+        for source in self.sources:
+            try:
+                changed, removed = source.update(self.cache)
+            except Exception as e:
+                # Start over with a full read next time round.
+                source.reset()
+                print(f"Error reading {source.name} devices: {e}")
+                continue
+            if self.verbose and (changed or removed):
+                print(f"{source.name}: {changed} devices added or changed, {removed} removed")
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.refresh()
+
+    def stop(self):
+        self.stopping.set()
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def main():
+    from network_db import db
+
+    if '--help' in sys.argv:
+        print("Usage:")
+        print("  python3 query_service.py                           # Serve arp_table on 127.0.0.1:8088")
+        print("  python3 query_service.py --db sqlite:///var/lib/network_info/network_info.db")
+        print("  python3 query_service.py --node-db ./node.db       # Serve monitor.py's node table instead")
+        print("  python3 query_service.py --db <url> --node-db ./node.db   # Both")
+        print("  python3 query_service.py --listen 0.0.0.0:8088     # Address and port to listen on")
+        print("  python3 query_service.py --refresh 5               # Seconds between checks for changes (default 5)")
+        print("  python3 query_service.py --verbose                 # Log every request")
+        print("")
+        print("  GET /devices[?cidr=<block>&state=<state>&source=update|monitor&since=<version>]")
+        print("  GET /devices/<ip or mac>")
+        print("  GET /summary[?cidr=<block>]")
+        print("  GET /events[?since=<seq>&types=insert,address,state,hostname,update,remove&cidr=<block>&source=<source>]")
+        return 0
+
+    follow_arp_table = '--db' in sys.argv or '--node-db' not in sys.argv
+    try:
+        db.configure_from_argv(sys.argv)
+        listen = get_option_value('--listen') or DEFAULT_LISTEN
+        refresh = float(get_option_value('--refresh') or DEFAULT_REFRESH)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 2
+
+    sources = []
+    if follow_arp_table:
+        sources.append(ArpTableSource(db))
+    if '--node-db' in sys.argv:
+        node_db = get_option_value('--node-db')
+        if not node_db or not os.path.exists(node_db):
+            print(f"Error: no node database {node_db}")
+            return 2
+        sources.append(NodeDbSource(node_db))
+
+    cache = StateCache()
+    follower = Follower(cache, sources, refresh)
+    follower.refresh()
+    try:
+        service = QueryService(cache, listen, verbose='--verbose' in sys.argv)
+    except (OSError, ValueError) as e:
+        print(f"Error listening on {listen}: {e}")
+        return 1
+    print("Serving %d devices on http://%s:%d/" % ((len(cache),) + service.server_address[:2]))
+
+    follower.start()
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    follower.stop()
+    service.server_close()
+    print("Query service", service.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Per-host round-trip time history.
+
+Every ping records its RTT (or a loss) in a fixed-size ring buffer for the
+host: an array of 32-bit floats, so memory per host is constant however
+long the tool runs.  Percentiles and the loss rate over the ring are
+computed only when asked for.
+
+A host that answers, but whose p95 latency or loss rate is over threshold,
+is degraded rather than up, which catches a struggling device before it
+drops off the network.
+
+update_network_info.py runs from cron, so rings can be saved to and loaded
+from a small binary file between runs:
+
+    header   magic 'NMRT', version u16, ring size u16, host count u32
+    host     ip u32, next slot u16, filled u16, ring size x f32
+
+(all in network byte order)
+"""
+
+import array
+import os
+import struct
+import sys
+import threading
+
+RTT_MAGIC = b'NMRT'
+RTT_VERSION = 1
+
+DEFAULT_SIZE = 64
+DEFAULT_LATENCY_THRESHOLD = 0.2
+DEFAULT_LOSS_THRESHOLD = 0.2
+DEFAULT_MIN_SAMPLES = 5
+
+# A lost probe is stored as a negative RTT.
+LOST = -1.0
+
+_HEADER = struct.Struct('!4sHHI')
+_HOST = struct.Struct('!IHH')
+
+
+class RttRing:
+    """
+    The last size probe results for one host
+    """
+    __slots__ = ('samples', 'next', 'filled')
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.samples = array.array('f', bytes(4 * size))
+        self.next = 0
+        self.filled = 0
+
+    def record(self, rtt):
+        """
+        Record an RTT in seconds, or None for a lost probe
+        """
+        self.samples[self.next] = LOST if rtt is None else rtt
+        self.next = (self.next + 1) % len(self.samples)
+        if self.filled < len(self.samples):
+            self.filled += 1
+
+    def values(self):
+        if self.filled < len(self.samples):
+            return self.samples[:self.filled]
+        return self.samples
+
+    def loss(self):
+        if not self.filled:
+            return 0.0
+        return sum(1 for value in self.values() if value < 0) / self.filled
+
+    def percentiles(self, points=(50, 95, 99)):
+        """
+        Nearest-rank percentiles of the answered probes, in seconds
+        Returns a dict point -> RTT, empty if nothing answered
+        """
+        answered = sorted(value for value in self.values() if value >= 0)
+        if not answered:
+            return {}
+        last = len(answered) - 1
+        return {point: answered[min(last, max(0, -(-point * len(answered) // 100) - 1))] for point in points}
+
+
+class RttTracker:
+    """
+    RttRings for many hosts, keyed by integer IP
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, latency_threshold=DEFAULT_LATENCY_THRESHOLD,
+                 loss_threshold=DEFAULT_LOSS_THRESHOLD, min_samples=DEFAULT_MIN_SAMPLES):
+        self.size = size
+        self.latency_threshold = latency_threshold
+        self.loss_threshold = loss_threshold
+        self.min_samples = min_samples
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def configure(self, latency_threshold=None, loss_threshold=None):
+        if latency_threshold is not None:
+            self.latency_threshold = latency_threshold
+        if loss_threshold is not None:
+            self.loss_threshold = loss_threshold
+
+    def record(self, ip, rtt):
+        with self.lock:
+            ring = self.rings.get(ip)
+            if ring is None:
+                ring = self.rings[ip] = RttRing(self.size)
+            ring.record(rtt)
+
+    def stats(self, ip):
+        """
+        {'samples', 'loss', 'p50', 'p95', 'p99'} for a host (RTTs in
+        seconds, None if nothing answered), or None if it was never probed
+        """
+        with self.lock:
+            ring = self.rings.get(ip)
+            if ring is None:
+                return None
+            points = ring.percentiles()
+            return {
+                'samples': ring.filled,
+                'loss': ring.loss(),
+                'p50': points.get(50),
+                'p95': points.get(95),
+                'p99': points.get(99),
+            }
+
+    def degraded(self, ip):
+        """
+        True if the host's p95 latency or loss rate is over threshold
+        """
+        stats = self.stats(ip)
+        if stats is None or stats['samples'] < self.min_samples:
+            return False
+        if stats['loss'] > self.loss_threshold:
+            return True
+        return stats['p95'] is not None and stats['p95'] > self.latency_threshold
+
+    def save(self, path):
+        with self.lock:
+            parts = [_HEADER.pack(RTT_MAGIC, RTT_VERSION, self.size, len(self.rings))]
+            for ip, ring in self.rings.items():
+                parts.append(_HOST.pack(ip, ring.next, ring.filled))
+                samples = array.array('f', ring.samples)
+                if sys.byteorder == 'little':
+                    samples.byteswap()
+                parts.append(samples.tobytes())
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Load rings saved by save(); a missing, foreign or mismatched file
+        is ignored and history starts afresh
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, size, count = _HEADER.unpack_from(data, 0)
+        except (OSError, struct.error):
+            return False
+        if magic != RTT_MAGIC or version != RTT_VERSION or size != self.size:
+            return False
+
+        rings = {}
+        offset = _HEADER.size
+        try:
+            for _ in range(count):
+                ip, next_slot, filled = _HOST.unpack_from(data, offset)
+                offset += _HOST.size
+                ring = RttRing(size)
+                ring.samples = array.array('f', data[offset:offset + 4 * size])
+                if len(ring.samples) != size:
+                    return False
+                if sys.byteorder == 'little':
+                    ring.samples.byteswap()
+                ring.next = next_slot % size
+                ring.filled = min(filled, size)
+                offset += 4 * size
+                rings[ip] = ring
+        except (struct.error, ValueError):
+            return False
+
+        with self.lock:
+            self.rings = rings
+        return True
+
+
+tracker = RttTracker()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""
+Subnet work-leasing for horizontally scaled scanners.
+
+The configured address space is split into shards (one /24 each by default,
+which is what a single fing process scans).  Scanner workers hold shards as
+time-limited leases recorded in a shared SQLite table.  Each worker renews
+periodically; on renewal it keeps at most its fair share
+ceil(shards / live workers), hands back any excess so that newly joined
+workers can pick it up, and claims free or expired shards up to its share.
+A worker that stops renewing loses its leases after the TTL and its shards
+are reassigned.
+"""
+
+import ipaddress
+import math
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+DEFAULT_TTL = 60.0
+DEFAULT_SHARD_PREFIX = 24
+
+
+def split_address_space(cidrs, shard_prefix=DEFAULT_SHARD_PREFIX):
+    """
+    Split a list of CIDR blocks into shard CIDR strings of /shard_prefix
+    Blocks smaller than a shard are kept as they are
+    """
+    shards = []
+    for cidr in cidrs:
+        network = ipaddress.IPv4Network(cidr.strip(), strict=False)
+        if network.prefixlen >= shard_prefix:
+            shards.append(str(network))
+        else:
+            shards.extend(str(subnet) for subnet in network.subnets(new_prefix=shard_prefix))
+    return shards
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ScanLeaseCoordinator:
+    """
+    Lease coordinator backed by a SQLite file shared by all workers
+    """
+
+    def __init__(self, db_path, shards, worker_id=None, ttl=DEFAULT_TTL):
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scan_shard ("
+                          "shard TEXT PRIMARY KEY, owner TEXT, expires REAL DEFAULT 0);")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scan_worker ("
+                          "worker TEXT PRIMARY KEY, heartbeat REAL);")
+        self.configure(shards)
+
+    def configure(self, shards):
+        """
+        Make the shard table match the configured address space
+        """
+        with self._transaction() as cur:
+            existing = {row[0] for row in cur.execute("SELECT shard FROM scan_shard;")}
+            wanted = set(shards)
+            cur.executemany("INSERT INTO scan_shard (shard) VALUES (?);",
+                            [(shard,) for shard in shards if shard not in existing])
+            cur.executemany("DELETE FROM scan_shard WHERE shard = ?;",
+                            [(shard,) for shard in existing - wanted])
+
+    def renew(self, now=None):
+        """
+        Heartbeat, rebalance and return the sorted list of shards this worker holds
+        """
+        if now is None:
+            now = time.time()
+        expires = now + self.ttl
+        me = self.worker_id
+
+        with self._transaction() as cur:
+            cur.execute("INSERT OR REPLACE INTO scan_worker (worker, heartbeat) VALUES (?, ?);",
+                        (me, now))
+            cur.execute("DELETE FROM scan_worker WHERE heartbeat < ?;", (now - self.ttl,))
+
+            workers = cur.execute("SELECT COUNT(*) FROM scan_worker;").fetchone()[0]
+            total = cur.execute("SELECT COUNT(*) FROM scan_shard;").fetchone()[0]
+            fair_share = math.ceil(total / max(workers, 1))
+
+            owned = [row[0] for row in cur.execute(
+                "SELECT shard FROM scan_shard WHERE owner = ? AND expires >= ? ORDER BY shard;",
+                (me, now))]
+
+            if len(owned) > fair_share:
+                # Workers have joined: give back the excess for them to claim.
+                excess = owned[fair_share:]
+                owned = owned[:fair_share]
+                cur.executemany("UPDATE scan_shard SET owner = NULL, expires = 0 WHERE shard = ?;",
+                                [(shard,) for shard in excess])
+            elif len(owned) < fair_share:
+                free = [row[0] for row in cur.execute(
+                    "SELECT shard FROM scan_shard WHERE owner IS NULL OR expires < ? "
+                    "ORDER BY shard LIMIT ?;", (now, fair_share - len(owned)))]
+                owned.extend(free)
+
+            cur.executemany("UPDATE scan_shard SET owner = ?, expires = ? WHERE shard = ?;",
+                            [(me, expires, shard) for shard in owned])
+
+        return sorted(owned)
+
+    def release(self):
+        """
+        Give up all leases and leave the worker pool (clean shutdown)
+        """
+        with self._transaction() as cur:
+            cur.execute("UPDATE scan_shard SET owner = NULL, expires = 0 WHERE owner = ?;",
+                        (self.worker_id,))
+            cur.execute("DELETE FROM scan_worker WHERE worker = ?;", (self.worker_id,))
+
+    def assignments(self, now=None):
+        """
+        Return {shard: owner or None} for reporting
+        """
+        if now is None:
+            now = time.time()
+        return {shard: (owner if owner and expires >= now else None)
+                for shard, owner, expires in self.conn.execute(
+                    "SELECT shard, owner, expires FROM scan_shard ORDER BY shard;")}
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT/ROLLBACK, so that concurrent workers serialise
+    their read-modify-write of the lease table
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.cur = self.conn.cursor()
+        self.cur.execute("BEGIN IMMEDIATE;")
+        return self.cur
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cur.execute("COMMIT;" if exc_type is None else "ROLLBACK;")
+        return False
+
+
+def main():
+    """
+    Show the current shard assignments in a lease database
+    """
+    if len(sys.argv) < 2 or sys.argv[1] == '--help':
+        print("Usage:")
+        print("  python3 scan_leases.py <lease db>     # Show shard assignments")
+        return
+
+    conn = sqlite3.connect(sys.argv[1])
+    now = time.time()
+    try:
+        rows = conn.execute("SELECT shard, owner, expires FROM scan_shard ORDER BY shard;").fetchall()
+        workers = conn.execute("SELECT worker, heartbeat FROM scan_worker ORDER BY worker;").fetchall()
+    except sqlite3.Error as e:
+        print(f"Error reading lease database: {e}")
+        sys.exit(1)
+
+    print(f"{'Shard':<20} {'Owner':<30} {'Expires in':<10}")
+    print("-" * 62)
+    for shard, owner, expires in rows:
+        if owner and expires >= now:
+            print(f"{shard:<20} {owner:<30} {expires - now:>8.0f}s")
+        else:
+            print(f"{shard:<20} {'-':<30} {'-':>9}")
+    print("-" * 62)
+    print(f"Shards: {len(rows)}  Workers: {len(workers)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,32 @@
 #!/usr/bin/env python3
 
-import subprocess
 import sys
 import re
 
+from host_table import cidr_range
+from network_db import db, DatabaseError, change_log_sql
+
 def get_device_by_ip(ip_address):
     """
     Get device information by IP address from the database
     Returns (id, ip_address, hw_address, state, hostname) or None if not found
     """
     try:
-        cmd = [
-            'mysql',
-            '-u', 'andrewh',
-            '-pletmein',
-            '-e', f"USE network_info; SELECT id, ip_address, hw_address, state, hostname FROM arp_table WHERE ip_address = '{ip_address}';"
-        ]
-        
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            print(f"Error querying database: {result.stderr}")
+        try:
+            rows = db.run(f"SELECT id, ip_address, hw_address, state, hostname FROM arp_table WHERE ip_address = '{ip_address}';")
+        except DatabaseError as e:
+            print(f"Error querying database: {e}")
             return None
         
-        lines = result.stdout.strip().split('\n')
-        
-        # Check if we have data beyond header
-        if len(lines) > 1:
-            for line in lines[1:]:  # Skip header
-                if line.strip():
-                    columns = line.split('\t')
-                    if len(columns) >= 5:
-                        return {
-                            'id': columns[0].strip(),
-                            'ip_address': columns[1].strip(),
-                            'hw_address': columns[2].strip(),
-                            'state': columns[3].strip(),
-                            'hostname': columns[4].strip()
-                        }
+        for columns in rows:
+            if len(columns) >= 5:
+                return {
+                    'id': columns[0].strip(),
+                    'ip_address': columns[1].strip(),
+                    'hw_address': columns[2].strip(),
+                    'state': columns[3].strip(),
+                    'hostname': columns[4].strip()
+                }
         
         return None
     
@@ -58,24 +42,12 @@ def update_hostname(device_id, new_hostname):
         # Escape single quotes in hostname
         safe_hostname = new_hostname.replace("'", "''")
         
-        cmd = [
-            'mysql',
-            '-u', 'andrewh',
-            '-pletmein',
-            '-e', f"USE network_info; UPDATE arp_table SET hostname = '{safe_hostname}' WHERE id = {device_id};"
-        ]
-        
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        if result.returncode == 0:
+        try:
+            db.run(f"UPDATE arp_table SET hostname = '{safe_hostname}' WHERE id = {device_id}; "
+                   + change_log_sql(f"id = {device_id}"))
             return True
-        else:
-            print(f"Error updating hostname: {result.stderr}")
+        except DatabaseError as e:
+            print(f"Error updating hostname: {e}")
             return False
     
     except Exception as e:
@@ -101,50 +73,45 @@ def validate_hostname(hostname):
     pattern = r'^[a-zA-Z0-9]([a-zA-Z0-9\.-]*[a-zA-Z0-9])?$'
     return re.match(pattern, hostname) is not None
 
-def list_devices():
+def list_devices(cidr_filter=None):
     """
-    List all devices in the database for reference
+    List all devices in the database for reference, optionally limited to a CIDR block
+    Sorting and filtering use the indexed ip_int column
     """
     try:
-        cmd = [
-            'mysql',
-            '-u', 'andrewh',
-            '-pletmein',
-            '-e', 'USE network_info; SELECT ip_address, hw_address, state, hostname FROM arp_table ORDER BY INET_ATON(ip_address);'
-        ]
+        where = ""
+        if cidr_filter:
+            try:
+                first, last = cidr_range(cidr_filter)
+            except ValueError:
+                print(f"Error: '{cidr_filter}' is not a valid CIDR block")
+                return
+            where = f" WHERE ip_int BETWEEN {first} AND {last}"
         
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        try:
+            rows = db.run(f'SELECT ip_address, hw_address, state, hostname FROM arp_table{where} ORDER BY ip_int;')
+        except DatabaseError as e:
+            print(f"Error listing devices: {e}")
+            return
         
-        if result.returncode == 0:
-            lines = result.stdout.strip().split('\n')
+        if rows:
+            print("\nCurrent devices in database:")
+            print("=" * 70)
+            print(f"{'IP Address':<15} {'HW Address':<18} {'State':<8} {'Hostname':<15}")
+            print("-" * 70)
             
-            if len(lines) > 1:
-                print("\nCurrent devices in database:")
-                print("=" * 70)
-                print(f"{'IP Address':<15} {'HW Address':<18} {'State':<8} {'Hostname':<15}")
-                print("-" * 70)
-                
-                for line in lines[1:]:
-                    if line.strip():
-                        columns = line.split('\t')
-                        if len(columns) >= 4:
-                            ip = columns[0].strip()
-                            mac = columns[1].strip()
-                            state = columns[2].strip()
-                            hostname = columns[3].strip() if len(columns) > 3 else 'unknown'
-                            print(f"{ip:<15} {mac:<18} {state:<8} {hostname:<15}")
-                
-                print("-" * 70)
-                print(f"Total devices: {len(lines) - 1}")
-            else:
-                print("No devices found in database")
+            for columns in rows:
+                if len(columns) >= 4:
+                    ip = columns[0].strip()
+                    mac = columns[1].strip()
+                    state = columns[2].strip()
+                    hostname = columns[3].strip() if len(columns) > 3 else 'unknown'
+                    print(f"{ip:<15} {mac:<18} {state:<8} {hostname:<15}")
+            
+            print("-" * 70)
+            print(f"Total devices: {len(rows)}")
         else:
-            print(f"Error listing devices: {result.stderr}")
+            print("No devices found in database")
     
     except Exception as e:
         print(f"Error listing devices: {e}")
@@ -300,10 +267,17 @@ def main():
     """
     Main function with command line argument parsing
     """
+    try:
+        db.configure_from_argv(sys.argv)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
     if len(sys.argv) < 2:
         print("Usage:")
         print(f"  python3 {sys.argv[0]} <ip_address> [hostname]     # Set hostname for specific IP")
         print(f"  python3 {sys.argv[0]} --list                      # List all devices")
+        print(f"  python3 {sys.argv[0]} --list --cidr 10.20.0.0/22  # List devices in a subnet")
         print(f"  python3 {sys.argv[0]} --help                      # Show this help")
         print("")
         print("Examples:")
@@ -322,8 +296,12 @@ def main():
         print("Usage:")
         print(f"  python3 {sys.argv[0]} <ip_address> [hostname]     # Set hostname for specific IP")
         print(f"  python3 {sys.argv[0]} --list                      # List all devices")
+        print(f"  python3 {sys.argv[0]} --list --cidr 10.20.0.0/22  # List devices in a subnet")
         print(f"  python3 {sys.argv[0]} --help                      # Show this help")
         print("")
+        print("Add --db sqlite:///path/to/network_info.db to any of these to use an")
+        print("embedded SQLite database instead of MySQL.")
+        print("")
         print("Modes:")
         print("  Interactive: Provide only IP address, script will prompt for hostname")
         print("  Direct:      Provide both IP address and hostname on command line")
@@ -341,7 +319,10 @@ def main():
         print("  - Cannot start or end with hyphen")
     
     elif arg == '--list':
-        list_devices()
+        if len(sys.argv) >= 4 and sys.argv[2] == '--cidr':
+            list_devices(sys.argv[3])
+        else:
+            list_devices()
     
     else:
         # Treat as IP address
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import subprocess
 import sys
 import getpass
@@ -133,7 +134,51 @@ def create_database_and_user(method, user, password):
             hw_address VARCHAR(17) NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             state VARCHAR(8) DEFAULT 'DOWN',
-            hostname VARCHAR(32) DEFAULT 'unknown'
+            hostname VARCHAR(32) DEFAULT 'unknown',
+            ip_int INT UNSIGNED NULL,
+            last_seen TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_ip_int (ip_int),
+            INDEX idx_hw_address (hw_address),
+            INDEX idx_last_seen (last_seen)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS arp_archive (
+            id INT PRIMARY KEY,
+            ip_address VARCHAR(15) NOT NULL,
+            hw_address VARCHAR(17) NOT NULL,
+            created_at TIMESTAMP NULL,
+            state VARCHAR(8),
+            hostname VARCHAR(32),
+            ip_int INT UNSIGNED NULL,
+            last_seen TIMESTAMP NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reason VARCHAR(16),
+            INDEX idx_archive_hw_address (hw_address)
+        ) ROW_FORMAT=COMPRESSED;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS address_history (
+            hw_address VARCHAR(17) NOT NULL,
+            ip_address VARCHAR(15) NOT NULL,
+            ip_int INT UNSIGNED NULL,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (hw_address, ip_address),
+            INDEX idx_history_ip_int (ip_int)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS arp_changes (
+            seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+            row_id INT NOT NULL,
+            ip_address VARCHAR(15) NOT NULL,
+            hw_address VARCHAR(17) NOT NULL,
+            state VARCHAR(8),
+            hostname VARCHAR(32),
+            removed TINYINT NOT NULL DEFAULT 0,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_changes_changed_at (changed_at)
         );
         """
     ]
@@ -156,6 +201,77 @@ def create_database_and_user(method, user, password):
         print(f"✗ Error creating database: {stderr}")
         return False
 
+def add_ip_int_column(method, user, password):
+    """
+    Add the indexed integer IP column to an arp_table created by an older setup
+    and back-fill it from ip_address
+    """
+    use_sudo = method == "sudo"
+    
+    success, stdout, stderr = run_mysql_command(
+        "USE network_info; SHOW COLUMNS FROM arp_table LIKE 'ip_int';",
+        user=user, password=password, use_sudo=use_sudo
+    )
+    
+    if not success:
+        print(f"✗ Error checking arp_table columns: {stderr}")
+        return False
+    
+    if 'ip_int' in stdout:
+        print("✓ Column 'ip_int' already present")
+        return True
+    
+    print("\nAdding integer IP column to arp_table...")
+    success, stdout, stderr = run_mysql_command(
+        "USE network_info; "
+        "ALTER TABLE arp_table ADD COLUMN ip_int INT UNSIGNED NULL, ADD INDEX idx_ip_int (ip_int); "
+        "UPDATE arp_table SET ip_int = INET_ATON(ip_address) WHERE ip_int IS NULL;",
+        user=user, password=password, use_sudo=use_sudo
+    )
+    
+    if success:
+        print("✓ Column 'ip_int' added and populated")
+        return True
+    else:
+        print(f"✗ Error adding ip_int column: {stderr}")
+        return False
+
+def add_last_seen_column(method, user, password):
+    """
+    Add the last_seen column used by arp_retention.py to an arp_table created
+    by an older setup.  Existing rows start out as seen now, so nothing is
+    archived until it has really been absent for the retention period.
+    """
+    use_sudo = method == "sudo"
+    
+    success, stdout, stderr = run_mysql_command(
+        "USE network_info; SHOW COLUMNS FROM arp_table LIKE 'last_seen';",
+        user=user, password=password, use_sudo=use_sudo
+    )
+    
+    if not success:
+        print(f"✗ Error checking arp_table columns: {stderr}")
+        return False
+    
+    if 'last_seen' in stdout:
+        print("✓ Column 'last_seen' already present")
+        return True
+    
+    print("\nAdding last_seen column to arp_table...")
+    success, stdout, stderr = run_mysql_command(
+        "USE network_info; "
+        "ALTER TABLE arp_table ADD COLUMN last_seen TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP, "
+        "ADD INDEX idx_hw_address (hw_address), ADD INDEX idx_last_seen (last_seen);",
+        user=user, password=password, use_sudo=use_sudo
+    )
+    
+    if success:
+        print("✓ Column 'last_seen' added")
+        return True
+    else:
+        print(f"✗ Error adding last_seen column: {stderr}")
+        return False
+
 def verify_setup():
     """
     Verify the setup by testing the andrewh user connection
@@ -211,10 +327,46 @@ def show_next_steps():
     print("  Password: letmein")
     print("\nFor more information, see README.md")
 
+def setup_sqlite(path):
+    """
+    Create an embedded SQLite network_info database (no server, no sudo)
+    """
+    import sqlite3
+    from network_db import DatabaseError
+    from sqlite_backend import SqliteBackend
+    
+    print(f"Creating SQLite database {path}...")
+    try:
+        backend = SqliteBackend(path)
+        tables = backend.run("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name;")
+        backend.close()
+    except (OSError, DatabaseError, sqlite3.Error) as e:
+        print(f"✗ Error creating database: {e}")
+        return False
+    
+    print("✓ Tables: " + ", ".join(row[0] for row in tables if not row[0].startswith('sqlite_')))
+    print("\nUse it by adding --db to each tool, or for all of them with:")
+    print(f"   export NETWORK_INFO_DB=sqlite://{os.path.abspath(path)}")
+    print("   python3 update_network_info.py")
+    return True
+
 def main():
     """
     Main setup function
     """
+    if '--help' in sys.argv:
+        print("Usage:")
+        print("  python3 setup_database.py                      # Create the MySQL database, user and tables")
+        print("  python3 setup_database.py --sqlite <file>      # Create an embedded SQLite database instead")
+        sys.exit(0)
+    
+    if '--sqlite' in sys.argv:
+        index = sys.argv.index('--sqlite')
+        if index + 1 >= len(sys.argv):
+            print("Usage: python3 setup_database.py --sqlite <database file>")
+            sys.exit(2)
+        sys.exit(0 if setup_sqlite(sys.argv[index + 1]) else 1)
+    
     print("Network Info Database Setup")
     print("="*40)
     print("This script will:")
@@ -269,6 +421,14 @@ def main():
         print("Database setup failed. Please check MySQL permissions.")
         sys.exit(1)
     
+    if not add_ip_int_column(method, user, password):
+        print("Database upgrade failed. Please check MySQL permissions.")
+        sys.exit(1)
+    
+    if not add_last_seen_column(method, user, password):
+        print("Database upgrade failed. Please check MySQL permissions.")
+        sys.exit(1)
+    
     # Step 4: Verify setup
     print("\n4. Verifying setup...")
     if not verify_setup():
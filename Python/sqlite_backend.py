@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""
+Embedded SQLite backend for the network_info tools (see network_db.py).
+
+Same tables and indexes as setup_database.py creates in MySQL, in WAL
+mode.  The few MySQL-only constructs the tools use are rewritten for
+SQLite (see SqliteBackend.translate), and each call's statements run as a
+single transaction.
+"""
+
+import re
+import socket
+import sqlite3
+import struct
+
+from network_db import DatabaseError
+
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS arp_table (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ip_address VARCHAR(15) NOT NULL,
+        hw_address VARCHAR(17) NOT NULL,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        state VARCHAR(8) DEFAULT 'DOWN',
+        hostname VARCHAR(32) DEFAULT 'unknown',
+        ip_int INTEGER NULL,
+        last_seen TIMESTAMP NULL DEFAULT (datetime('now', 'localtime'))
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_ip_int ON arp_table (ip_int);",
+    "CREATE INDEX IF NOT EXISTS idx_hw_address ON arp_table (hw_address);",
+    "CREATE INDEX IF NOT EXISTS idx_last_seen ON arp_table (last_seen);",
+    """
+    CREATE TABLE IF NOT EXISTS arp_archive (
+        id INTEGER PRIMARY KEY,
+        ip_address VARCHAR(15) NOT NULL,
+        hw_address VARCHAR(17) NOT NULL,
+        created_at TIMESTAMP NULL,
+        state VARCHAR(8),
+        hostname VARCHAR(32),
+        ip_int INTEGER NULL,
+        last_seen TIMESTAMP NULL,
+        archived_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        reason VARCHAR(16)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_archive_hw_address ON arp_archive (hw_address);",
+    """
+    CREATE TABLE IF NOT EXISTS address_history (
+        hw_address VARCHAR(17) NOT NULL,
+        ip_address VARCHAR(15) NOT NULL,
+        ip_int INTEGER NULL,
+        first_seen TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        last_seen TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        PRIMARY KEY (hw_address, ip_address)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_history_ip_int ON address_history (ip_int);",
+    """
+    CREATE TABLE IF NOT EXISTS arp_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        row_id INTEGER NOT NULL,
+        ip_address VARCHAR(15) NOT NULL,
+        hw_address VARCHAR(17) NOT NULL,
+        state VARCHAR(8),
+        hostname VARCHAR(32),
+        removed INTEGER NOT NULL DEFAULT 0,
+        changed_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON arp_changes (changed_at);",
+]
+
+
+
+def _inet_aton(address):
+    try:
+        return struct.unpack('!I', socket.inet_aton(address))[0]
+    except (OSError, TypeError):
+        return None
+
+
+class SqliteBackend:
+    """
+    Runs SQL against a SQLite file in this process
+    """
+
+    # MySQL-only syntax used by the tools, and its SQLite equivalent.
+    TRANSLATIONS = [
+        (re.compile(r'\bINSERT IGNORE\b', re.IGNORECASE), 'INSERT OR IGNORE'),
+        (re.compile(r'\bON DUPLICATE KEY UPDATE\b', re.IGNORECASE), 'ON CONFLICT DO UPDATE SET'),
+        (re.compile(r'\bSTART TRANSACTION\b', re.IGNORECASE), 'BEGIN'),
+        (re.compile(r'\bOPTIMIZE TABLE\s+\w+', re.IGNORECASE), 'VACUUM'),
+        (re.compile(r'\bLAST_INSERT_ID\(\)', re.IGNORECASE), 'last_insert_rowid()'),
+        # MySQL TIMESTAMPs read back in local time.
+        (re.compile(r'\b(CURRENT_TIMESTAMP|NOW\(\))', re.IGNORECASE), "datetime('now', 'localtime')"),
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.create_function('INET_ATON', 1, _inet_aton, deterministic=True)
+        for statement in SQLITE_SCHEMA:
+            self.conn.execute(statement)
+
+    @classmethod
+    def translate(cls, sql):
+        for pattern, replacement in cls.TRANSLATIONS:
+            sql = pattern.sub(replacement, sql)
+        return sql
+
+    @staticmethod
+    def statements(sql):
+        """
+        Split a batch into complete statements (semicolons inside quoted
+        strings do not end a statement)
+        """
+        pending = ''
+        for part in sql.split(';'):
+            pending += part + ';'
+            if sqlite3.complete_statement(pending):
+                if pending.strip(' \t\r\n;'):
+                    yield pending.strip()
+                pending = ''
+        if pending.strip(' \t\r\n;'):
+            yield pending.strip()
+
+    def run(self, sql):
+        cur = self.conn.cursor()
+        statements = list(self.statements(self.translate(sql)))
+        # A batch that manages its own transaction is run as written; any
+        # other is made atomic (and synced once) by wrapping it.
+        wrap = not any(statement.upper().startswith(('BEGIN', 'VACUUM')) for statement in statements)
+        rows = []
+        try:
+            if wrap:
+                cur.execute('BEGIN;')
+            for statement in statements:
+                cur.execute(statement)
+                if cur.description:
+                    rows.extend(['NULL' if value is None else str(value) for value in row] for row in cur)
+            if wrap:
+                cur.execute('COMMIT;')
+        except sqlite3.Error as e:
+            if self.conn.in_transaction:
+                cur.execute('ROLLBACK;')
+            raise DatabaseError(str(e)) from e
+        return rows
+
+    def close(self):
+        self.conn.close()
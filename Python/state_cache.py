@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+"""
+Versioned in-memory copy of the device state the tools maintain.
+
+monitor.py feeds its node table into a StateCache as it processes
+observations; query_service.py keeps one current from arp_table and/or
+node.db.  Readers (the HTTP query service) never touch the databases.
+
+Every change that matters to a reader (a device appearing or going away,
+or its address, state, name or maker changing) stamps the device with the
+next version number.  Versions start from the time the cache was created
+in microseconds, so they keep increasing across restarts and a version
+from before the cache existed is recognisable.  last_seen is refreshed in
+place without a new version: a reader polling for changes is not sent
+every device each time the ARP cache is read.
+
+A reader holding version V asks for changed(V): the devices stamped after
+V, found by walking the devices in version order from the newest, and the
+devices removed after V from a bounded list of removals.  When V is older
+than the oldest removal still remembered (or unknown to this cache) the
+reader must fetch everything again.
+
+Each change is also an event, numbered by the version it took, kept in a
+bounded replay buffer for the change feed:
+
+    insert      a device appeared
+    address     its IP address changed ("old" is the previous address)
+    state       its state changed ("old" is the previous state)
+    hostname    its name changed ("old" is the previous name)
+    update      its MAC was learned ("old" is the address it was known by)
+                or its maker changed
+    remove      it is gone
+
+A change to several fields is one event per field, in that order.  Events
+carry the device's whole state, so applying one twice does no harm.  The
+first load of a source (replace()) is a baseline, not news, and raises no
+events.  events_after(seq) waits for the events after seq, or returns None
+when some of them have already left the buffer.
+"""
+
+import collections
+import json
+import threading
+import time
+
+from host_table import cidr_range, int_to_ip, int_to_mac, ip_to_int, mac_to_int
+
+# Removals remembered for changed(); an older version gets a full listing.
+DEFAULT_REMOVALS = 4096
+
+# Events kept for the change feed to replay to a client that reconnects.
+DEFAULT_EVENTS = 10000
+
+EVENT_TYPES = ('insert', 'address', 'state', 'hostname', 'update', 'remove')
+
+_NO_MAC = 1 << 48
+
+
+def device_key(ip, mac):
+    """
+    Key of a device within a source: its MAC, or its address while the MAC is unknown
+    """
+    return mac if mac else _NO_MAC | ip
+
+
+class DeviceState:
+    """
+    One device as one source (tool) sees it
+    """
+    __slots__ = ('source', 'ip', 'mac', 'state', 'name', 'maker', 'last_seen', 'event_time', 'version')
+
+    def __init__(self, source, ip, mac, state='', name='', maker='', last_seen=0, event_time=0, version=0):
+        self.source = source
+        self.ip = ip
+        self.mac = mac
+        self.state = state
+        self.name = name
+        self.maker = maker
+        self.last_seen = last_seen
+        self.event_time = event_time
+        self.version = version
+
+    @property
+    def id(self):
+        return int_to_mac(self.mac) if self.mac else int_to_ip(self.ip)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'source': self.source,
+            'ip_address': int_to_ip(self.ip) if self.ip else '',
+            'hw_address': int_to_mac(self.mac) if self.mac else '',
+            'state': self.state,
+            'name': self.name,
+            'maker': self.maker,
+            'last_seen': self.last_seen,
+            'event_time': self.event_time,
+            'version': self.version,
+        }
+
+    def __repr__(self):
+        return 'DeviceState(%s, %s, %r, v%d)' % (self.source, self.id, self.state, self.version)
+
+
+class DeviceFilter:
+    """
+    Which devices a query wants: a CIDR block, a state, a source
+    Raises ValueError for a malformed block
+    """
+    __slots__ = ('first', 'last', 'state', 'source')
+
+    def __init__(self, cidr=None, state=None, source=None):
+        self.first, self.last = cidr_range(cidr) if cidr else (0, 0xffffffff)
+        self.state = state.lower() if state else None
+        self.source = source
+
+    def __call__(self, device):
+        return (self.first <= device.ip <= self.last and (self.state is None or device.state == self.state)
+                and (self.source is None or device.source == self.source))
+
+
+class StateCache:
+    """
+    Devices from any number of sources, keyed by (source, device key)
+    """
+
+    def __init__(self, removals=DEFAULT_REMOVALS, events=DEFAULT_EVENTS):
+        self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+        self.base = int(time.time() * 1e6)
+        self.version = self.base
+        # Oldest first by version: a change moves the device to the end.
+        self.devices = collections.OrderedDict()
+        self.removed = collections.deque(maxlen=removals)
+        self.forgotten = self.base
+        # (seq, type, source, ip, old ip, encoded event), oldest first.
+        self.events = collections.deque(maxlen=events)
+        self.events_forgotten = self.base
+        # Sources past their first load, whose changes are events.
+        self.announced = set()
+
+    def _event(self, kind, device, old=None, old_ip=0):
+        self.version += 1
+        if device.source not in self.announced:
+            return
+        if len(self.events) == self.events.maxlen:
+            self.events_forgotten = self.events[0][0]
+        payload = json.dumps({'seq': self.version, 'type': kind, 'time': round(time.time(), 3),
+                              'source': device.source, 'id': device.id, 'old': old, 'device': device.to_dict()},
+                             separators=(',', ':'))
+        self.events.append((self.version, kind, device.source, device.ip, old_ip, payload))
+
+    def _stamp(self, key, device, changes):
+        # changes: [(type, old, old ip)]; the device takes the last event's version.
+        device.version = self.version + len(changes)
+        self.devices[key] = device
+        self.devices.move_to_end(key)
+        for kind, old, old_ip in changes:
+            self._event(kind, device, old, old_ip)
+
+    def _note_removed(self, source, id):
+        if len(self.removed) == self.removed.maxlen:
+            self.forgotten = self.removed[0][0]
+        self.removed.append((self.version, source, id))
+
+    def _remove(self, key):
+        device = self.devices.pop(key)
+        device.version = self.version + 1
+        self._event('remove', device)
+        self._note_removed(device.source, device.id)
+        return device
+
+    def _put(self, source, ip, mac, state, name, maker, last_seen, event_time, old_key=None):
+        state = (state or '').lower()
+        key = (source, device_key(ip, mac))
+        device = self.devices.get(key)
+        rekeyed = device is None and old_key is not None and old_key in self.devices
+        if rekeyed:
+            # A device known by address whose MAC was learned, or one without
+            # a MAC that moved: the same device under a new key.
+            device = self.devices.pop(old_key)
+        if device is None:
+            device = DeviceState(source, ip, mac, state, name, maker, last_seen, event_time)
+            self._stamp(key, device, [('insert', None, 0)])
+            return True
+
+        old_id = device.id
+        changes = []
+        if device.ip != ip:
+            changes.append(('address', int_to_ip(device.ip) if device.ip else '', device.ip))
+        if device.state != state:
+            changes.append(('state', device.state, 0))
+        if device.name != name:
+            changes.append(('hostname', device.name, 0))
+        if device.mac != mac:
+            changes.append(('update', old_id, 0))
+        elif device.maker != maker and not changes:
+            changes.append(('update', None, 0))
+        device.ip, device.mac, device.state, device.name, device.maker = ip, mac, state, name, maker
+        device.last_seen = max(device.last_seen, last_seen)
+        device.event_time = event_time or device.event_time
+        if changes:
+            self._stamp(key, device, changes)
+        if rekeyed:
+            self._note_removed(source, old_id)
+        return bool(changes)
+
+    def put(self, source, ip, mac, state, name='', maker='', last_seen=0, event_time=0, old_ip=None):
+        """
+        Add or update one device; old_ip is the address a device without a
+        known MAC was keyed by before this sighting, if it differs
+        Returns True if the device is new or changed
+        """
+        old_key = (source, device_key(old_ip, 0)) if old_ip is not None else None
+        with self.lock:
+            self.announced.add(source)
+            changed = self._put(source, ip, mac, state, name, maker, last_seen, event_time, old_key)
+            if changed:
+                self.updated.notify_all()
+            return changed
+
+    def put_record(self, source, record, old_ip=None):
+        """
+        put() a HostRecord
+        """
+        return self.put(source, record.ip, record.mac, record.state, record.name, record.maker,
+                        record.last_seen, record.event_time, old_ip)
+
+    def remove(self, source, ip, mac):
+        with self.lock:
+            key = (source, device_key(ip, mac))
+            if key in self.devices:
+                self._remove(key)
+                self.updated.notify_all()
+                return True
+            return False
+
+    def replace(self, source, records):
+        """
+        Make the devices of source exactly records (HostRecords, e.g. a
+        table just read from a database), versioning only what changed;
+        the first replace() of a source raises no events
+        Returns (added or changed, removed) counts
+        """
+        with self.lock:
+            seen = set()
+            changed = 0
+            for record in records:
+                seen.add((source, device_key(record.ip, record.mac)))
+                changed += self._put(source, record.ip, record.mac, record.state, record.name, record.maker,
+                                     record.last_seen, record.event_time)
+            gone = [key for key in self.devices if key[0] == source and key not in seen]
+            for key in gone:
+                self._remove(key)
+            self.announced.add(source)
+            if changed or gone:
+                self.updated.notify_all()
+            return changed, len(gone)
+
+    def events_after(self, seq, timeout=None):
+        """
+        (version, [(seq, type, source, ip, old ip, encoded event) ...]) of
+        the events after seq, waiting up to timeout seconds for one if
+        there are none yet; None if the buffer no longer reaches back to seq
+        """
+        with self.lock:
+            if seq < self.events_forgotten or seq > self.version:
+                return None
+            if timeout and not (self.events and self.events[-1][0] > seq):
+                self.updated.wait(timeout)
+                if seq < self.events_forgotten:
+                    return None
+            events = []
+            for event in reversed(self.events):
+                if event[0] <= seq:
+                    break
+                events.append(event)
+            return self.version, events[::-1]
+
+    def wake(self):
+        """
+        Release every events_after() waiting, e.g. when shutting down
+        """
+        with self.lock:
+            self.updated.notify_all()
+
+    def select(self, wanted=None):
+        """
+        (version, [DeviceState ...] in address order, fingerprint) of the
+        devices wanted (a DeviceFilter); the fingerprint changes whenever
+        the selection does, and serves as an ETag
+        """
+        with self.lock:
+            devices = [device for device in self.devices.values() if wanted is None or wanted(device)]
+            version = self.version
+        devices.sort(key=lambda device: (device.ip, device.source, device.mac))
+        newest = max((device.version for device in devices), default=self.base)
+        # Anything joining the selection has just been stamped, and anything
+        # leaving it shrinks the count unless something else joined.
+        return version, devices, '%d-%d' % (newest, len(devices))
+
+    def changed(self, since, wanted=None):
+        """
+        (version, devices changed after since that are wanted, [(source, id)
+        of devices removed or no longer wanted]), or None if since is too
+        old for this cache to know what changed
+        """
+        with self.lock:
+            if since < self.forgotten or since > self.version:
+                return None
+            devices = []
+            gone = []
+            for device in reversed(self.devices.values()):
+                if device.version <= since:
+                    break
+                if wanted is None or wanted(device):
+                    devices.append(device)
+                else:
+                    gone.append((device.source, device.id))
+            gone.extend((source, id) for version, source, id in self.removed if version > since)
+            return self.version, devices[::-1], gone
+
+    def find(self, text):
+        """
+        Devices with this IP or MAC address, from every source
+        Raises ValueError if text is neither
+        """
+        if text.count('.') == 3:
+            try:
+                ip = ip_to_int(text)
+            except OSError:
+                raise ValueError(f"'{text}' is not an IP or MAC address")
+            match = lambda device: device.ip == ip
+        else:
+            mac = mac_to_int(text)
+            if not mac:
+                raise ValueError(f"'{text}' is not an IP or MAC address")
+            match = lambda device: device.mac == mac
+        with self.lock:
+            return [device for device in self.devices.values() if match(device)]
+
+    def summary(self, wanted=None):
+        """
+        (version, {source: {state: count}})
+        """
+        with self.lock:
+            counts = {}
+            for device in self.devices.values():
+                if wanted is None or wanted(device):
+                    states = counts.setdefault(device.source, {})
+                    states[device.state] = states.get(device.state, 0) + 1
+            return self.version, counts
+
+    def __len__(self):
+        return len(self.devices)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+"""
+Host state-transition history.
+
+node and arp_table only hold each host's current state.  Every transition
+(host, old state, new state, time, cause) is also appended to a log here,
+as a row of small integers in a SQLite file of its own, so questions like
+"how often was this host down last month" can be answered.
+
+Alongside the log, hourly and daily rollups hold the seconds each host
+spent up, down and degraded in each bucket and how many times it changed
+state.  They are maintained incrementally: when a host changes state, the
+interval since its previous transition is credited to the buckets it spans.
+Long-range queries read the rollups and only the still-open interval since
+the last transition is computed on the fly.
+
+Retention (defaults):
+
+    raw log          400 days, except each host's latest transition
+    hourly rollups   90 days
+    daily rollups    2 years
+
+A host is its MAC address when known, otherwise its IP address, so a device
+that moves keeps one history.  Buckets are aligned to UTC.
+"""
+
+import ipaddress
+import os
+import sqlite3
+import sys
+import time
+
+from host_table import int_to_ip, int_to_mac, ip_to_int, mac_to_int, \
+    CAUSE_NEW, CAUSE_STATE, CAUSE_MOVED, CAUSE_CONFLICT
+
+HOUR = 3600
+DAY = 86400
+
+DEFAULT_RAW_DAYS = 400
+DEFAULT_HOURLY_DAYS = 90
+DEFAULT_DAILY_DAYS = 730
+
+# Retention is enforced at most this often by record().
+PRUNE_INTERVAL = HOUR
+
+# States and causes are stored as their index here; anything not listed
+# is stored as 0.
+STATES = ('unknown', 'up', 'down', 'degraded')
+CAUSES = ('', CAUSE_NEW, CAUSE_STATE, CAUSE_MOVED, CAUSE_CONFLICT)
+
+# States whose time is accumulated in the rollups.
+ROLLUP_STATES = ('up', 'down', 'degraded')
+
+_STATE_CODE = {state: code for code, state in enumerate(STATES)}
+_CAUSE_CODE = {cause: code for code, cause in enumerate(CAUSES)}
+
+_COLUMNS = ", ".join(state + "_s" for state in ROLLUP_STATES)
+
+
+def state_code(state):
+    return _STATE_CODE.get((state or '').lower(), 0)
+
+
+def host_key(ip, mac):
+    """
+    (mac, ip) identifying a host in the rollups: ip is 0 when the MAC is known
+    """
+    return (mac, 0) if mac else (0, ip)
+
+
+def split_interval(start, end, span):
+    """
+    Yield (bucket start, seconds) for the part of [start, end) in each
+    span-aligned bucket
+    """
+    while start < end:
+        bucket = start - start % span
+        stop = min(end, bucket + span)
+        yield bucket, stop - start
+        start = stop
+
+
+class StateHistory:
+    """
+    Transition log and rollups in a SQLite file
+    """
+
+    def __init__(self, db_path, raw_days=DEFAULT_RAW_DAYS, hourly_days=DEFAULT_HOURLY_DAYS,
+                 daily_days=DEFAULT_DAILY_DAYS):
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+        self.pruned = 0
+
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state_log ("
+                          "ts INTEGER NOT NULL, mac INTEGER NOT NULL, ip INTEGER NOT NULL, "
+                          "old_state INTEGER NOT NULL, new_state INTEGER NOT NULL, "
+                          "cause INTEGER NOT NULL);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS state_log_ts ON state_log (ts);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS state_log_host ON state_log (mac, ip, ts);")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state_rollup ("
+                          "mac INTEGER NOT NULL, ip INTEGER NOT NULL, span INTEGER NOT NULL, "
+                          "bucket INTEGER NOT NULL, up_s INTEGER DEFAULT 0, down_s INTEGER DEFAULT 0, "
+                          "degraded_s INTEGER DEFAULT 0, changes INTEGER DEFAULT 0, "
+                          "PRIMARY KEY (mac, ip, span, bucket)) WITHOUT ROWID;")
+
+        # Latest (time, state) per host, the start of its open interval.
+        self.last = {}
+        for mac, ip, ts, state in self.conn.execute(
+                "SELECT mac, CASE WHEN mac THEN 0 ELSE ip END, ts, new_state FROM state_log "
+                "WHERE rowid IN (SELECT max(rowid) FROM state_log "
+                "GROUP BY mac, CASE WHEN mac THEN 0 ELSE ip END);"):
+            self.last[(mac, ip)] = (ts, state)
+
+    def record(self, timestamp, ip, mac, old_state, new_state, cause=CAUSE_STATE):
+        """
+        Append a transition and credit the interval it closes to the rollups
+        ip and mac are integers (mac 0 if unknown); states are names
+        """
+        ts = int(timestamp)
+        mac = mac or 0
+        key = host_key(ip, mac)
+        old_code = state_code(old_state)
+        new_code = state_code(new_state)
+
+        credits = {}
+        previous = self.last.get(key)
+        if previous is not None:
+            since, state = previous
+            self._credit(credits, since, ts, state, ts)
+        if old_code != new_code:
+            for span in (HOUR, DAY):
+                credits.setdefault((span, ts - ts % span), [0, 0, 0, 0])[3] += 1
+
+        with self._transaction() as cur:
+            cur.execute("INSERT INTO state_log VALUES (?, ?, ?, ?, ?, ?);",
+                        (ts, mac, ip, old_code, new_code, _CAUSE_CODE.get(cause, 0)))
+            cur.executemany(
+                f"INSERT INTO state_rollup (mac, ip, span, bucket, {_COLUMNS}, changes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (mac, ip, span, bucket) DO UPDATE SET "
+                "up_s = up_s + excluded.up_s, down_s = down_s + excluded.down_s, "
+                "degraded_s = degraded_s + excluded.degraded_s, changes = changes + excluded.changes;",
+                [key + (span, bucket, *values) for (span, bucket), values in credits.items()])
+
+        self.last[key] = (ts, new_code)
+
+        if ts - self.pruned >= PRUNE_INTERVAL:
+            self.prune(ts)
+
+    def _credit(self, credits, start, end, state, now):
+        if state >= len(STATES) or STATES[state] not in ROLLUP_STATES:
+            return
+        column = ROLLUP_STATES.index(STATES[state])
+        # Hourly buckets that retention would delete straight away are not written.
+        oldest_hour = now - self.hourly_days * DAY
+        for span in (HOUR, DAY):
+            for bucket, seconds in split_interval(start, end, span):
+                if span == HOUR and bucket + HOUR <= oldest_hour:
+                    continue
+                credits.setdefault((span, bucket), [0, 0, 0, 0])[column] += seconds
+
+    def prune(self, now=None):
+        """
+        Drop log rows and rollups older than their retention
+        """
+        now = int(time.time() if now is None else now)
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM state_log WHERE ts < ? AND rowid NOT IN "
+                        "(SELECT max(rowid) FROM state_log GROUP BY mac, CASE WHEN mac THEN 0 ELSE ip END);",
+                        (now - self.raw_days * DAY,))
+            cur.execute("DELETE FROM state_rollup WHERE span = ? AND bucket < ?;",
+                        (HOUR, now - self.hourly_days * DAY))
+            cur.execute("DELETE FROM state_rollup WHERE span = ? AND bucket < ?;",
+                        (DAY, now - self.daily_days * DAY))
+        self.pruned = now
+
+    def find_host(self, ip=0, mac=0):
+        """
+        Host key for a MAC, or for the device last seen at an IP
+        """
+        if mac:
+            return host_key(0, mac)
+        row = self.conn.execute("SELECT mac FROM state_log WHERE ip = ? ORDER BY ts DESC LIMIT 1;",
+                                (ip,)).fetchone()
+        return host_key(ip, row[0] if row else 0)
+
+    def transitions(self, key, start, end):
+        """
+        Raw transitions of a host in [start, end), oldest first, as
+        (time, ip, old state, new state, cause)
+        """
+        mac, ip = key
+        if mac:
+            rows = self.conn.execute("SELECT ts, ip, old_state, new_state, cause FROM state_log "
+                                     "WHERE mac = ? AND ts >= ? AND ts < ? ORDER BY ts, rowid;",
+                                     (mac, start, end))
+        else:
+            rows = self.conn.execute("SELECT ts, ip, old_state, new_state, cause FROM state_log "
+                                     "WHERE mac = 0 AND ip = ? AND ts >= ? AND ts < ? ORDER BY ts, rowid;",
+                                     (ip, start, end))
+        return [(ts, row_ip, STATES[old], STATES[new], CAUSES[cause] if cause < len(CAUSES) else '')
+                for ts, row_ip, old, new, cause in rows]
+
+    def rollups(self, key, span, start, end, now=None):
+        """
+        {bucket start: {'up': s, 'down': s, 'degraded': s, 'changes': n}}
+        for the span-aligned buckets overlapping [start, end), including the
+        host's current, still open interval
+        """
+        now = int(time.time() if now is None else now)
+        first = start - start % span
+        buckets = {}
+        for row in self.conn.execute(
+                f"SELECT bucket, {_COLUMNS}, changes FROM state_rollup "
+                "WHERE mac = ? AND ip = ? AND span = ? AND bucket >= ? AND bucket < ? ORDER BY bucket;",
+                key + (span, first, end)):
+            buckets[row[0]] = dict(zip(ROLLUP_STATES + ('changes',), row[1:]))
+
+        previous = self.last.get(key)
+        if previous is not None:
+            open_credits = {}
+            since, state = previous
+            self._credit(open_credits, max(since, first), min(end, now), state, now)
+            for (credit_span, bucket), values in open_credits.items():
+                if credit_span == span:
+                    totals = buckets.setdefault(bucket, dict.fromkeys(ROLLUP_STATES + ('changes',), 0))
+                    for state_name, seconds in zip(ROLLUP_STATES, values):
+                        totals[state_name] += seconds
+        return dict(sorted(buckets.items()))
+
+    def availability(self, key, start, end, now=None):
+        """
+        Seconds per state, changes and fraction of observed time up over
+        [start, end), from daily rollups for ranges over a week, hourly below
+        """
+        span = DAY if end - start > 7 * DAY else HOUR
+        totals = dict.fromkeys(ROLLUP_STATES + ('changes',), 0)
+        for values in self.rollups(key, span, start, end, now).values():
+            for name in totals:
+                totals[name] += values[name]
+        observed = sum(totals[state] for state in ROLLUP_STATES)
+        totals['up_fraction'] = totals['up'] / observed if observed else None
+        return totals
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT/ROLLBACK
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.cur = self.conn.cursor()
+        self.cur.execute("BEGIN IMMEDIATE;")
+        return self.cur
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cur.execute("COMMIT;" if exc_type is None else "ROLLBACK;")
+        return False
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def main():
+    """
+    Show a host's availability and transitions from a history database
+    """
+    if len(sys.argv) < 3 or '--help' in sys.argv:
+        print("Usage:")
+        print("  python3 state_history.py <history db> <ip or mac>            # Last 30 days")
+        print("  python3 state_history.py <history db> <ip or mac> --days 7   # Last 7 days")
+        print("  python3 state_history.py <history db> <ip or mac> --daily    # Per-day breakdown")
+        print("  python3 state_history.py <history db> <ip or mac> --hourly   # Per-hour breakdown")
+        return
+
+    if not os.path.exists(sys.argv[1]):
+        print(f"Error: no history database {sys.argv[1]}")
+        sys.exit(1)
+
+    host = sys.argv[2]
+    try:
+        days = float(get_option_value('--days') or 30)
+        if ':' in host:
+            mac, ip = mac_to_int(host), 0
+        else:
+            mac, ip = 0, ip_to_int(str(ipaddress.IPv4Address(host)))
+    except ValueError:
+        print("Error: expected an IP or MAC address and a numeric --days")
+        sys.exit(1)
+
+    history = StateHistory(sys.argv[1])
+    now = int(time.time())
+    start = now - int(days * DAY)
+    key = history.find_host(ip, mac)
+    name = int_to_mac(key[0]) if key[0] else int_to_ip(key[1])
+
+    totals = history.availability(key, start, now, now)
+    print(f"{name} over the last {days:g} days")
+    for state in ROLLUP_STATES:
+        print(f"  {state:<10} {totals[state] / HOUR:10.1f} h")
+    print(f"  {'changes':<10} {totals['changes']:10d}")
+    if totals['up_fraction'] is not None:
+        print(f"  {'available':<10} {totals['up_fraction']:10.2%}")
+
+    for option, span, fmt in (('--daily', DAY, '%Y-%m-%d'), ('--hourly', HOUR, '%Y-%m-%d %H:00')):
+        if option in sys.argv:
+            print()
+            print("  (buckets in UTC)")
+            for bucket, values in history.rollups(key, span, start, now, now).items():
+                print(f"  {time.strftime(fmt, time.gmtime(bucket)):<17}"
+                      + "".join(f" {state} {values[state]:>6}s" for state in ROLLUP_STATES)
+                      + f" changes {values['changes']}")
+
+    print()
+    for ts, ip_int, old, new, cause in history.transitions(key, start, now):
+        print(f"  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))}  "
+              f"{int_to_ip(ip_int) if ip_int else '-':<15} {old} -> {new}  {cause}")
+
+    history.close()
+
+
+if __name__ == "__main__":
+    main()
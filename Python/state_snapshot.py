@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+"""
+Warm-start snapshots of monitor.py's in-memory node table.
+
+The daemon periodically writes its DeviceTable to a compact binary file and
+memory-maps it back on startup, so a restart neither re-reads the node table
+row by row nor re-verifies (and re-notifies) every host on the first fing
+pass.
+
+File layout (network byte order):
+
+    header   magic 'NMSS', version u16, reserved u16, written f64,
+             count u32, max event_time u32, payload length u32, payload crc32 u32
+    record   ip u32, mac 6 bytes, flags u8, check_port u16,
+             last_seen u32, event_time u32,
+             state, name, maker (each u8 len + utf-8)
+
+count and max event_time describe the node table as the snapshot saw it.
+The caller compares them, and the database file's modification time against
+the written time, with the database; if the database has moved on
+(a crash after a db write but before the next snapshot) the snapshot is
+discarded and the daemon cold-starts from the database.
+"""
+
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from host_table import DeviceTable, HostRecord
+
+SNAPSHOT_MAGIC = b'NMSS'
+SNAPSHOT_VERSION = 1
+
+FLAG_NOTIFY = 0x01
+
+_HEADER = struct.Struct('!4sHHdIIII')
+_RECORD = struct.Struct('!I6sBHII')
+
+
+def _pack_text(text):
+    data = (text or '').encode('utf-8')[:255]
+    return bytes((len(data),)) + data
+
+
+def _unpack_text(buf, offset):
+    length = buf[offset]
+    offset += 1
+    return str(buf[offset:offset + length], 'utf-8', 'replace'), offset + length
+
+
+def table_marker(records):
+    """
+    (count, max event_time) of a set of records, to compare with the database
+    """
+    count = 0
+    latest = 0
+    for record in records:
+        count += 1
+        if record.event_time > latest:
+            latest = record.event_time
+    return count, latest
+
+
+def write_snapshot(path, hosts):
+    """
+    Atomically write hosts (a DeviceTable) to path
+    Returns the number of records written
+    """
+    records = list(hosts)
+    count, latest = table_marker(records)
+
+    parts = []
+    for record in records:
+        flags = FLAG_NOTIFY if record.notify else 0
+        parts.append(_RECORD.pack(record.ip, record.mac.to_bytes(6, 'big'), flags,
+                                  record.check_port or 0, int(record.last_seen), int(record.event_time)))
+        parts.append(_pack_text(record.state))
+        parts.append(_pack_text(record.name))
+        parts.append(_pack_text(record.maker))
+    payload = b''.join(parts)
+
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, time.time(),
+                          count, latest, len(payload), zlib.crc32(payload))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def load_snapshot(path):
+    """
+    Memory-map and decode a snapshot
+    Returns (DeviceTable, (count, max event_time), written) or raises ValueError
+    with the reason the snapshot cannot be used
+    """
+    try:
+        f = open(path, 'rb')
+    except OSError as e:
+        raise ValueError(f"cannot open snapshot: {e.strerror}")
+
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _HEADER.size:
+            raise ValueError("snapshot too short")
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            buf = memoryview(mapped)
+            try:
+                return _decode(buf, size)
+            finally:
+                buf.release()
+
+
+def _decode(buf, size):
+    magic, version, _, written, count, latest, length, crc = _HEADER.unpack_from(buf, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("not a snapshot file")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"snapshot version {version} not supported")
+    if _HEADER.size + length != size:
+        raise ValueError("snapshot length mismatch")
+    payload = buf[_HEADER.size:]
+    try:
+        if zlib.crc32(payload) != crc:
+            raise ValueError("snapshot checksum mismatch")
+
+        hosts = DeviceTable()
+        offset = 0
+        for _ in range(count):
+            ip, mac, flags, check_port, last_seen, event_time = _RECORD.unpack_from(payload, offset)
+            offset += _RECORD.size
+            state, offset = _unpack_text(payload, offset)
+            name, offset = _unpack_text(payload, offset)
+            maker, offset = _unpack_text(payload, offset)
+            hosts.add(HostRecord(ip, int.from_bytes(mac, 'big'), state, name=name, maker=maker,
+                                 notify=bool(flags & FLAG_NOTIFY), check_port=check_port,
+                                 last_seen=last_seen, event_time=event_time))
+    except (struct.error, IndexError):
+        raise ValueError("snapshot truncated")
+    finally:
+        payload.release()
+
+    return hosts, (count, latest), written
@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+
+"""
+Active sweep scanner, the built-in alternative to fing for monitor.py.
+
+Every address of a CIDR block is probed from a single asyncio event loop
+with up to max_in_flight probes outstanding, so silent devices that never
+appear in the kernel ARP cache are found too.  Hosts coming up, changing
+MAC or going down are reported as fing log lines
+
+    2026/10/19 10:00:00;up;192.168.10.5;;host5.lan;aa:bb:cc:00:00:05;
+
+which monitor.py reads exactly as it reads fing's output.  How a host is
+probed is up to the transport:
+
+    arp    ARP who-has on the local segment (Linux AF_PACKET, CAP_NET_RAW),
+           which also gives the MAC
+    icmp   ICMP echo over a raw socket (CAP_NET_RAW)
+    tcp    TCP connect to a few common ports, a refused connection counts
+           as up; needs no privileges
+    fake   an in-memory table of hosts, for tests
+
+"auto" picks arp for a block on a directly attached interface and icmp for
+a routed one when raw sockets can be opened, and tcp when they cannot.
+MACs the icmp and tcp transports cannot see are filled in from the kernel
+neighbour table, which the probes themselves populate on the local segment.
+
+Probes are paced by a ProbeLimiter of their own (DEFAULT_SWEEP_RATE,
+DEFAULT_SWEEP_SUBNET_RATE), so a sweep does not use up the budget of the
+monitor's verification pings.  At the default rates one pass over a /22
+takes about a second, so a sweep with its retry pass is done in three to
+four seconds.
+"""
+
+import asyncio
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from host_table import cidr_range, int_to_ip, int_to_mac, ip_to_int, mac_to_int
+from probe_limiter import ProbeLimiter
+
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_RETRIES = 1
+DEFAULT_MAX_IN_FLIGHT = 1024
+DEFAULT_INTERVAL = 60
+DEFAULT_DOWN_AFTER = 2
+
+# Reverse DNS lookups outstanding at once (each holds an executor thread).
+DEFAULT_MAX_LOOKUPS = 16
+
+DEFAULT_SWEEP_RATE = 1000.0
+DEFAULT_SWEEP_SUBNET_RATE = 256.0
+
+# Tried together on each host by the tcp transport.
+TCP_PORTS = (80, 443, 22, 445)
+
+TRANSPORTS = ('auto', 'arp', 'icmp', 'tcp')
+
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+_ETHER = struct.Struct('!6s6sH')
+_ARP = struct.Struct('!HHBBH6sI6sI')
+_ICMP = struct.Struct('!BBHHH')
+_BROADCAST = b'\xff' * 6
+
+
+def fing_line(state, ip, mac=0, name='', maker='', timestamp=None):
+    """
+    A host in the "log,csv" format fing writes
+    """
+    stamp = time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(timestamp))
+    return ';'.join((stamp, state, int_to_ip(ip), '', name, int_to_mac(mac) if mac else '', maker)) + '\n'
+
+
+def read_neighbours(path='/proc/net/arp'):
+    """
+    Complete entries of the kernel neighbour table as {ip: mac} integers
+    """
+    neighbours = {}
+    try:
+        with open(path) as f:
+            next(f, None)
+            for line in f:
+                fields = line.split()
+                # IP address, HW type, Flags, HW address, Mask, Device
+                if len(fields) >= 4 and int(fields[2], 16) & 0x2:
+                    mac = mac_to_int(fields[3])
+                    if mac:
+                        neighbours[ip_to_int(fields[0])] = mac
+    except (OSError, ValueError):
+        pass
+    return neighbours
+
+
+def attached_interface(cidr, path='/proc/net/route'):
+    """
+    Name of the interface with an on-link route covering the whole block,
+    or None when the block is routed (or this is not Linux)
+    """
+    first, last = cidr_range(cidr)
+    best = None
+    try:
+        with open(path) as f:
+            next(f, None)
+            for line in f:
+                fields = line.split()
+                # Iface, Destination, Gateway, Flags, ..., Mask (little-endian hex)
+                if len(fields) < 8 or int(fields[2], 16) != 0:
+                    continue
+                destination = socket.ntohl(int(fields[1], 16))
+                mask = socket.ntohl(int(fields[7], 16))
+                if mask and first & mask == destination and last & mask == destination:
+                    if best is None or mask > best[0]:
+                        best = (mask, fields[0])
+    except (OSError, ValueError):
+        return None
+    return best[1] if best else None
+
+
+def interface_addresses(interface):
+    """
+    (mac, ip) integers of a local interface
+    """
+    import fcntl
+
+    with open(f'/sys/class/net/{interface}/address') as f:
+        mac = mac_to_int(f.read().strip())
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        # SIOCGIFADDR; the address is at bytes 20..24 of the returned ifreq.
+        ifreq = fcntl.ioctl(s.fileno(), 0x8915, struct.pack('256s', interface.encode()[:15]))
+    return mac, struct.unpack('!I', ifreq[20:24])[0]
+
+
+def can_use_raw_sockets():
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP).close()
+        return True
+    except OSError:
+        return False
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class Transport:
+    """
+    How a sweep probes one address
+
+    probe(ip) is a coroutine returning the host's MAC (0 when the transport
+    cannot see it) once it answers; the scanner cancels it when the timeout
+    expires.  sockets_per_probe limits in-flight probes to what the process
+    may have open.
+    """
+    name = 'none'
+    sockets_per_probe = 0
+
+    async def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def probe(self, ip):
+        raise NotImplementedError
+
+    async def host_name(self, ip):
+        """
+        Reverse DNS name of a host that answered, '' when there is none
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            name, _, _ = await loop.run_in_executor(None, socket.gethostbyaddr, int_to_ip(ip))
+        except OSError:
+            return ''
+        return name
+
+
+class _RawTransport(Transport):
+    """
+    One socket shared by every probe; replies are matched to the waiting
+    probe by source address
+    """
+
+    def __init__(self):
+        self.sock = None
+        self.waiting = {}
+
+    async def open(self):
+        self.sock = self.make_socket()
+        # Replies arrive in bursts of up to max_in_flight.
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._readable)
+
+    def close(self):
+        if self.sock is not None:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    def _readable(self):
+        while True:
+            try:
+                packet = self.sock.recv(2048)
+            except OSError:
+                return
+            reply = self.parse(packet)
+            if reply is not None:
+                waiter = self.waiting.get(reply[0])
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(reply[1])
+
+    async def probe(self, ip):
+        waiter = self.waiting[ip] = asyncio.get_running_loop().create_future()
+        try:
+            self.send(ip)
+            return await waiter
+        finally:
+            if self.waiting.get(ip) is waiter:
+                del self.waiting[ip]
+
+
+class ArpTransport(_RawTransport):
+    """
+    ARP who-has broadcast on the interface the block is attached to
+    """
+    name = 'arp'
+
+    def __init__(self, interface):
+        super().__init__()
+        self.interface = interface
+        self.mac, self.ip = interface_addresses(interface)
+        self.frame_head = _ETHER.pack(_BROADCAST, self.mac.to_bytes(6, 'big'), ETH_P_ARP)
+
+    def make_socket(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+        sock.bind((self.interface, ETH_P_ARP))
+        return sock
+
+    def send(self, ip):
+        self.sock.send(self.frame_head + _ARP.pack(1, ETH_P_IP, 6, 4, ARP_REQUEST,
+                                                   self.mac.to_bytes(6, 'big'), self.ip,
+                                                   bytes(6), ip))
+
+    def parse(self, frame):
+        if len(frame) < _ETHER.size + _ARP.size:
+            return None
+        htype, ptype, hlen, plen, op, sha, spa, _, tpa = _ARP.unpack_from(frame, _ETHER.size)
+        if op != ARP_REPLY or ptype != ETH_P_IP or tpa != self.ip:
+            return None
+        return spa, int.from_bytes(sha, 'big')
+
+
+class IcmpTransport(_RawTransport):
+    """
+    ICMP echo request/reply over a raw IPv4 socket
+    """
+    name = 'icmp'
+
+    def __init__(self):
+        super().__init__()
+        self.ident = os.getpid() & 0xffff
+        self.sequence = 0
+
+    def make_socket(self):
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+
+    def send(self, ip):
+        self.sequence = (self.sequence + 1) & 0xffff
+        payload = b'netmgmt-sweep'
+        header = _ICMP.pack(ICMP_ECHO_REQUEST, 0, 0, self.ident, self.sequence)
+        checksum = _checksum(header + payload)
+        packet = _ICMP.pack(ICMP_ECHO_REQUEST, 0, checksum, self.ident, self.sequence) + payload
+        self.sock.sendto(packet, (int_to_ip(ip), 0))
+
+    def parse(self, packet):
+        # Raw IPv4 sockets deliver the IP header too.
+        offset = (packet[0] & 0x0f) * 4 if packet else 0
+        if len(packet) < offset + _ICMP.size:
+            return None
+        kind, _, _, ident, _ = _ICMP.unpack_from(packet, offset)
+        if kind != ICMP_ECHO_REPLY or ident != self.ident:
+            return None
+        return struct.unpack_from('!I', packet, 12)[0], 0
+
+
+class TcpTransport(Transport):
+    """
+    TCP connect to each of ports at once; any answer, even a refusal,
+    shows the host is there
+    """
+    name = 'tcp'
+
+    def __init__(self, ports=TCP_PORTS):
+        self.ports = tuple(ports)
+        self.sockets_per_probe = len(self.ports)
+
+    async def _connect(self, address, port):
+        try:
+            _, writer = await asyncio.open_connection(address, port)
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            return False
+        writer.close()
+        return True
+
+    async def probe(self, ip):
+        address = int_to_ip(ip)
+        pending = {asyncio.ensure_future(self._connect(address, port)) for port in self.ports}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(task.result() for task in done):
+                    return 0
+            # Every port failed outright (unreachable); wait for the timeout.
+            await asyncio.sleep(3600)
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+class FakeTransport(Transport):
+    """
+    In-memory network for tests: hosts maps integer IP to (mac, name, rtt
+    seconds).  Edit hosts between sweeps to bring hosts up or down.
+    """
+    name = 'fake'
+
+    def __init__(self, hosts=None):
+        self.hosts = dict(hosts or {})
+        self.probes = 0
+
+    async def probe(self, ip):
+        self.probes += 1
+        host = self.hosts.get(ip)
+        if host is None:
+            await asyncio.sleep(3600)
+        mac, name, rtt = host
+        await asyncio.sleep(rtt)
+        return mac
+
+    async def host_name(self, ip):
+        host = self.hosts.get(ip)
+        return host[1] if host else ''
+
+
+def open_transport(kind, cidr):
+    """
+    Transport for 'auto', 'arp', 'icmp' or 'tcp' sweeping cidr
+    Raises ValueError for an unknown kind or an arp sweep of a routed block
+    """
+    if kind == 'auto':
+        if not can_use_raw_sockets():
+            return TcpTransport()
+        kind = 'arp' if attached_interface(cidr) else 'icmp'
+    if kind == 'arp':
+        interface = attached_interface(cidr)
+        if interface is None:
+            raise ValueError(f"{cidr} is not on a directly attached interface")
+        return ArpTransport(interface)
+    if kind == 'icmp':
+        return IcmpTransport()
+    if kind == 'tcp':
+        return TcpTransport()
+    raise ValueError(f"unknown transport {kind}")
+
+
+def _open_file_limit():
+    try:
+        import resource
+        return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, OSError):
+        return 1024
+
+
+class SweepScanner:
+    """
+    Sweeps one CIDR block and reports changes as fing log lines
+
+    A host that stops answering is reported down only after down_after
+    sweeps in a row, so one lost probe does not flap it.
+    """
+
+    def __init__(self, cidr, transport, limiter=None, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 down_after=DEFAULT_DOWN_AFTER, names=True):
+        if '/' not in cidr:
+            cidr += '/24'
+        self.cidr = cidr
+        first, last = cidr_range(cidr)
+        if last - first >= 2:
+            # Skip the network and broadcast addresses.
+            first, last = first + 1, last - 1
+        self.first = first
+        self.last = last
+        self.transport = transport
+        self.limiter = limiter if limiter is not None else ProbeLimiter(
+            DEFAULT_SWEEP_RATE, DEFAULT_SWEEP_SUBNET_RATE)
+        self.timeout = timeout
+        self.retries = retries
+        if transport.sockets_per_probe:
+            max_in_flight = min(max_in_flight,
+                                max(1, (_open_file_limit() - 64) // transport.sockets_per_probe))
+        self.max_in_flight = max_in_flight
+        self.down_after = down_after
+        self.names = names
+
+        # ip -> [mac, name, missed sweeps] for hosts currently reported up
+        self.up = {}
+        self.sweeps = 0
+        self.probes = 0
+        self.last_duration = 0.0
+
+    async def _probe(self, ip, slots):
+        async with slots:
+            wait = self.limiter.reserve(int_to_ip(ip))
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.probes += 1
+            try:
+                return ip, await asyncio.wait_for(self.transport.probe(ip), self.timeout)
+            except (asyncio.TimeoutError, OSError):
+                return ip, None
+
+    async def _host_name(self, ip, slots):
+        async with slots:
+            return await self.transport.host_name(ip)
+
+    async def sweep(self):
+        """
+        Probe every address once (retrying silent ones)
+        Returns {ip: mac} for the hosts that answered
+        """
+        started = time.monotonic()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        found = {}
+        targets = range(self.first, self.last + 1)
+        for _ in range(1 + self.retries):
+            results = await asyncio.gather(*(self._probe(ip, slots) for ip in targets))
+            found.update((ip, mac) for ip, mac in results if mac is not None)
+            targets = [ip for ip, mac in results if mac is None]
+            if not targets:
+                break
+
+        if any(not mac for mac in found.values()):
+            neighbours = read_neighbours()
+            for ip, mac in found.items():
+                if not mac:
+                    found[ip] = neighbours.get(ip, 0)
+
+        self.sweeps += 1
+        self.last_duration = time.monotonic() - started
+        return found
+
+    async def changes(self, found):
+        """
+        Fold one sweep's result into the hosts known to be up
+        Returns the fing lines for hosts that came up, changed MAC or went down
+        """
+        now = time.time()
+        names = {}
+        if self.names:
+            # Look up every new host's name at once rather than one by one.
+            new = [ip for ip in found if ip not in self.up]
+            slots = asyncio.Semaphore(DEFAULT_MAX_LOOKUPS)
+            names = dict(zip(new, await asyncio.gather(*(self._host_name(ip, slots) for ip in new))))
+
+        lines = []
+        for ip, mac in sorted(found.items()):
+            known = self.up.get(ip)
+            if known is not None:
+                known[2] = 0
+                if not mac or mac == known[0]:
+                    continue
+                known[0] = mac
+            else:
+                known = self.up[ip] = [mac, names.get(ip, ''), 0]
+            lines.append(fing_line('up', ip, known[0], known[1], timestamp=now))
+
+        for ip in sorted(set(self.up) - set(found)):
+            known = self.up[ip]
+            known[2] += 1
+            if known[2] >= self.down_after:
+                del self.up[ip]
+                lines.append(fing_line('down', ip, known[0], known[1], timestamp=now))
+        return lines
+
+    async def run(self, emit, interval=DEFAULT_INTERVAL, stop=None):
+        """
+        Sweep every interval seconds, passing each change line to emit(),
+        until the threading.Event stop is set
+        """
+        await self.transport.open()
+        try:
+            while stop is None or not stop.is_set():
+                started = time.monotonic()
+                for line in await self.changes(await self.sweep()):
+                    emit(line)
+                deadline = started + interval
+                while (stop is None or not stop.is_set()) and time.monotonic() < deadline:
+                    await asyncio.sleep(min(1.0, deadline - time.monotonic()))
+        finally:
+            self.transport.close()
+
+
+class SweepThread:
+    """
+    A SweepScanner on its own event loop thread, stopped with terminate()
+    like the fing process it stands in for
+    """
+
+    def __init__(self, scanner, emit, interval=DEFAULT_INTERVAL):
+        self.scanner = scanner
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(emit, interval),
+                                       name=f"sweep-{scanner.cidr}", daemon=True)
+        self.thread.start()
+
+    def _run(self, emit, interval):
+        try:
+            asyncio.run(self.scanner.run(emit, interval, self.stopped))
+        except (OSError, ValueError) as e:
+            print(f"Sweep of {self.scanner.cidr} failed: {e}")
+
+    def terminate(self):
+        self.stopped.set()
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def get_positional_args(value_options):
+    """
+    Return the command line arguments that are neither options nor the
+    value following one of value_options
+    """
+    args = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg in value_options:
+            skip = True
+        elif not arg.startswith('--'):
+            args.append(arg)
+    return args
+
+
+def main():
+    args = get_positional_args(('--transport', '--timeout', '--rate', '--repeat'))
+    if '--help' in sys.argv or not args:
+        print("Usage:")
+        print("  python3 sweep_scanner.py <cidr>                     # Sweep once, print the hosts that are up")
+        print("  python3 sweep_scanner.py <cidr> --transport tcp     # auto (default), arp, icmp or tcp")
+        print("  python3 sweep_scanner.py <cidr> --timeout 0.5       # Seconds to wait for an answer (default 1)")
+        print("  python3 sweep_scanner.py <cidr> --rate 1000         # Probes per second (default 1000, 256 per /24)")
+        print("  python3 sweep_scanner.py <cidr> --repeat 60         # Keep sweeping, print changes like fing")
+        print("  python3 sweep_scanner.py <cidr> --no-names          # Skip reverse DNS lookups")
+        return 0 if '--help' in sys.argv else 2
+
+    cidr = args[0]
+    try:
+        timeout = float(get_option_value('--timeout') or DEFAULT_TIMEOUT)
+        repeat = get_option_value('--repeat')
+        repeat = float(repeat) if repeat is not None else None
+        rate = get_option_value('--rate')
+        limiter = None
+        if rate is not None:
+            rate = float(rate)
+            limiter = ProbeLimiter(rate, min(rate, DEFAULT_SWEEP_SUBNET_RATE * rate / DEFAULT_SWEEP_RATE))
+        transport = open_transport(get_option_value('--transport') or 'auto', cidr)
+        scanner = SweepScanner(cidr, transport, limiter, timeout=timeout, names='--no-names' not in sys.argv)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 2
+    except OSError as e:
+        print(f"Error opening {get_option_value('--transport') or 'auto'} transport: {e}")
+        return 1
+
+    if repeat is not None:
+        try:
+            asyncio.run(scanner.run(lambda line: print(line, end='', flush=True), repeat))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    async def once():
+        await transport.open()
+        try:
+            return await scanner.changes(await scanner.sweep())
+        finally:
+            transport.close()
+
+    try:
+        lines = asyncio.run(once())
+    except OSError as e:
+        print(f"Sweep failed: {e}")
+        return 1
+    for line in lines:
+        print(line, end='')
+    count = scanner.last - scanner.first + 1
+    print(f"Swept {count} addresses of {scanner.cidr} in {scanner.last_duration:.2f}s "
+          f"({transport.name}, {scanner.probes} probes): {len(lines)} up")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
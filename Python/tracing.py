@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+"""
+Timing spans for finding where a run spends its time.
+
+    with tracing.tracer.span('read_arp'):
+        ... a stage ...
+
+Stages, database queries, subprocesses and probes are wrapped in spans.
+While the tracer is disabled (the default) span() returns one shared
+do-nothing context manager, so the instrumentation costs a method call and
+an attribute test.  Once enabled, every finished span is kept in memory
+with its start, duration, self time (duration less that of the spans
+nested in it, on the same thread) and thread, and at the end of the run
+can be written as
+
+    <file>.json     Chrome trace format (chrome://tracing, Perfetto)
+    anything else   JSON lines, one span per line
+
+and summarised as the hotspots with the most self time.
+
+    python3 tracing.py <trace file> [--top N]
+
+prints the hotspots of a trace written earlier.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+
+DEFAULT_TOP = 15
+
+_SQL_VERB = re.compile(r'\s*(\w+)')
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+`?(\w+)', re.IGNORECASE)
+
+
+def query_name(sql):
+    """
+    Short span name for a batch of SQL: "db <verb> <table>" of its first statement
+    """
+    verb = _SQL_VERB.match(sql)
+    table = _SQL_TABLE.search(sql)
+    return ' '.join(['db', verb.group(1).upper() if verb else '?'] + ([table.group(1)] if table else []))
+
+
+class _NoSpan:
+    """
+    What span() returns while tracing is off
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'attrs', 'start', 'children')
+
+    def __init__(self, tracer, name, category, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.children = 0
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        stack = self.tracer._stack()
+        stack.pop()
+        duration = end - self.start
+        if stack:
+            stack[-1].children += duration
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer._finish(self, duration, len(stack))
+        return False
+
+    def set(self, **attrs):
+        """
+        Add attributes to the span while it is open
+        """
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    """
+    Collects spans from every thread of the process
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = 0
+        self.started = 0.0
+
+    def enable(self):
+        self.spans = []
+        self.origin = time.perf_counter_ns()
+        self.started = time.time()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, category='stage', **attrs):
+        if not self.enabled:
+            return _NO_SPAN
+        return Span(self, name, category, attrs)
+
+    def _stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _finish(self, span, duration, depth):
+        thread = threading.current_thread()
+        record = (span.name, span.category, span.start - self.origin, duration, duration - span.children,
+                  depth, thread.ident, thread.name, span.attrs)
+        with self.lock:
+            self.spans.append(record)
+
+    def records(self):
+        """
+        Finished spans as dicts, in start order; times in seconds from enable()
+        """
+        with self.lock:
+            spans = sorted(self.spans, key=lambda record: record[2])
+        return [{'name': name, 'cat': category, 'start': start / 1e9, 'dur': duration / 1e9,
+                 'self': own / 1e9, 'depth': depth, 'thread': thread_name, 'tid': tid, 'attrs': attrs}
+                for name, category, start, duration, own, depth, tid, thread_name, attrs in spans]
+
+    def write(self, path, metadata=None):
+        """
+        Write the spans to path: Chrome trace format for a .json file,
+        JSON lines otherwise
+        """
+        import json
+
+        records = self.records()
+        metadata = dict(metadata or {}, started=self.started, pid=os.getpid())
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                tids = {}
+                events = []
+                for record in records:
+                    tid = tids.setdefault(record['tid'], len(tids) + 1)
+                    events.append({'name': record['name'], 'cat': record['cat'], 'ph': 'X', 'pid': 1, 'tid': tid,
+                                   'ts': round(record['start'] * 1e6, 3), 'dur': round(record['dur'] * 1e6, 3),
+                                   'args': record['attrs']})
+                names = {record['tid']: record['thread'] for record in records}
+                for ident, tid in tids.items():
+                    events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                                   'args': {'name': names[ident]}})
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': metadata}, f, default=str)
+            else:
+                f.write(json.dumps({'trace': metadata}, default=str) + '\n')
+                for record in records:
+                    del record['tid']
+                    f.write(json.dumps(record, default=str) + '\n')
+
+
+def hotspots(records, top=DEFAULT_TOP):
+    """
+    Span names with the most self time: [(name, category, count, total, self, max)]
+    """
+    totals = {}
+    for record in records:
+        entry = totals.setdefault(record['name'], [record['cat'], 0, 0.0, 0.0, 0.0])
+        entry[1] += 1
+        entry[2] += record['dur']
+        entry[3] += record['self']
+        entry[4] = max(entry[4], record['dur'])
+    ranked = sorted(totals.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [(name, category, count, total, own, longest) for name, (category, count, total, own, longest) in ranked]
+
+
+def print_hotspots(records, top=DEFAULT_TOP):
+    wall = max((record['start'] + record['dur'] for record in records), default=0.0)
+    print(f"Hotspots by self time ({len(records)} spans over {wall:.3f}s; threads overlap, so totals can exceed it)")
+    print(f"  {'Span':<32} {'Kind':<10} {'Calls':>6} {'Self':>10} {'Total':>10} {'Max':>9}")
+    for name, category, count, total, own, longest in hotspots(records, top):
+        print(f"  {name[:32]:<32} {category:<10} {count:>6} {own * 1000:>8.1f}ms {total * 1000:>8.1f}ms "
+              f"{longest * 1000:>7.1f}ms")
+
+
+def read_trace(path):
+    """
+    Span records from a trace file written by Tracer.write
+    """
+    import json
+
+    with open(path) as f:
+        if path.endswith('.json'):
+            events = json.load(f).get('traceEvents', [])
+            spans = [event for event in events if event.get('ph') == 'X']
+            # Chrome traces carry no self time; work it out from nesting per thread.
+            records = []
+            for tid in {event['tid'] for event in spans}:
+                open_spans = []
+                for event in sorted((e for e in spans if e['tid'] == tid), key=lambda e: (e['ts'], -e['dur'])):
+                    start, duration = event['ts'] / 1e6, event['dur'] / 1e6
+                    while open_spans and open_spans[-1]['start'] + open_spans[-1]['dur'] <= start:
+                        open_spans.pop()
+                    if open_spans:
+                        open_spans[-1]['self'] -= duration
+                    record = {'name': event['name'], 'cat': event.get('cat', ''), 'start': start, 'dur': duration,
+                              'self': duration, 'attrs': event.get('args', {})}
+                    records.append(record)
+                    open_spans.append(record)
+            return records
+        return [record for record in map(json.loads, f) if 'name' in record]
+
+
+# Shared by every module in the process.
+tracer = Tracer()
+
+
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
+
+def get_positional_args(value_options):
+    """
+    Return the command line arguments that are neither options nor the
+    value following one of value_options
+    """
+    args = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg in value_options:
+            skip = True
+        elif not arg.startswith('--'):
+            args.append(arg)
+    return args
+
+
+def main():
+    args = get_positional_args(('--top',))
+    if '--help' in sys.argv or not args:
+        print("Usage:")
+        print("  python3 tracing.py <trace file>            # Hotspots of a trace written with --trace")
+        print("  python3 tracing.py <trace file> --top 30   # Show more of them (default 15)")
+        return 0 if '--help' in sys.argv else 2
+
+    try:
+        top = int(get_option_value('--top') or DEFAULT_TOP)
+        records = read_trace(args[0])
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 2
+    except OSError as e:
+        print(f"Error reading {args[0]}: {e}")
+        return 1
+    print_hotspots(records, top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,53 @@
 #!/usr/bin/env python3
 
+import os
 import subprocess
 import sys
 import re
+import shlex
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from host_table import DeviceTable, HostRecord, ip_to_int, mac_to_int
+from device_identity import find_conflicts
+from probe_limiter import limiter
+from rtt_stats import tracker
+from arp_retention import archive_rows, prune_change_log
+from network_db import db, DatabaseError, change_log_sql
+from state_history import StateHistory, CAUSE_NEW, CAUSE_STATE
+from tracing import tracer, print_hotspots
+
+# Batches archive_rows() may do per run when called with --retain-days; a
+# larger backlog is worked off over several runs.
+RETENTION_BATCHES_PER_RUN = 4
+
+# Where ping round-trip times are kept between runs.
+DEFAULT_RTT_FILE = os.path.expanduser('~/.network_info_rtt')
+
+# Where state transitions and their rollups are logged.
+DEFAULT_HISTORY_DB = os.path.expanduser('~/.network_info_history.db')
+
+# Commands that list the ARP cache and ping a host (the count, timeout and
+# address are appended); --arp-command and --ping-command replace them,
+# e.g. with the Python/netsim stand-ins.
+ARP_COMMAND = ['arp', '-a']
+PING_COMMAND = ['ping']
 
 def get_current_arp_entries():
     """
     Get current ARP entries from the system
-    Returns a list of tuples (ip_address, hw_address)
+    Returns a DeviceTable keyed by MAC
     """
     try:
         # Get ARP table entries
-        result = subprocess.run(['arp', '-a'], capture_output=True, text=True)
+        with tracer.span('arp command', 'subprocess'):
+            result = subprocess.run(ARP_COMMAND, capture_output=True, text=True)
         
         if result.returncode != 0:
             print(f"Error getting ARP entries: {result.stderr}")
-            return []
+            return DeviceTable()
         
-        arp_entries = []
+        arp_entries = DeviceTable()
         lines = result.stdout.strip().split('\n')
         
         for line in lines:
@@ -28,92 +57,109 @@ def get_current_arp_entries():
                 mac_match = re.search(r'at ([0-9a-fA-F:]{17})', line)
                 
                 if ip_match and mac_match:
-                    ip_addr = ip_match.group(1)
-                    hw_addr = mac_match.group(1).lower()  # Normalize to lowercase
-                    arp_entries.append((ip_addr, hw_addr))
+                    ip_addr = ip_to_int(ip_match.group(1))
+                    hw_addr = mac_to_int(mac_match.group(1))
+                    arp_entries.add(HostRecord(ip_addr, hw_addr))
         
         return arp_entries
     
     except Exception as e:
         print(f"Error parsing ARP entries: {e}")
-        return []
+        return DeviceTable()
 
 def get_existing_entries():
     """
     Get existing entries from the database
-    Returns a dict with (ip_address, hw_address) as key and (id, state) as value
+    Returns a DeviceTable keyed by MAC whose records carry row_id and state
+    (where older databases hold several rows for one MAC, the newest is used)
     """
     try:
-        cmd = [
-            'mysql',
-            '-u', 'andrewh',
-            '-pletmein',
-            '-e', 'USE network_info; SELECT id, ip_address, hw_address, state FROM arp_table;'
-        ]
+        try:
+            rows = db.run('SELECT id, ip_address, hw_address, state FROM arp_table ORDER BY id;')
+        except DatabaseError as e:
+            print(f"Error reading existing entries: {e}")
+            return DeviceTable()
         
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        existing_entries = DeviceTable()
         
-        if result.returncode != 0:
-            print(f"Error reading existing entries: {result.stderr}")
-            return {}
-        
-        existing_entries = {}
-        lines = result.stdout.strip().split('\n')
-        
-        # Skip header line if present
-        for line in lines[1:] if len(lines) > 1 else []:
-            if line.strip():
-                columns = line.split('\t')
-                if len(columns) >= 4:
-                    entry_id = columns[0].strip()
-                    ip_addr = columns[1].strip()
-                    hw_addr = columns[2].strip().lower()
-                    state = columns[3].strip()
-                    existing_entries[(ip_addr, hw_addr)] = (entry_id, state)
+        for columns in rows:
+            if len(columns) >= 4:
+                entry_id = int(columns[0])
+                ip_addr = ip_to_int(columns[1].strip())
+                hw_addr = mac_to_int(columns[2].strip())
+                state = columns[3].strip()
+                existing_entries.add(HostRecord(ip_addr, hw_addr, state, row_id=entry_id))
         
         return existing_entries
     
     except Exception as e:
         print(f"Error getting existing entries: {e}")
-        return {}
+        return DeviceTable()
+
+def ping_rtt(ip_address, timeout=2):
+    """
+    Ping a host once and record the result in its RTT history
+    Returns the round-trip time in seconds, or None if there was no reply
+    """
+    rtt = None
+    try:
+        # Use ping command with timeout; the probe span's self time is the
+        # wait for the rate limiter
+        with tracer.span('probe', 'probe', ip=ip_address), limiter.probe(ip_address):
+            with tracer.span('ping command', 'subprocess'):
+                result = subprocess.run(
+                    PING_COMMAND + ['-c', '1', '-W', str(timeout), ip_address],
+                    capture_output=True,
+                    text=True
+                )
+        if result.returncode == 0:
+            match = re.search(r'time[=<]([\d.]+) ?ms', result.stdout)
+            rtt = float(match.group(1)) / 1000 if match else 0.0
+    except Exception:
+        rtt = None
+    
+    tracker.record(ip_to_int(ip_address), rtt)
+    return rtt
 
 def ping_host(ip_address, timeout=2):
     """
     Ping a host to check if it's reachable
     Returns True if host responds, False otherwise
     """
-    try:
-        # Use ping command with timeout
-        result = subprocess.run(
-            ['ping', '-c', '1', '-W', str(timeout), ip_address],
-            capture_output=True,
-            text=True
-        )
-        return result.returncode == 0
-    except Exception:
-        return False
+    return ping_rtt(ip_address, timeout) is not None
 
 def determine_state(ip_address, check_connectivity=True):
     """
     Determine the state of a host based on connectivity
-    Returns 'UP' if reachable, 'DOWN' if not, 'UNKNOWN' if check is disabled
+    Returns 'UP' if reachable, 'DEGRADED' if reachable but its recent latency
+    or loss is over threshold, 'DOWN' if not, 'UNKNOWN' if check is disabled
     """
     if not check_connectivity:
         return 'UNKNOWN'
     
-    if ping_host(ip_address):
-        return 'UP'
-    else:
+    if not ping_host(ip_address):
         return 'DOWN'
+    elif tracker.degraded(ip_to_int(ip_address)):
+        return 'DEGRADED'
+    else:
+        return 'UP'
+
+def determine_states(ip_addresses, check_connectivity=True):
+    """
+    Determine the state of many hosts concurrently
+    Probe rate and concurrency are bounded by the shared probe limiter
+    Returns a dict of ip_address -> state
+    """
+    if not check_connectivity or not ip_addresses:
+        return {ip: 'UNKNOWN' for ip in ip_addresses}
+    
+    with ThreadPoolExecutor(max_workers=limiter.max_in_flight) as executor:
+        states = executor.map(determine_state, ip_addresses)
+        return dict(zip(ip_addresses, states))
 
-def insert_new_entries(new_entries, check_connectivity=True):
+def insert_new_entries(new_entries, check_connectivity=True, history=None):
     """
-    Insert new ARP entries into the database with state determination
+    Insert new ARP entries (HostRecord objects) into the database with state determination
     """
     if not new_entries:
         print("No new entries to insert")
@@ -123,54 +169,130 @@ def insert_new_entries(new_entries, check_connectivity=True):
         print(f"Inserting {len(new_entries)} new entries...")
         insert_statements = []
         
-        for ip_addr, hw_addr in new_entries:
-            # Determine state by pinging
-            state = determine_state(ip_addr, check_connectivity)
+        # Determine states by pinging
+        states = determine_states([record.ip_address for record in new_entries], check_connectivity)
+        
+        for record in new_entries:
+            ip_addr = record.ip_address
+            hw_addr = record.hw_address
+            state = states[ip_addr]
+            record.state = state
             print(f"  {ip_addr} -> {hw_addr} (State: {state})")
             
-            insert_statements.append(
-                f"INSERT INTO arp_table (ip_address, hw_address, state) VALUES ('{ip_addr}', '{hw_addr}', '{state}');"
-            )
+            insert_statements.append(address_history_sql(record))
+            if record.name:
+                insert_statements.append(
+                    f"INSERT INTO arp_table (ip_address, ip_int, hw_address, state, hostname) VALUES ('{ip_addr}', {record.ip}, '{hw_addr}', '{state}', '{record.name}');"
+                )
+            else:
+                insert_statements.append(
+                    f"INSERT INTO arp_table (ip_address, ip_int, hw_address, state) VALUES ('{ip_addr}', {record.ip}, '{hw_addr}', '{state}');"
+                )
+            insert_statements.append(change_log_sql("id = LAST_INSERT_ID()"))
         
         # Combine all insert statements
-        sql_commands = "USE network_info; " + " ".join(insert_statements)
+        try:
+            db.run(" ".join(insert_statements))
+        except DatabaseError as e:
+            print(f"Error inserting entries: {e}")
+            return
         
-        cmd = [
-            'mysql',
-            '-u', 'andrewh',
-            '-pletmein',
-            '-e', sql_commands
-        ]
+        print(f"Successfully inserted {len(new_entries)} new entries")
+        if history is not None:
+            now = time.time()
+            for record in new_entries:
+                history.record(now, record.ip, record.mac, None, record.state, CAUSE_NEW)
+    
+    except Exception as e:
+        print(f"Error inserting new entries: {e}")
+
+def address_history_sql(record):
+    """
+    SQL recording that record's device uses its current address
+    """
+    return (f"INSERT INTO address_history (hw_address, ip_address, ip_int) "
+            f"VALUES ('{record.hw_address}', '{record.ip_address}', {record.ip}) "
+            f"ON DUPLICATE KEY UPDATE last_seen = CURRENT_TIMESTAMP;")
+
+def apply_address_changes(existing_entries, current_entries):
+    """
+    Follow devices whose IP address changed since the last run, so a DHCP
+    reassignment updates the device's row instead of adding another
+    Both arguments are DeviceTables; moved records in existing_entries are
+    updated in place
+    """
+    try:
+        for ip_records in find_conflicts(current_entries).values():
+            macs = ", ".join(record.hw_address for record in ip_records)
+            print(f"Warning: IP conflict, {ip_records[0].ip_address} is claimed by {macs}")
         
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        move_statements = []
+        for record in current_entries:
+            known = existing_entries.get(record.ip, record.mac)
+            if known is None or known.ip == record.ip:
+                continue
+            
+            print(f"  {known.hw_address} moved: {known.ip_address} -> {record.ip_address}")
+            move_statements.append(address_history_sql(known))
+            move_statements.append(
+                f"UPDATE arp_table SET ip_address = '{record.ip_address}', ip_int = {record.ip} WHERE id = {known.row_id};"
+            )
+            move_statements.append(change_log_sql(f"id = {known.row_id}"))
+            existing_entries.move(known, record.ip)
+            move_statements.append(address_history_sql(known))
         
-        if result.returncode == 0:
-            print(f"Successfully inserted {len(new_entries)} new entries")
-        else:
-            print(f"Error inserting entries: {result.stderr}")
+        if not move_statements:
+            return
+        
+        try:
+            db.run(" ".join(move_statements))
+            print(f"Successfully recorded {len(move_statements) // 4} address changes")
+        except DatabaseError as e:
+            print(f"Error recording address changes: {e}")
     
     except Exception as e:
-        print(f"Error inserting new entries: {e}")
+        print(f"Error applying address changes: {e}")
 
-def update_existing_states(existing_entries, current_arp_set, check_connectivity=True):
+def mark_seen(existing_entries, current_entries):
+    """
+    Set last_seen on the rows of devices present in the ARP table, so
+    arp_retention.py can tell long-gone devices from current ones
+    """
+    try:
+        present = (existing_entries.get(record.ip, record.mac) for record in current_entries)
+        ids = sorted({str(record.row_id) for record in present if record is not None})
+        if not ids:
+            return
+        
+        db.run(f"UPDATE arp_table SET last_seen = CURRENT_TIMESTAMP WHERE id IN ({', '.join(ids)});")
+    
+    except Exception as e:
+        print(f"Error marking entries seen: {e}")
+
+def update_existing_states(existing_entries, current_entries, check_connectivity=True, history=None):
     """
     Update states of existing entries based on current ARP presence and connectivity
+    Both arguments are DeviceTables keyed by MAC
     """
     try:
         updates = []
+        current_keys = current_entries.keys()
         
-        for (ip_addr, hw_addr), (entry_id, current_state) in existing_entries.items():
+        # Ping everything still in the ARP table in one concurrent sweep
+        present = {record.ip_address for record in existing_entries
+                   if existing_entries.key(record.ip, record.mac) in current_keys}
+        if check_connectivity:
+            states = determine_states(sorted(present), True)
+        
+        for record in existing_entries:
+            ip_addr = record.ip_address
+            current_state = record.state
             new_state = None
             
-            if (ip_addr, hw_addr) in current_arp_set:
+            if existing_entries.key(record.ip, record.mac) in current_keys:
                 # Entry is in current ARP table
                 if check_connectivity:
-                    new_state = determine_state(ip_addr, True)
+                    new_state = states[ip_addr]
                 else:
                     new_state = 'UP'  # Present in ARP = UP
             else:
@@ -179,7 +301,8 @@ def update_existing_states(existing_entries, current_arp_set, check_connectivity
             
             # Only update if state has changed
             if new_state != current_state:
-                updates.append((entry_id, ip_addr, hw_addr, current_state, new_state))
+                updates.append((record.row_id, ip_addr, record.hw_address, current_state, new_state))
+                record.state = new_state
         
         if updates:
             print(f"\nUpdating states for {len(updates)} existing entries...")
@@ -190,35 +313,29 @@ def update_existing_states(existing_entries, current_arp_set, check_connectivity
                 update_statements.append(
                     f"UPDATE arp_table SET state = '{new_state}' WHERE id = {entry_id};"
                 )
+                update_statements.append(change_log_sql(f"id = {entry_id}"))
             
             # Execute updates
-            sql_commands = "USE network_info; " + " ".join(update_statements)
-            
-            cmd = [
-                'mysql',
-                '-u', 'andrewh',
-                '-pletmein',
-                '-e', sql_commands
-            ]
+            try:
+                db.run(" ".join(update_statements))
+            except DatabaseError as e:
+                print(f"Error updating entries: {e}")
+                return
             
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            if result.returncode == 0:
-                print(f"Successfully updated {len(updates)} entries")
-            else:
-                print(f"Error updating entries: {result.stderr}")
+            print(f"Successfully updated {len(updates)} entries")
+            if history is not None:
+                now = time.time()
+                for entry_id, ip_addr, hw_addr, old_state, new_state in updates:
+                    history.record(now, ip_to_int(ip_addr), mac_to_int(hw_addr), old_state, new_state,
+                                   CAUSE_STATE)
         else:
             print("\nNo state updates needed for existing entries")
     
     except Exception as e:
         print(f"Error updating existing states: {e}")
 
-def update_network_database(check_connectivity=True, verbose=True):
+def update_network_database(check_connectivity=True, verbose=True, retain_days=None, rtt_file=DEFAULT_RTT_FILE,
+                            history_db=DEFAULT_HISTORY_DB):
     """
     Main function to update the network_info database with current ARP entries and states
     """
@@ -230,7 +347,8 @@ def update_network_database(check_connectivity=True, verbose=True):
     # Get current ARP entries from system
     if verbose:
         print("Getting current ARP entries from system...")
-    current_entries = get_current_arp_entries()
+    with tracer.span('read arp'):
+        current_entries = get_current_arp_entries()
     print(f"Found {len(current_entries)} current ARP entries")
     
     if not current_entries:
@@ -240,81 +358,130 @@ def update_network_database(check_connectivity=True, verbose=True):
     # Display current entries
     if verbose:
         print("\nCurrent ARP entries:")
-        for ip, mac in current_entries:
-            print(f"  {ip} -> {mac}")
+        for record in current_entries:
+            print(f"  {record.ip_address} -> {record.hw_address}")
     
     # Get existing entries from database
     print("\nGetting existing entries from database...")
-    existing_entries = get_existing_entries()
+    with tracer.span('read db'):
+        existing_entries = get_existing_entries()
     print(f"Found {len(existing_entries)} existing database entries")
     
+    # Follow devices that changed address
+    with tracer.span('address changes'):
+        apply_address_changes(existing_entries, current_entries)
+    
+    with tracer.span('open history'):
+        history = StateHistory(history_db) if history_db else None
+    
+    # Round-trip times from earlier runs, to judge latency and loss
+    if check_connectivity and rtt_file:
+        with tracer.span('load rtt'):
+            tracker.load(rtt_file)
+    
     # Find new entries
-    current_set = set(current_entries)
-    existing_set = set(existing_entries.keys())
-    new_entries = current_set - existing_set
+    with tracer.span('diff'):
+        new_entries = current_entries.new_records(existing_entries)
     
     # Insert new entries
     if new_entries:
         print(f"\nFound {len(new_entries)} new entries to add:")
-        insert_new_entries(list(new_entries), check_connectivity)
+        with tracer.span('insert new', entries=len(new_entries)):
+            insert_new_entries(new_entries, check_connectivity, history)
     else:
         print("\nNo new entries found.")
     
     # Update existing entry states
     if existing_entries:
-        update_existing_states(existing_entries, current_set, check_connectivity)
+        with tracer.span('mark seen'):
+            mark_seen(existing_entries, current_entries)
+        with tracer.span('update states', entries=len(existing_entries)):
+            update_existing_states(existing_entries, current_entries, check_connectivity, history)
+    
+    if check_connectivity and rtt_file:
+        try:
+            with tracer.span('save rtt'):
+                tracker.save(rtt_file)
+        except OSError as e:
+            print(f"Error saving RTT history: {e}")
+        
+        if verbose:
+            for record in existing_entries:
+                if record.state == 'DEGRADED':
+                    stats = tracker.stats(record.ip)
+                    print(f"  {record.ip_address} degraded: p50 {stats['p50'] * 1000:.1f} ms, "
+                          f"p95 {(stats['p95'] or 0) * 1000:.1f} ms, loss {stats['loss']:.0%}")
+    
+    if history is not None:
+        history.close()
+    
+    # Archive a few batches of long-gone devices
+    if retain_days is not None:
+        print(f"\nArchiving entries not seen for {retain_days:g} days...")
+        with tracer.span('archive'):
+            archived = archive_rows(retain_days, max_batches=RETENTION_BATCHES_PER_RUN)
+        print(f"Archived {archived} entries")
+    
+    # The change log is only kept until followers have read it
+    with tracer.span('prune changes'):
+        prune_change_log()
     
     print("\nUpdate complete!")
     
     # Show final summary
     print("\n" + "=" * 50)
     print("Final Database Summary:")
-    show_summary()
+    with tracer.span('summary'):
+        show_summary()
 
 def show_summary():
     """
     Show summary statistics of the arp_table
     """
     try:
-        cmd = [
-            'mysql',
-            '-u', 'andrewh',
-            '-pletmein',
-            '-e', 'USE network_info; SELECT state, COUNT(*) as count FROM arp_table GROUP BY state ORDER BY state;'
-        ]
-        
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        rows = db.run('SELECT state, COUNT(*) as count FROM arp_table GROUP BY state ORDER BY state;')
         
-        if result.returncode == 0:
-            lines = result.stdout.strip().split('\n')
-            if len(lines) > 1:
-                total = 0
-                for line in lines[1:]:
-                    if line.strip():
-                        columns = line.split('\t')
-                        if len(columns) >= 2:
-                            state = columns[0].strip()
-                            count = int(columns[1].strip())
-                            total += count
-                            print(f"  {state}: {count} entries")
-                print(f"  Total: {total} entries")
-            else:
-                print("  No data available")
+        if rows:
+            total = 0
+            for columns in rows:
+                if len(columns) >= 2:
+                    state = columns[0].strip()
+                    count = int(columns[1].strip())
+                    total += count
+                    print(f"  {state}: {count} entries")
+            print(f"  Total: {total} entries")
+        else:
+            print("  No data available")
         
     except Exception as e:
         print(f"Error getting summary: {e}")
 
+def get_option_value(option):
+    """
+    Return the value following option on the command line, or None
+    """
+    if option in sys.argv:
+        index = sys.argv.index(option)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return None
+
 def main():
     """
     Main function with command line options
     """
+    global ARP_COMMAND, PING_COMMAND
     check_connectivity = True
     verbose = True
+    retain_days = None
+    rtt_file = DEFAULT_RTT_FILE
+    history_db = DEFAULT_HISTORY_DB
+    
+    try:
+        db.configure_from_argv(sys.argv)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     
     # Parse command line arguments
     if len(sys.argv) > 1:
@@ -322,11 +489,68 @@ def main():
             check_connectivity = False
         if '--quiet' in sys.argv:
             verbose = False
+        if '--rate' in sys.argv or '--subnet-rate' in sys.argv or '--max-in-flight' in sys.argv:
+            try:
+                limiter.configure(
+                    rate=float(get_option_value('--rate') or limiter.rate),
+                    subnet_rate=float(get_option_value('--subnet-rate') or limiter.subnet_rate),
+                    max_in_flight=int(get_option_value('--max-in-flight') or limiter.max_in_flight)
+                )
+            except ValueError:
+                print("Error: --rate and --subnet-rate take numbers of 0 or more, "
+                      "--max-in-flight a whole number of 1 or more")
+                sys.exit(1)
+        if '--retain-days' in sys.argv:
+            try:
+                retain_days = float(get_option_value('--retain-days'))
+            except (TypeError, ValueError):
+                print("Error: --retain-days takes a numeric value")
+                sys.exit(1)
+        if '--degraded-latency' in sys.argv or '--degraded-loss' in sys.argv:
+            try:
+                latency = get_option_value('--degraded-latency')
+                loss = get_option_value('--degraded-loss')
+                tracker.configure(
+                    latency_threshold=float(latency) / 1000 if latency else None,
+                    loss_threshold=float(loss) / 100 if loss else None
+                )
+            except ValueError:
+                print("Error: --degraded-latency and --degraded-loss take numeric values")
+                sys.exit(1)
+        if '--rtt-file' in sys.argv:
+            rtt_file = get_option_value('--rtt-file')
+        if '--history-db' in sys.argv:
+            history_db = get_option_value('--history-db')
+        if '--arp-command' in sys.argv:
+            ARP_COMMAND = shlex.split(get_option_value('--arp-command') or '')
+        if '--ping-command' in sys.argv:
+            PING_COMMAND = shlex.split(get_option_value('--ping-command') or '')
+        if not ARP_COMMAND or not PING_COMMAND:
+            print("Error: --arp-command and --ping-command take a command line")
+            sys.exit(1)
         if '--help' in sys.argv:
             print("Usage:")
             print("  python3 update_network_info.py              # Update with connectivity check")
             print("  python3 update_network_info.py --no-ping    # Update without pinging hosts")
             print("  python3 update_network_info.py --quiet      # Less verbose output")
+            print("  python3 update_network_info.py --rate 200 --subnet-rate 50 --max-in-flight 128")
+            print("                                              # Probe rate limits (defaults 100/s, 20/s per /24, 64)")
+            print("  python3 update_network_info.py --retain-days 30")
+            print("                                              # Also archive entries not seen for 30 days")
+            print("  python3 update_network_info.py --degraded-latency 200 --degraded-loss 20")
+            print("                                              # Mark hosts DEGRADED over 200 ms p95 or 20% loss (defaults)")
+            print("  python3 update_network_info.py --rtt-file /var/lib/network_info/rtt")
+            print("                                              # Where RTT history is kept (default ~/.network_info_rtt)")
+            print("  python3 update_network_info.py --history-db /var/lib/network_info/history.db")
+            print("                                              # Where state transitions are logged (default ~/.network_info_history.db)")
+            print("  python3 update_network_info.py --db sqlite:///var/lib/network_info/network_info.db")
+            print("                                              # Use an embedded SQLite database instead of MySQL")
+            print("  python3 update_network_info.py --arp-command 'python3 netsim arp sim.txt' --ping-command 'python3 netsim ping sim.txt'")
+            print("                                              # Read the ARP cache and ping with other commands (default arp -a, ping)")
+            print("  python3 update_network_info.py --trace /var/log/network_info/")
+            print("                                              # Write a timing trace of the run (a .json file is Chrome")
+            print("                                              # trace format, other files JSON lines, a directory gets one per run)")
+            print("  python3 update_network_info.py --profile    # Print the stages and calls that took longest")
             print("  python3 update_network_info.py --help       # Show this help")
             print("")
             print("This script:")
@@ -334,9 +558,31 @@ def main():
             print("  - Adds new entries to the database")
             print("  - Updates states of existing entries")
             print("  - Uses ping to determine UP/DOWN states (unless --no-ping)")
+            print("  - Marks hosts whose recent latency or loss is over threshold DEGRADED")
             return
     
-    update_network_database(check_connectivity, verbose)
+    trace_path = get_option_value('--trace') if '--trace' in sys.argv else None
+    if '--trace' in sys.argv and not trace_path:
+        print("Error: --trace takes a file or directory")
+        sys.exit(1)
+    profile = '--profile' in sys.argv
+    if trace_path or profile:
+        tracer.enable()
+    
+    with tracer.span('update', 'run'):
+        update_network_database(check_connectivity, verbose, retain_days, rtt_file, history_db)
+    
+    if trace_path:
+        if os.path.isdir(trace_path):
+            trace_path = os.path.join(trace_path, time.strftime('update-%Y%m%d-%H%M%S.json'))
+        try:
+            tracer.write(trace_path, {'argv': sys.argv})
+            print(f"\nTrace written to {trace_path}")
+        except OSError as e:
+            print(f"Error writing trace: {e}")
+    if profile:
+        print()
+        print_hotspots(tracer.records())
 
 if __name__ == "__main__":
     main()
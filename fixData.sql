@@ -11,3 +11,7 @@ update node set notify='NO' where name like 'Galaxy%.lan';
 update node set notify='NO' where name like 'Annes-iPhone.lan';
 update node set notify='NO' where name like 'Andrews-MBP.lan';
 update node set notify='NO' where name like 'iPad.lan';
+
+-- Monit answers 401 without credentials, which still proves it is running.
+insert into node_check (ip_address, kind, port, expect) values ('192.168.10.221', 'http', 2812, '401');
+insert into node_check (ip_address, kind, port, expect) values ('192.168.10.221', 'banner', 22, '^SSH-2.0');
@@ -1,34 +1,122 @@
 #!/usr/bin/env python3.7
 
 import subprocess
+import re
 import sqlite3
 import sys
 import threading
 import time
-import datetime
 import queue
 import signal
 import os
 import socket
+import shlex
 from ping3 import ping
 import getopt
 
-import paho.mqtt.client as mqtt
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Python"))
+
+from host_table import HostEvent, HostRecord, DeviceTable, CAUSE_NEW, CAUSE_STATE, CAUSE_MOVED, CAUSE_CONFLICT, \
+    ip_to_int, int_to_ip, mac_to_int, int_to_mac
+from device_identity import IdentityResolver, CONFLICT, MOVED, NEW
+from observations import Observation, ObservationBatcher, ObservationMerger, OBSERVATION_TOPIC, decode_batch
+from scan_leases import ScanLeaseCoordinator, split_address_space
+from check_profiles import load_profiles, run_profile, STATE_DEGRADED
+from probe_limiter import limiter
+from rtt_stats import tracker
+from state_snapshot import load_snapshot, write_snapshot
+from notify_outbox import Outbox, pack_event
+from event_buffer import CoalescingBuffer
+from notify_sinks import NotificationFanOut, sink_from_url
+from node_policy import PolicyFile
+from state_history import StateHistory
 
 conn = None
 cursor = None
 
+# In memory copy of the node table, one record per device keyed by MAC,
+# and the resolver that follows devices between addresses.
+hosts = DeviceTable()
+resolver = None
 
-workQueue=queue.Queue(10)
+# Service check profiles from node_check, keyed by integer IP.
+profiles = {}
+
+# Notify/check rules applied to newly discovered nodes.
+policy = None
+
+# Log of every state transition, with hourly/daily up-time rollups.
+history = None
+
+# Notifications waiting for delivery, and the sinks they are delivered to.
+outbox = None
+fanOut = None
+
+def merge_events(old, new):
+    # A host that has not been announced yet stays NEW, with its latest state.
+    if old.cause == CAUSE_NEW:
+        new.cause = CAUSE_NEW
+    return new
+
+# Events from the ingest path, coalesced per host until written to the outbox.
+eventBuffer = CoalescingBuffer(10000, merge=merge_events)
+
+# Output lines from every running fing process (or built-in sweep).
+fingLines = queue.Queue()
+
+# Transport for the built-in sweep scanner, None to run fing.
+sweepTransport = None
+
+# The fing command (subnet and output options are appended), and the
+# command used for verification pings instead of ping3 (None for ping3).
+fingCommand = ["fing"]
+pingCommand = None
 
 exitFlag = False
-queueLock = threading.Lock()
 
 connected = False
 verbose =  True
 
+mqttBroker = "192.168.10.124"
+mqttPort = 1883
+
+# Warm start snapshot of hosts, written every snapshotInterval seconds.
+snapshotPath = None
+snapshotInterval = 30
+
+# Copy of hosts served over HTTP by -H, kept current as observations are
+# processed; None when not serving.
+stateCache = None
+queryService = None
+
 def usage():
     print("Usage: monitor.py -h | -d <path to db> -v -s <subnet address>")
+    print("       monitor.py -s <subnet address> -a <broker>   # agent: publish observations, no db")
+    print("       monitor.py -d <path to db> -A <broker>       # aggregator: merge agent observations")
+    print("       monitor.py -d <path to db> -L <lease db> -s <cidr>[,<cidr>...]  # share the scan with other workers")
+    print("       -r <probes/sec>  global probe rate limit (default 100, 20 per /24)")
+    print("       -F <command>  run this instead of fing, e.g. \"python3 Python/netsim fing sim.txt\"")
+    print("       -P <command>  verify with this ping command instead of ping3")
+    print("       -w <transport>  sweep with the built-in scanner instead of fing: auto, arp, icmp or tcp")
+    print("       -S <snapshot file>  warm start from, and periodically save, the in-memory node state")
+    print("       -H [<address>:]<port>  serve the node state and its change feed over HTTP (query_service.py), e.g. -H 8088")
+    print("       -o <outbox dir>  where undelivered notifications are kept (default <path to db>outbox)")
+    print("       -p <policy file>  notify/check rules for new nodes (default <path to db>policy.rules)")
+    print("       -n <sink url>  notify mqtt://host[:port][/prefix], http(s)://..., syslog://host[:port] or")
+    print("                      file:///path.jsonl; repeat for several sinks (default mqtt://" + mqttBroker + ")")
+
+def ping_once(ip, timeout):
+    # One verification ping: the round trip in seconds, None (or ping3's
+    # False) without a reply.
+    if pingCommand is None:
+        return ping(ip, timeout=timeout)
+
+    result = subprocess.run(pingCommand + ["-c", "1", "-W", str(timeout), ip],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    if result.returncode != 0:
+        return None
+    match = re.search(r'time[=<]([\d.]+) ?ms', result.stdout)
+    return float(match.group(1)) / 1000 if match else None
 
 def checkNode(ip,port):
 
@@ -36,12 +124,31 @@ def checkNode(ip,port):
     if verbose:
         print("CHECKING",ip,port)
 
+    specs = profiles.get(ip_to_int(ip))
+    if specs:
+        state, results = run_profile(ip, specs)
+
+        if verbose:
+            for spec, ok in results:
+                print("  ", spec, "ok" if ok else "FAILED")
+
+        if state == "down":
+            # No service answered; if the host itself still responds it is
+            # degraded rather than down.
+            with limiter.probe(ip):
+                res = ping_once(ip, 2)
+            tracker.record(ip_to_int(ip), res or None)
+            if res != None:
+                state = STATE_DEGRADED
+
+        return state
+
     state = "down"
 
     fail=True
 
     if port != 0:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        with limiter.probe(ip), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             try:
                 s.connect((ip, port))
                 state = "up"
@@ -52,14 +159,23 @@ def checkNode(ip,port):
                 fail = True
 
     if fail:
-        res = ping(ip,timeout=1)
-        res = ping(ip,timeout=2)
+        with limiter.probe(ip):
+            res = ping_once(ip, 1)
+        tracker.record(ip_to_int(ip), res or None)
+        with limiter.probe(ip):
+            res = ping_once(ip, 2)
+        tracker.record(ip_to_int(ip), res or None)
 
         if res == None:
             state = 'down'
         else:
             state = 'up'
 
+    if state == 'up' and tracker.degraded(ip_to_int(ip)):
+        state = STATE_DEGRADED
+        if verbose:
+            print("  DEGRADED", tracker.stats(ip_to_int(ip)))
+
     return state
 
 def handler(signum, frame):
@@ -75,108 +191,277 @@ def on_connect(client, userdata, flags, rc):
     if verbose:
         print("MQTT Connected")
 
-def process_data(threadName, q):
-    global exitFlag
-    global verbose
-    mqttBroker = "192.168.10.124"
-    mqttPort = 1883
+def outbox_writer():
+    # Move events from the in-memory buffer to the outbox, so that even disk
+    # stalls never reach the fing reader.
+    while not exitFlag or len(eventBuffer):
+        for event in eventBuffer.take(100, timeout=1):
+            if verbose:
+                print("Notify", event.cause, event.ip_address, event.state)
+            outbox.append(pack_event(event))
 
-    count=1
+def start_notifier(outboxDir, sinkUrls):
+    # Events are appended to the on-disk outbox by the ingest path and
+    # drained to each sink by a dispatcher thread with its own cursor, so a
+    # broker outage never stalls scanning and an event stays on disk until
+    # every sink has it.
+    global outbox
+    global fanOut
 
-    while not exitFlag:
+    if not sinkUrls:
+        sinkUrls = ["mqtt://%s:%d" % (mqttBroker, mqttPort)]
 
-        queueLock.acquire()
-        if not workQueue.empty():
-#            print("Process In")
-            data = q.get()
+    if verbose:
+        print("Notifying", ", ".join(sinkUrls))
+    fanOut = NotificationFanOut([sink_from_url(url) for url in sinkUrls])
+
+    outbox = Outbox(outboxDir, readers=fanOut.readers)
+    fanOut.start(outbox)
+
+    writer = threading.Thread(target=outbox_writer, name="outbox-writer")
+    writer.start()
+    return writer
+
+def upgrade_db():
+    # Older node.db files predate the integer IP column; add and populate it.
+
+    columns = [res[1] for res in cursor.execute('pragma table_info(node);')]
+
+    if 'ip_int' not in columns:
+        if verbose:
+            print("Adding ip_int column to node")
+        cursor.execute('alter table node add column ip_int integer;')
+        rows = cursor.execute('select ip_address from node;').fetchall()
+        cursor.executemany('update node set ip_int = ? where ip_address = ?;',
+                           [(ip_to_int(res[0]), res[0]) for res in rows])
+
+    # setup.sql used to name this column check_port while the code and
+    # fixData.sql use checkport.
+    if 'checkport' not in columns:
+        cursor.execute('alter table node add column checkport integer default 0;')
+
+    sql = cursor.execute("select sql from sqlite_master where type = 'table' and name = 'node';").fetchone()[0]
+    if re.search(r'ip_address[^,]*\bunique\b', sql, re.IGNORECASE):
+        migrate_node_identity(sql)
+
+    cursor.execute('create index if not exists node_ip_int on node (ip_int);')
+    cursor.execute('create index if not exists node_ip on node (ip_address);')
+    cursor.execute('create index if not exists node_mac on node (mac_address);')
+    cursor.execute('create table if not exists address_history (mac_address varchar(32) NOT NULL, '
+                   'ip_address varchar(32) NOT NULL, ip_int integer, first_seen integer, last_seen integer, '
+                   'PRIMARY KEY (mac_address, ip_address));')
+    cursor.execute('create index if not exists address_history_ip_int on address_history (ip_int);')
+    cursor.execute('create table if not exists node_check (ip_address varchar(32) NOT NULL, kind varchar(8) NOT NULL, '
+                   'port integer NOT NULL, path varchar(128), expect varchar(128), timeout real);')
+    cursor.execute('create index if not exists node_check_ip on node_check (ip_address);')
+    conn.commit()
+
+def migrate_node_identity(sql):
+    # node used to be keyed on ip_address UNIQUE, so a DHCP reassignment
+    # overwrote one device's row with another's.  Devices are now identified
+    # by MAC: normalise mac_address, keep the newest row per MAC (older ones
+    # go to address_history) and rebuild the table without the constraint.
+    if verbose:
+        print("Migrating node to MAC identity")
+
+    cursor.execute('create table if not exists address_history (mac_address varchar(32) NOT NULL, '
+                   'ip_address varchar(32) NOT NULL, ip_int integer, first_seen integer, last_seen integer, '
+                   'PRIMARY KEY (mac_address, ip_address));')
+
+    latest = {}
+    rows = cursor.execute('select rowid, mac_address, ip_address, ip_int, event_time from node '
+                          'order by event_time, rowid;').fetchall()
+    for rowid, mac_address, ip_address, ip_int, event_time in rows:
+        mac = mac_to_int(mac_address)
+        if not mac:
+            continue
+        cursor.execute('update node set mac_address = ? where rowid = ?;', (int_to_mac(mac), rowid))
+        cursor.execute('insert or ignore into address_history values (?, ?, ?, ?, ?);',
+                       (int_to_mac(mac), ip_address, ip_int, event_time or 0, event_time or 0))
+        if mac in latest:
+            cursor.execute('delete from node where rowid = ?;', (latest[mac],))
+        latest[mac] = rowid
+
+    sql = re.sub(r'(ip_address[^,]*?)\s+unique\b', r'\1', sql, count=1, flags=re.IGNORECASE)
+    sql = re.sub(r'^\s*create\s+table\s+("?node"?)', 'CREATE TABLE node_new', sql, count=1, flags=re.IGNORECASE)
+    cursor.execute('drop table if exists node_new;')
+    cursor.execute(sql)
+    cursor.execute('insert into node_new select * from node;')
+    cursor.execute('drop table node;')
+    cursor.execute('alter table node_new rename to node;')
+
+def record_address(record, ticks):
+    # Note in address_history that the device uses its current address.
+    if not record.mac or not record.ip:
+        return
+    key = (int_to_mac(record.mac), record.ip_address)
+    cursor.execute('insert or ignore into address_history values (?, ?, ?, ?, ?);',
+                   key + (record.ip, int(ticks), int(ticks)))
+    cursor.execute('update address_history set last_seen = ? where mac_address = ? and ip_address = ?;',
+                   (int(ticks),) + key)
+
+def load_nodes():
+    global hosts
+
+    sqlCmd = 'select ip_address,mac_address,state,name,maker,notify,checkport,event_time from node;'
+
+    for res in cursor.execute( sqlCmd ):
+        hosts.add(HostRecord(ip_to_int(res[0]) if res[0] else 0, mac_to_int(res[1]), res[2], name=res[3] or '',
+                             maker=res[4] or '', notify=(res[5] == "YES"), check_port=res[6] or 0,
+                             event_time=res[7] or 0))
 
-            queueLock.release()
-#            print ("%s processing %s" % (threadName, data))
+    if verbose:
+        print("Loaded", len(hosts), "nodes")
 
-            stuff = data.split(':')
-#            print(stuff)
+def restore_snapshot(dbMtime):
+    # Warm start.  Returns False (cold start from the db) if the snapshot is
+    # missing, corrupt, or older than the last write to the database.
+    global hosts
 
-            cause      = stuff[0]
-            ip_address = stuff[1]
-            name       = stuff[2]
-            state      = stuff[3]
+    try:
+        table, marker, written = load_snapshot(snapshotPath)
+    except ValueError as err:
+        print("Cold start:", err)
+        return False
 
-            mqttClient = mqtt.Client()
-            mqttClient.on_connect = on_connect
+    if dbMtime > written:
+        print("Cold start: database changed since the snapshot was written")
+        return False
 
-            if verbose:
-                print("MQTT connecting ...")
-            mqttClient.connect(mqttBroker, mqttPort, 60)
+    res = cursor.execute('select count(*), max(event_time) from node;').fetchone()
+    if (res[0], res[1] or 0) != marker:
+        print("Cold start: snapshot does not match the database")
+        return False
 
-            while not connected:
-                if verbose:
-                    print("Waiting ....")
-                time.sleep(0.1)
-                mqttClient.loop()
+    hosts = table
+    if verbose:
+        print("Warm start,", len(hosts), "nodes from", snapshotPath)
+    return True
 
-            if verbose:
-                print("MQTT connected ")
+def save_snapshot():
+    count = write_snapshot(snapshotPath, hosts)
+    if verbose:
+        print("Snapshot of", count, "nodes written")
 
-            topic = "/test/monitor/"
+def snapshot_writer():
+    while not exitFlag:
+        time.sleep(snapshotInterval)
+        try:
+            save_snapshot()
+        except OSError as err:
+            print("Snapshot failed:", err)
 
-            if name == "":
-                topic += ip_address
-            else:
-                tmp = name.split('.')
-                topic += tmp[0]
 
-            topic += "/"
+def share_state(record, oldIp=None):
+    # Pass a device's current state on to the query service.
+    if stateCache is not None:
+        stateCache.put_record('monitor', record, oldIp)
 
-            # TODO command line flag to make payload JSON
+def start_query_service(listen):
+    # Imported here so that monitors that do not serve skip http.server.
+    global stateCache
+    global queryService
+    from state_cache import StateCache
+    from query_service import QueryService
 
-            if verbose:
-                print( "Cause:" + topic + 'cause:' + cause )
-                print( "State:" + topic + 'state:' + state )
+    stateCache = StateCache()
+    stateCache.replace('monitor', hosts)
+    queryService = QueryService(stateCache, listen).start()
+    print("Serving node state on http://%s:%d/" % queryService.server_address[:2])
 
-            mqttClient.publish(topic + 'event_time',payload='{0:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now()))
-            mqttClient.publish(topic + 'cause',payload=cause)
-            mqttClient.publish(topic + 'state',payload=state)
+def start_fing(subNet):
+    # Start fing on a subnet ("a.b.c.d" scans the /24, or an explicit CIDR)
+    # with a reader thread feeding its output lines into fingLines.
 
-            if verbose:
-                print("MQTT disconnecting")
-            mqttClient.disconnect()
-        else:
-            queueLock.release()
-            time.sleep(1)
+    if '/' not in subNet:
+        subNet += "/24"
 
+    cmdList = fingCommand + ["--silent", subNet, "-o", "log,csv"]
 
-class myThread (threading.Thread):
-    def __init__(self, threadID, name, q):
-      threading.Thread.__init__(self)
-      self.threadID = threadID
-      self.name = name
-      self.q = q
-    def run(self):
-      global verbose
-      if verbose:
-        print ("Thread Starting " + self.name)
-      process_data(self.name, self.q)
+    if verbose:
+        print("Starting", " ".join(cmdList))
 
-      if verbose:
-        print ("Thread exiting " + self.name)
+    tst = subprocess.Popen(cmdList, universal_newlines=True,stdout=subprocess.PIPE)
 
+    def reader():
+        for output in tst.stdout:
+            fingLines.put(output)
 
-def main(subNet):
+    threading.Thread(target=reader, daemon=True).start()
+    return tst
 
-    global verbose
-    print("Verbose",verbose)
-    global exitFlag
-    signal.signal(signal.SIGINT, handler)
+def start_sweep(subNet):
+    # Sweep a subnet with the built-in scanner on its own event loop thread,
+    # feeding fing style lines into fingLines.  Imported here so that fing
+    # users do not load asyncio.
+    # A transport that cannot be used for this block (arp on a routed block,
+    # no raw socket privilege) falls back to tcp; a block that cannot be
+    # swept at all is reported and skipped (returns None).
+    from sweep_scanner import SweepScanner, SweepThread, TcpTransport, open_transport
+
+    if '/' not in subNet:
+        subNet += "/24"
 
-    thread = myThread(1,"TEST", workQueue)
-    thread.start()
+    try:
+        transport = open_transport(sweepTransport, subNet)
+    except (ValueError, OSError) as err:
+        print("Cannot", sweepTransport, "sweep", subNet + ":", err, "- using tcp")
+        transport = TcpTransport()
 
-    cmd= "fing --silent " + subNet + "/24 -o log,csv"
-    cmdList = cmd.split(" ")
+    try:
+        scanner = SweepScanner(subNet, transport)
+    except ValueError as err:
+        print("Not sweeping", subNet + ":", err)
+        return None
+
+    if verbose:
+        print("Starting", transport.name, "sweep of", subNet)
+
+    return SweepThread(scanner, fingLines.put)
+
+def start_scanner(subNet):
+    if sweepTransport is not None:
+        return start_sweep(subNet)
+    return start_fing(subNet)
+
+def fing_observations(subNet, leaseDb=None):
+    # Run fing (or the built-in sweep) over the subnet and turn each csv log
+    # line into an Observation.
+    # With a lease db, subNet is a comma separated list of CIDR blocks shared
+    # with other workers and only the currently leased shards are scanned.
+
+    scanners = {}
+    coordinator = None
+    nextRenew = 0
+
+    if leaseDb is None:
+        scanner = start_scanner(subNet)
+        if scanner is not None:
+            scanners[subNet] = scanner
+    else:
+        coordinator = ScanLeaseCoordinator(leaseDb, split_address_space(subNet.split(',')))
+        if verbose:
+            print("Lease worker", coordinator.worker_id)
 
-    tst = subprocess.Popen(cmdList, universal_newlines=True,stdout=subprocess.PIPE)
     while not exitFlag:
-        output = tst.stdout.readline()
+        if coordinator is not None and time.time() >= nextRenew:
+            leased = set(coordinator.renew())
+            for shard in leased - set(scanners):
+                # A shard that cannot be scanned is tried again at the next renewal.
+                scanner = start_scanner(shard)
+                if scanner is not None:
+                    scanners[shard] = scanner
+            for shard in set(scanners) - leased:
+                if verbose:
+                    print("Lease lost", shard)
+                scanners.pop(shard).terminate()
+            nextRenew = time.time() + coordinator.ttl / 3
+
+        try:
+            output = fingLines.get(timeout=1)
+        except queue.Empty:
+            continue
+
         fred = output.splitlines()
 
         for data in fred:
@@ -198,81 +483,287 @@ def main(subNet):
     #        print("mac_address:" + mac_address)
     #        print("maker      :" + maker)
 
-            sqlCmd = 'select count(*),state,notify,checkport from node where ip_address = "'+ ip_address + '";'
+            yield Observation(ip_to_int(ip_address), mac_to_int(mac_address), state, time.time(),
+                              name, maker, unknown, time_stamp=time_stamp)
+
+    for tst in scanners.values():
+        tst.terminate()
+    if coordinator is not None:
+        coordinator.release()
+
+def process_observation(obs):
+    # Compare an observation with the node table, update the db and queue notifications.
+
+    ip = obs.ip
+    ip_address = obs.ip_address
+    name = obs.name
+    state = obs.state
+    time_stamp = obs.text_time_stamp()
+
+    ticks = obs.timestamp
+
+    resolution = resolver.resolve(ip, obs.mac, ticks)
+    node = resolution.record
+
+    if resolution.outcome == CONFLICT:
+        # Another live device already answers on this address; leave both
+        # rows alone and report it.
+        if not resolution.repeat:
+            holder = resolution.holder
+            print("IP conflict on", ip_address, ":", holder.hw_address, "and", int_to_mac(obs.mac))
+            eventBuffer.put((CAUSE_CONFLICT, ip), HostEvent(CAUSE_CONFLICT, ip, name, state, ticks))
+        return
+
+    displaced = resolution.displaced
+    if displaced is not None and displaced.mac:
+        # The lease was reassigned; the old holder keeps its row, without an address.
+        if verbose:
+            print("Address", ip_address, "reassigned from", displaced.hw_address)
+        cursor.execute("update node set ip_address = '', ip_int = NULL where mac_address = ?;",
+                       (displaced.hw_address,))
+        share_state(displaced)
+    elif displaced is not None:
+        cursor.execute("delete from node where ip_address = ?;", (ip_address,))
+        if stateCache is not None:
+            stateCache.remove('monitor', ip, 0)
+
+    if resolution.learned:
+        cursor.execute("update node set mac_address = ? where ip_address = ?;", (node.hw_address, ip_address))
+        conn.commit()
+        share_state(node, oldIp=ip)
+
+    if resolution.outcome == MOVED:
+        oldAddress = int_to_ip(resolution.old_ip) if resolution.old_ip else "(none)"
+        if verbose:
+            print("Moved", node.hw_address, oldAddress, "->", ip_address)
+        cursor.execute("update node set ip_address = ?, ip_int = ? where mac_address = ?;",
+                       (ip_address, ip, node.hw_address))
+        cursor.execute("update address_history set last_seen = max(last_seen, ?) where mac_address = ? and ip_address = ?;",
+                       (node.last_seen, node.hw_address, oldAddress))
+        record_address(node, ticks)
+        conn.commit()
+        history.record(ticks, ip, node.mac, node.state, node.state, CAUSE_MOVED)
+        share_state(node)
+        if node.notify:
+            eventBuffer.put((CAUSE_MOVED, node.mac), HostEvent(CAUSE_MOVED, ip, node.name, node.state, ticks))
+
+    if resolution.outcome == NEW:
+        if verbose:
+            print("No match, insert and alert")
+
+        settings = policy.match(ip, obs.mac, name, obs.maker) if policy is not None else {}
+        notify = settings.get('notify', 'YES')
+        checkPort = settings.get('checkport', 0)
+        if verbose and settings:
+            print("Policy", settings)
+
+        sqlCmd = 'insert into node '
+        sqlCmd += '(time_stamp,state,ip_address,unknown,name,mac_address,maker,event_time,ip_int,notify,checkport) '
+        sqlCmd += "values('" + time_stamp + "','" + state + "','"  + ip_address 
+        sqlCmd += "','" + obs.info + "','" + name + "','"  + int_to_mac(obs.mac)
+        sqlCmd += "','" + obs.maker + "'," + str(int(ticks)) + "," + str(ip)
+        sqlCmd += ",'" + notify + "'," + str(checkPort) + ");"
+
+        if verbose:
+            print(sqlCmd)
+
+        cursor.execute(sqlCmd)
+        conn.commit()
+
+        node = hosts.add(HostRecord(ip, obs.mac, state, name=name, maker=obs.maker,
+                                    notify=(notify == "YES"), check_port=checkPort,
+                                    last_seen=int(ticks), event_time=int(ticks)))
+        record_address(node, ticks)
+        conn.commit()
+        history.record(ticks, ip, obs.mac, None, state, CAUSE_NEW)
+        share_state(node)
+
+        eventBuffer.put(ip, HostEvent(CAUSE_NEW, ip, name, state, ticks))
+    else:
+        node.last_seen = int(ticks)
+
+        if verbose:
+            print("Match, check state")
+
+            print("oldState      ", node.state)
+            print("new State     ", state)
+
+        if node.state == state:
+            if verbose:
+                print("No Change in state")
+        else:
+            if not obs.verified:
+                state = checkNode(ip_address,node.check_port)
 
-        #    print(sqlCmd)
+            if verbose:
+                print("Checked State ", state)
 
-            for res in cursor.execute( sqlCmd ):
-                resultCount=res[0]
-                resultState=res[1]
-                resultNotify=res[2]
-                checkport = res[3]
+            if node.state != state:
 
-                ticks = time.time()
+                if verbose:
+                    print("State change, alert and update db")
 
-                if resultCount == 0:
-                    if verbose:
-                        print("No match, insert and alert")
-                    sqlCmd = 'insert into node '
-                    sqlCmd += '(time_stamp,state,ip_address,unknown,name,mac_address,maker,event_time) '
-                    sqlCmd += "values('" + time_stamp + "','" + state + "','"  + ip_address 
-                    sqlCmd += "','" + unknown + "','" + name + "','"  + mac_address
-                    sqlCmd += "','" + maker + "'," + str(int(ticks)) + ");"
 
-                    if verbose:
-                        print(sqlCmd)
+                sqlCmd = "update node set state = '" + state + "',time_stamp='" + time_stamp + "',event_time =" + str(int(ticks)) + " where ip_address='" + ip_address + "';"
 
-                    cursor.execute(sqlCmd)
-                    conn.commit()
+                if verbose:
+                    print(sqlCmd)
+                cursor.execute(sqlCmd)
+                conn.commit()
+                history.record(ticks, ip, node.mac, node.state, state, CAUSE_STATE)
 
-                    dataOut = "NEW:" + ip_address + ":" + name +":" + state 
-                    workQueue.put(dataOut)
-                else:
-                    if verbose:
-                        print("Match, check state")
+                node.state = state
+                node.event_time = int(ticks)
 
-                        print("oldState      ", resultState)
-                        print("new State     ", state)
+#                print("NOTIFY")
+                if node.notify:
+                    event = HostEvent(CAUSE_STATE, ip, name, state, ticks)
+#                    print("... " + repr(event))
+                    eventBuffer.put(ip, event)
 
-                    if resultState == state:
-                        if verbose:
-                            print("No Change in state")
-                    else:
-                        # TODO If state is 'down' check by some other means (ping etc)
+        share_state(node)
 
-                        state = checkNode(ip_address,checkport)
+def run_agent(subNet, broker, leaseDb=None):
+    # Agent mode: scan and probe locally, publish observation batches, no db.
 
-                        if verbose:
-                            print("Checked State ", state)
+    import paho.mqtt.client as mqtt
 
-                        if resultState != state:
+    agentId = socket.gethostname()
+    topic = OBSERVATION_TOPIC + agentId
 
-                            if verbose:
-                                print("State change, alert and update db")
-    
+    mqttClient = mqtt.Client()
+    mqttClient.on_connect = on_connect
+    mqttClient.connect_async(broker, mqttPort, 60)
+    mqttClient.loop_start()
 
-                            sqlCmd = "update node set state = '" + state + "',time_stamp='" + time_stamp + "',event_time =" + str(int(ticks)) + " where ip_address='" + ip_address + "';"
+    def publish(payload):
+        mqttClient.publish(topic, payload=payload, qos=1)
 
-                            if verbose:
-                                print(sqlCmd)
-                            cursor.execute(sqlCmd)
-                            conn.commit()
-    
-#                            print("NOTIFY")
-                            if resultNotify == "YES":
-                                dataOut = "STATE:" + ip_address + ":" + name +":" + state 
-#                                print("... " + dataOut)
-                                workQueue.put(dataOut)
+    batcher = ObservationBatcher(agentId, publish)
+    batcher.start()
+
+    # Last state reported per host.  The aggregator may not be able to reach
+    # this subnet, so state changes are verified here before publishing.
+    lastState = {}
+
+    for obs in fing_observations(subNet, leaseDb):
+        previous = lastState.get(obs.ip)
+        if previous is not None and previous != obs.state:
+            obs.state = checkNode(obs.ip_address, 0)
+            obs.verified = True
+        lastState[obs.ip] = obs.state
+
+        if verbose:
+            print("Observed", obs)
+        batcher.add(obs)
+
+    batcher.stop()
+    mqttClient.loop_stop()
+    mqttClient.disconnect()
+
+def aggregator_observations(broker):
+    # Aggregator mode: merge observation batches published by agents.
+
+    inQueue = queue.Queue()
+    merger = ObservationMerger()
+
+    def on_message(client, userdata, message):
+        try:
+            agentId, sent, observations = decode_batch(message.payload)
+        except ValueError as err:
+            print("Bad observation batch on", message.topic, err)
+            return
+        if verbose:
+            print("Batch of", len(observations), "from", agentId)
+        for obs in observations:
+            inQueue.put(obs)
+
+    def on_subscribe_connect(client, userdata, flags, rc):
+        client.subscribe(OBSERVATION_TOPIC + "#", qos=1)
+
+    import paho.mqtt.client as mqtt
+
+    mqttClient = mqtt.Client()
+    mqttClient.on_connect = on_subscribe_connect
+    mqttClient.on_message = on_message
+    mqttClient.connect_async(broker, mqttPort, 60)
+    mqttClient.loop_start()
+
+    while not exitFlag:
+        try:
+            obs = inQueue.get(timeout=1)
+        except queue.Empty:
+            continue
+        if merger.accept(obs):
+            yield obs
+        elif verbose:
+            print("Stale observation dropped", obs)
+
+    mqttClient.loop_stop()
+    mqttClient.disconnect()
+
+def main(subNet, agentBroker=None, aggregatorBroker=None, leaseDb=None, outboxDir="./outbox", sinkUrls=None):
+
+    global verbose
+    print("Verbose",verbose)
+    global exitFlag
+    signal.signal(signal.SIGINT, handler)
+
+    if agentBroker is not None:
+        run_agent(subNet, agentBroker, leaseDb)
+        return
+
+    writer = start_notifier(outboxDir, sinkUrls)
+
+    if snapshotPath is not None:
+        threading.Thread(target=snapshot_writer, daemon=True).start()
+
+    if aggregatorBroker is not None:
+        source = aggregator_observations(aggregatorBroker)
+    else:
+        source = fing_observations(subNet, leaseDb)
+
+    for obs in source:
+        process_observation(obs)
+
+    if snapshotPath is not None:
+        save_snapshot()
+
+    if queryService is not None:
+        queryService.stop()
+        if verbose:
+            print("Query service", queryService.stats())
+
+    writer.join()
+    fanOut.stop(timeout=10)
+    outbox.close()
+
+    if verbose:
+        print("Event buffer", eventBuffer.stats())
+        for stats in fanOut.stats():
+            print("Sink", stats)
 
 def start():
     global verbose
     global conn
     global cursor 
+    global snapshotPath
+    global sweepTransport
+    global fingCommand
+    global pingCommand
 
     dbPath = "./"
+    subNet = None
+    agentBroker = None
+    aggregatorBroker = None
+    leaseDb = None
+    outboxDir = None
+    sinkUrls = []
+    policyPath = None
+    serveAddress = None
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "d:hs:v")
+        opts, args = getopt.getopt(sys.argv[1:], "a:A:d:F:hH:L:n:o:p:P:r:s:S:vw:")
     except getopt.GetoptError as err:
         print(err)  # will print something like "option -a not recognized"
         usage()
@@ -288,16 +779,91 @@ def start():
             subNet = a
         elif o == '-v':
             print("Verbose")
+        elif o == '-a':
+            agentBroker = a
+        elif o == '-A':
+            aggregatorBroker = a
+        elif o == '-L':
+            leaseDb = a
+        elif o == '-r':
+            try:
+                rate = float(a)
+                limiter.configure(rate=rate, subnet_rate=min(rate, limiter.subnet_rate))
+            except ValueError as err:
+                print("Bad probe rate", a + ":", err)
+                usage()
+                sys.exit(2)
+        elif o == '-S':
+            snapshotPath = a
+        elif o == '-o':
+            outboxDir = a
+        elif o == '-n':
+            sinkUrls.append(a)
+        elif o == '-p':
+            policyPath = a
+        elif o == '-w':
+            if a not in ('auto', 'arp', 'icmp', 'tcp'):
+                print("Unknown sweep transport", a)
+                usage()
+                sys.exit(2)
+            sweepTransport = a
+        elif o == '-F':
+            fingCommand = shlex.split(a)
+        elif o == '-P':
+            pingCommand = shlex.split(a)
+        elif o == '-H':
+            serveAddress = a
+
+    if agentBroker is not None:
+        if subNet is None:
+            usage()
+            sys.exit(2)
+        main( subNet, agentBroker=agentBroker, leaseDb=leaseDb )
+        return
 
 #    print(sys.argv[1])
     dbName = dbPath + 'node.db'
     print("Open db " + dbName)
 
 #    conn = sqlite3.connect('node.db')
+    dbMtime = os.path.getmtime(dbName) if os.path.exists(dbName) else 0
+
     conn = sqlite3.connect(dbName)
     cursor = conn.cursor()
 
-    main( subNet )
+    upgrade_db()
+
+    if snapshotPath is None or not restore_snapshot(dbMtime):
+        load_nodes()
+
+    global resolver
+    resolver = IdentityResolver(hosts)
+
+    global profiles
+    profiles = load_profiles(cursor)
+    if verbose:
+        print("Loaded check profiles for", len(profiles), "nodes")
+
+    global history
+    history = StateHistory(dbPath + 'history.db')
+
+    global policy
+    if policyPath is None:
+        policyPath = dbPath + 'policy.rules'
+    policy = PolicyFile(policyPath)
+
+    if outboxDir is None:
+        outboxDir = dbPath + 'outbox'
+
+    if serveAddress is not None:
+        try:
+            start_query_service(serveAddress)
+        except (OSError, ValueError) as err:
+            print("Cannot serve node state on", serveAddress, err)
+            sys.exit(1)
+
+    main( subNet, aggregatorBroker=aggregatorBroker, leaseDb=leaseDb, outboxDir=outboxDir, sinkUrls=sinkUrls )
 
-start()
+if __name__ == "__main__":
+    start()
 
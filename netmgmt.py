@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+One command for the network management tools.
+
+    netmgmt.py <subcommand> [options]
+
+Each subcommand runs an existing tool's main() with the remaining
+arguments.  Only the module for the chosen subcommand is imported, so a
+quick "netmgmt.py list" or a cron "netmgmt.py update" does not pay for
+loading paho-mqtt, ping3 or sqlite3 it will not use.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Python"))
+
+# name -> (module, function, arguments put in front of the user's, description)
+SUBCOMMANDS = {
+    'monitor':      ('monitor', 'start', [], "run the fing monitor (monitor.py)"),
+    'update':       ('update_network_info', 'main', [], "update arp_table from the ARP cache"),
+    'list':         ('set_hostname', 'main', ['--list'], "list devices [--cidr <block>]"),
+    'show':         ('display_arp_entries', 'main', [], "show arp_table [--state S] [--cidr <block>]"),
+    'summary':      ('display_arp_entries', 'main', ['--summary'], "device counts by state"),
+    'set-hostname': ('set_hostname', 'main', [], "<ip> [hostname]"),
+    'setup':        ('setup_database', 'main', [], "create the network_info database"),
+    'retention':    ('arp_retention', 'main', [], "archive devices not seen for a while"),
+    'discover':     ('pcap_discovery', 'main', [], "add hosts seen in pcap files or live traffic"),
+    'history':      ('state_history', 'main', [], "<history db> <ip or mac>: a host's transitions"),
+    'availability': ('availability_report', 'main', [], "<history db>: availability, MTTR, MTBF"),
+    'sweep':        ('sweep_scanner', 'main', [], "<cidr>: probe every address, list the hosts that answer"),
+    'serve':        ('query_service', 'main', [], "device queries and change feed over HTTP"),
+}
+
+
+def usage():
+    print("Usage: netmgmt.py <subcommand> [options]")
+    print()
+    for name, (module, function, prefix, description) in SUBCOMMANDS.items():
+        print(f"  {name:<14} {description}")
+    print()
+    print("netmgmt.py <subcommand> --help shows the options of each.")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help', 'help'):
+        usage()
+        return 0 if argv else 2
+
+    name = argv[0]
+    if name not in SUBCOMMANDS:
+        print(f"Unknown subcommand '{name}'")
+        usage()
+        return 2
+
+    module_name, function, prefix, description = SUBCOMMANDS[name]
+    # The tools read their options from sys.argv.  For --help the tool gets
+    # nothing else, so fixed options such as --list do not run it instead.
+    sys.argv = [f"netmgmt.py {name}"] + prefix + argv[1:]
+    if '--help' in argv[1:]:
+        sys.argv[1:] = ['-h'] if name == 'monitor' else ['--help']
+
+    module = __import__(module_name)
+    result = getattr(module, function)()
+    return result if isinstance(result, int) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
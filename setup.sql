@@ -1,16 +1,55 @@
 CREATE TABLE node (
     time_stamp varchar(32),
     state varchar(8),
-    ip_address varchar(32) NOT NULL UNIQUE,
+    -- Devices are identified by mac_address; ip_address is where the device
+    -- is now, '' if its address has since been given to another device.
+    ip_address varchar(32) NOT NULL,
     unknown varchar(32),
     name varchar(32),
     mac_address varchar(32),
     maker varchar(32),
     notify varchar(4) default "YES" NOT NULL,
     -- checkport: connect to this port to verify up, ignore if 0
-    check_port integer default 0,
+    checkport integer default 0,
     -- If tru connect via monit to verify.
     check_monit integer default false,
-    event_time integer
+    event_time integer,
+    -- ip_address as a 32 bit integer, for sorting and CIDR range scans
+    ip_int integer
 );
 
+CREATE INDEX node_ip_int ON node (ip_int);
+CREATE INDEX node_ip ON node (ip_address);
+CREATE INDEX node_mac ON node (mac_address);
+
+-- Every address each device has used.  last_seen of a device's current
+-- address is brought up to date when it moves.
+CREATE TABLE address_history (
+    mac_address varchar(32) NOT NULL,
+    ip_address varchar(32) NOT NULL,
+    ip_int integer,
+    first_seen integer,
+    last_seen integer,
+    PRIMARY KEY (mac_address, ip_address)
+);
+
+CREATE INDEX address_history_ip_int ON address_history (ip_int);
+
+
+-- Per-node service check profile, one row per check.  All checks of a node
+-- run concurrently when fing reports a state change; all passing is 'up',
+-- some passing is 'degraded', none passing is 'down'.
+--   kind    tcp | http | https | banner
+--   path    request path for http/https (default /)
+--   expect  http status (default 200), or a regex the banner must match
+--   timeout seconds for this check (default 2)
+CREATE TABLE node_check (
+    ip_address varchar(32) NOT NULL,
+    kind varchar(8) NOT NULL,
+    port integer NOT NULL,
+    path varchar(128),
+    expect varchar(128),
+    timeout real
+);
+
+CREATE INDEX node_check_ip ON node_check (ip_address);